@@ -1,5 +1,7 @@
 import requests
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 import datetime as dt
 
 from organizations.models import Tenant, Workspace
@@ -11,20 +13,26 @@ from organizations.helpers import (
     get_or_create_default_subscription,
 )
 
+from . import reconcile
+from .fetcher import fetch_all
 from .helpers import (
     fetch_chirpstack_users,
     fetch_tenant_user_mapping,
-    update_existing_user,
-    create_new_user,
-    fetch_device_profiles,
-    update_local_device_profile,
-    create_local_device_profile,
-    fetch_applications,
-    update_local_application,
-    create_local_application,
-    fetch_devices,
-    update_local_device,
-    create_local_device,
+    workspace_cache,
+    api_user_values,
+    new_api_user,
+    fetch_device_profiles_by_tenant,
+    device_profile_values,
+    new_device_profile,
+    fetch_applications_by_tenant,
+    application_values,
+    new_application,
+    fetch_devices_by_application,
+    device_profile_ids,
+    device_values,
+    get_default_type,
+    get_default_machine,
+    new_device,
 )
 
 from loguru import logger
@@ -264,54 +272,57 @@ def sync_tenant_destroy(tenant):
     return response
 
 
-def get_tenant_from_chirpstack():
-    local_instances = Tenant.objects.all()
+def fetch_remote_tenants():
+    """All tenants in Chirpstack, as (results, response)."""
+    results, response = fetch_all(CHIRPSTACK_TENANT_URL, HEADERS)
+    if response.status_code != 200:
+        results = []
+    return results, response
 
-    list_response = requests.get(
-        CHIRPSTACK_TENANT_URL, headers=HEADERS, params={"limit": 100}
+
+def get_tenant_from_chirpstack(remote=None):
+    """
+    Sync tenants from Chirpstack to the local DB, matching them by name.
+    `remote` is an already fetched (results, response) from
+    fetch_remote_tenants.
+    """
+    cs_instance_list, list_response = remote or fetch_remote_tenants()
+
+    local = {t.name: t for t in Tenant.objects.all()}
+    changes = reconcile.diff(
+        local,
+        {t["name"]: t for t in cs_instance_list},
+        lambda match, instance: {"cs_tenant_id": match["id"], **reconcile.SYNCED},
     )
-    if list_response.status_code == 200:
-        cs_instance_list = list_response.json().get("result", [])
-    else:
-        cs_instance_list = []
 
-    to_remove_ids = []
-    for instance in local_instances:
-        match = next((t for t in cs_instance_list if t["name"] == instance.name), None)
-        if match:
-            to_remove_ids.append(match["id"])
-            if instance.cs_tenant_id != match["id"]:
-                instance.cs_tenant_id = match["id"]
-            instance.sync_status = "SYNCED"
-            instance.sync_error = ""
-            instance.last_synced_at = dt.datetime.now()
-            instance.save()
-            logger.debug(
-                f"Tenant {instance.cs_tenant_id} - {instance.name} has been synced with Chirpstack"
+    # New tenants are bulk created with the updates; each one then gets its
+    # default workspace (with permissions) in the same transaction.
+    new_tenants = []
+    if changes.create:
+        subscription = get_or_create_default_subscription()
+        new_tenants = [
+            Tenant(
+                cs_tenant_id=new_instance["id"],
+                name=new_instance["name"],
+                description=new_instance.get(
+                    "description", f"{new_instance['name']}: synced tenant"
+                ),
+                subscription=subscription,
+                sync_status="SYNCED",
+                sync_error="",
             )
+            for new_instance in changes.create
+        ]
 
-    # remover los que ya están sincronizados, por id
-    cs_instance_list = [t for t in cs_instance_list if t["id"] not in to_remove_ids]
+    with transaction.atomic():
+        reconcile.apply(Tenant, changes.update, new_tenants)
+        for new_tenant in new_tenants:
+            workspace = get_or_create_default_workspace(new_tenant)
+            logger.debug(
+                f"Tenant {new_tenant.cs_tenant_id} - {new_tenant.name} with its default workspace {workspace.id} has been created from Chirpstack"
+            )
 
-    # crear los que faltan en local
-    for new_instance in cs_instance_list:
-        subscription = get_or_create_default_subscription()
-        new_tenant = Tenant(
-            cs_tenant_id=new_instance["id"],
-            name=new_instance["name"],
-            description=new_instance.get(
-                "description", f"{new_instance['name']}: synced tenant"
-            ),
-            subscription=subscription,
-            sync_status="SYNCED",
-            sync_error="",
-            last_synced_at=dt.datetime.now(),
-        )
-        new_tenant.save()
-        workspace = get_or_create_default_workspace(new_tenant)
-        logger.debug(
-            f"Tenant {new_tenant.cs_tenant_id} - {new_tenant.name} with its default workspace {workspace.id} has been created from Chirpstack"
-        )
+    logger.info(f"Tenants synced from Chirpstack: {changes}")
     return list_response
 
 
@@ -354,13 +365,12 @@ def create_gateway_in_chirpstack(gateway):
 
 
 def sync_gateway_status(gateway):
-    response = requests.get(
+    results, response = fetch_all(
         CHIRPSTACK_GATEWAYS_URL,
-        headers=HEADERS,
-        params={"tenantId": gateway.workspace.tenant.cs_tenant_id, "limit": 100},
+        HEADERS,
+        params={"tenantId": gateway.workspace.tenant.cs_tenant_id},
     )
     if response and response.status_code == 200:
-        results = response.json().get("result", [])
         match = next(
             (g for g in results if g["gatewayId"] == gateway.cs_gateway_id), None
         )
@@ -443,78 +453,82 @@ def sync_gateway_destroy(gateway):
     return None
 
 
-def get_gateway_from_chirpstack():
-    local_instances = Gateway.objects.all()
-    list_response = requests.get(
-        CHIRPSTACK_GATEWAYS_URL, headers=HEADERS, params={"limit": 100}
-    )
+def fetch_remote_gateways():
+    """All gateways in Chirpstack, as (results, response)."""
+    results, response = fetch_all(CHIRPSTACK_GATEWAYS_URL, HEADERS)
+    if response.status_code != 200:
+        results = []
+    return results, response
 
-    if list_response.status_code == 200:
-        results = list_response.json().get("result", [])
-        to_remove = []
 
-        for item in results:
-            match = next(
-                (g for g in local_instances if g.cs_gateway_id == item["gatewayId"]),
-                None,
+def get_gateway_from_chirpstack(remote=None):
+    """
+    Sync gateways from Chirpstack to the local DB. `remote` is an already
+    fetched (results, response) from fetch_remote_gateways.
+    """
+    results, list_response = remote or fetch_remote_gateways()
+
+    if list_response.status_code != 200:
+        logger.error(f"Error fetching gateways from Chirpstack.")
+        return list_response
+
+    changes = reconcile.diff(
+        {g.cs_gateway_id: g for g in Gateway.objects.all()},
+        {g["gatewayId"]: g for g in results},
+        lambda item, gateway: {
+            "state": item.get("state", gateway.state),
+            "last_seen_at": reconcile.parse_timestamp(
+                item.get("lastSeenAt", gateway.last_seen_at)
+            ),
+            **reconcile.SYNCED,
+        },
+    )
+
+    tenants = {
+        t.cs_tenant_id: t for t in Tenant.objects.exclude(cs_tenant_id__isnull=True)
+    }
+    workspace_for = workspace_cache()
+    locations, new_gateways = [], []
+    for new_instance in changes.create:
+        tenant = tenants.get(new_instance.get("tenantId"))
+        if not tenant:
+            logger.warning(
+                f"No tenant found with cs_tenant_id {new_instance.get('tenantId')}. Gateway {new_instance['gatewayId']} was not created."
             )
-            if match:
-                to_remove.append(item)
-                match.state = item.get("state", match.state)
-                match.last_seen_at = item.get("lastSeenAt", match.last_seen_at)
-                match.sync_status = "SYNCED"
-                match.sync_error = ""
-                match.last_synced_at = dt.datetime.now()
-                match.save()
-                logger.debug(
-                    f"Gateway {match.cs_gateway_id} - {match.name} has been synced with Chirpstack"
-                )
-        for match in to_remove:
-            results.remove(match)
-
-        for new_instance in results:
-            tenant = Tenant.objects.filter(
-                cs_tenant_id=new_instance.get("tenantId")
-            ).first()
-            if tenant:
-                workspace = get_or_create_default_workspace(tenant)
-                cs_location = new_instance.get("location", {})
-
-                location = Location(
-                    name=f"{new_instance['name']} Location",
-                    accuracy=cs_location.get("accuracy", 0.0),
-                    altitude=cs_location.get("altitude", 0.0),
-                    latitude=cs_location.get("latitude", 0.0),
-                    longitude=cs_location.get("longitude", 0.0),
-                    source=cs_location.get("source", "UNKNOWN"),
-                )
-                location.save()
-                new_gw = Gateway(
-                    cs_gateway_id=new_instance["gatewayId"],
-                    name=new_instance["name"],
-                    description=new_instance.get("description", ""),
-                    stats_interval=new_instance.get("statsInterval", 0),
-                    state=new_instance.get("state", "unknown"),
-                    last_seen_at=new_instance.get("lastSeenAt", None),
-                    location=location,
-                    workspace=workspace,
-                    sync_status="SYNCED",
-                    sync_error="",
-                    last_synced_at=dt.datetime.now(),
-                )
-                new_gw.save()
-                logger.debug(
-                    f"Gateway {new_gw.cs_gateway_id} - {new_gw.name} has been created from Chirpstack"
-                )
+            continue
 
-            else:
-                logger.warning(
-                    f"No tenant found with cs_tenant_id {new_instance.get('tenantId')}. Gateway {new_instance['gatewayId']} was not created."
-                )
+        cs_location = new_instance.get("location", {})
+        location = Location(
+            name=f"{new_instance['name']} Location",
+            accuracy=cs_location.get("accuracy", 0.0),
+            altitude=cs_location.get("altitude", 0.0),
+            latitude=cs_location.get("latitude", 0.0),
+            longitude=cs_location.get("longitude", 0.0),
+            source=cs_location.get("source", "UNKNOWN"),
+        )
+        locations.append(location)
+        new_gateways.append(
+            Gateway(
+                cs_gateway_id=new_instance["gatewayId"],
+                name=new_instance["name"],
+                description=new_instance.get("description", ""),
+                stats_interval=new_instance.get("statsInterval", 0),
+                state=new_instance.get("state", "unknown"),
+                last_seen_at=reconcile.parse_timestamp(
+                    new_instance.get("lastSeenAt", None)
+                ),
+                location=location,
+                workspace=workspace_for(tenant),
+                sync_status="SYNCED",
+                sync_error="",
+            )
+        )
 
-    else:
-        logger.error(f"Error fetching gateways from Chirpstack.")
+    with transaction.atomic():
+        Location.objects.bulk_create(locations, batch_size=reconcile.BATCH_SIZE)
+        reconcile.apply(Gateway, changes.update, new_gateways)
 
+    logger.info(f"Gateways synced from Chirpstack: {changes}")
     return list_response
 
 
@@ -698,31 +712,50 @@ def sync_api_user_destroy(api_user):
     return response
 
 
-def get_api_user_from_chirpstack():
+def fetch_remote_api_users():
+    """All users in Chirpstack, as (results, response)."""
+    return fetch_chirpstack_users(CHIRPSTACK_API_URL, HEADERS)
+
+
+def get_api_user_from_chirpstack(remote=None):
     """
-    Syncs API users from Chirpstack to the local database.
-    Updates existing users and creates new users when necessary.
+    Syncs API users from Chirpstack to the local database, matching them by
+    email. Updates existing users and creates new users when necessary.
+    `remote` is an already fetched (results, response) from
+    fetch_remote_api_users.
     """
-    local_instances = ApiUser.objects.all()
-
-    users, list_response = fetch_chirpstack_users(CHIRPSTACK_API_URL, HEADERS)
+    users, list_response = remote or fetch_remote_api_users()
 
     user_tenant_mapping = fetch_tenant_user_mapping(
         Tenant.objects.exclude(cs_tenant_id__isnull=True),
         CHIRPSTACK_TENANT_URL,
         HEADERS,
     )
+    workspace_for = workspace_cache()
+
+    local = {u.email: u for u in ApiUser.objects.all()}
+    changes = reconcile.diff(
+        local,
+        {u["email"]: u for u in users},
+        lambda match, instance: api_user_values(
+            match, instance, user_tenant_mapping, workspace_for
+        ),
+    )
 
-    users_by_email = {u["email"]: u for u in users}
-
-    for instance in local_instances:
-        match = users_by_email.get(instance.email)
-        if match:
-            update_existing_user(instance, match, user_tenant_mapping)
-
-    for new_instance in users:
-        create_new_user(new_instance, user_tenant_mapping)
+    known_ids = {u.cs_user_id for u in local.values() if u.cs_user_id}
+    new_users = []
+    for new_instance in changes.create:
+        if new_instance["id"] in known_ids:
+            logger.warning(
+                f"ApiUser {new_instance['id']} already exists, skipping creation"
+            )
+            continue
+        new_users.append(
+            new_api_user(new_instance, user_tenant_mapping, workspace_for)
+        )
 
+    reconcile.apply(ApiUser, changes.update, new_users)
+    logger.info(f"API users synced from Chirpstack: {changes}")
     return list_response
 
 
@@ -967,42 +1000,57 @@ def sync_device_profile_destroy(device_profile):
     return response
 
 
-def get_device_profiles_from_chirpstack():
-    """Sync device profiles from Chirpstack to local DB per tenant."""
-    local_tenants = Tenant.objects.exclude(cs_tenant_id__isnull=True)
+def fetch_remote_device_profiles(tenants=None):
+    """Device profiles of every synced tenant, keyed by tenant id."""
+    if tenants is None:
+        tenants = list(Tenant.objects.exclude(cs_tenant_id__isnull=True))
+    return fetch_device_profiles_by_tenant(
+        tenants, CHIRPSTACK_DEVICE_PROFILE_URL, HEADERS
+    )
+
+
+def get_device_profiles_from_chirpstack(remote=None):
+    """
+    Sync device profiles from Chirpstack to local DB per tenant. `remote` is
+    an already fetched dict from fetch_remote_device_profiles.
+    """
+    local_tenants = list(Tenant.objects.exclude(cs_tenant_id__isnull=True))
+    if remote is None:
+        remote = fetch_remote_device_profiles(local_tenants)
     last_response = None
 
+    workspace_for = workspace_cache()
+    workspaces = {}
+    cs_profiles = {}
     for tenant in local_tenants:
-        workspace = get_or_create_default_workspace(tenant)
+        workspace = workspace_for(tenant)
         if not workspace:
             logger.warning(
                 f"Tenant {tenant.name} does not have an associated workspace. Skipping..."
             )
             continue
 
-        cs_profiles, response = fetch_device_profiles(
-            tenant, CHIRPSTACK_DEVICE_PROFILE_URL, HEADERS
-        )
+        results, response = remote.get(tenant.id, ([], None))
         last_response = response
+        for dp in results:
+            cs_profiles[dp["id"]] = dp
+            workspaces[dp["id"]] = workspace
+
+    local = {
+        dp.cs_device_profile_id: dp
+        for dp in DeviceProfile.objects.filter(
+            Q(workspace__in=set(workspaces.values()))
+            | Q(cs_device_profile_id__in=list(cs_profiles))
+        )
+    }
+    changes = reconcile.diff(local, cs_profiles, device_profile_values)
 
-        local_profiles = DeviceProfile.objects.filter(workspace=workspace)
-        to_remove = []
-
-        for local_dp in local_profiles:
-            match = next(
-                (dp for dp in cs_profiles if dp["id"] == local_dp.cs_device_profile_id),
-                None,
-            )
-            if match:
-                to_remove.append(match)
-                update_local_device_profile(local_dp, match, workspace)
-
-        for match in to_remove:
-            cs_profiles.remove(match)
-
-        for new_dp in cs_profiles:
-            create_local_device_profile(new_dp, workspace)
-
+    reconcile.apply(
+        DeviceProfile,
+        changes.update,
+        [new_device_profile(dp, workspaces[dp["id"]]) for dp in changes.create],
+    )
+    logger.info(f"Device profiles synced from Chirpstack: {changes}")
     return last_response
 
 
@@ -1142,36 +1190,49 @@ def sync_application_destroy(application):
     return response
 
 
-def get_applications_from_chirpstack():
-    """Sync applications from Chirpstack to local DB per tenant."""
-    local_tenants = Tenant.objects.exclude(cs_tenant_id__isnull=True)
+def fetch_remote_applications(tenants=None):
+    """Applications of every synced tenant, keyed by tenant id."""
+    if tenants is None:
+        tenants = list(Tenant.objects.exclude(cs_tenant_id__isnull=True))
+    return fetch_applications_by_tenant(tenants, CHIRPSTACK_APPLICATION_URL, HEADERS)
+
+
+def get_applications_from_chirpstack(remote=None):
+    """
+    Sync applications from Chirpstack to local DB per tenant. `remote` is an
+    already fetched dict from fetch_remote_applications.
+    """
+    local_tenants = list(Tenant.objects.exclude(cs_tenant_id__isnull=True))
+    if remote is None:
+        remote = fetch_remote_applications(local_tenants)
     last_response = None
 
+    workspace_for = workspace_cache()
+    workspaces = {}
+    cs_apps = {}
     for tenant in local_tenants:
-        workspace = get_or_create_default_workspace(tenant)
-
-        cs_apps, response = fetch_applications(
-            tenant, CHIRPSTACK_APPLICATION_URL, HEADERS
-        )
+        workspace = workspace_for(tenant)
+        results, response = remote.get(tenant.id, ([], None))
         last_response = response
+        for app in results:
+            cs_apps[app["id"]] = app
+            workspaces[app["id"]] = workspace
+
+    local = {
+        app.cs_application_id: app
+        for app in Application.objects.filter(
+            Q(workspace__in=set(workspaces.values()))
+            | Q(cs_application_id__in=list(cs_apps))
+        )
+    }
+    changes = reconcile.diff(local, cs_apps, application_values)
 
-        local_apps = Application.objects.filter(workspace=workspace)
-        to_remove = []
-
-        for local_app in local_apps:
-            match = next(
-                (a for a in cs_apps if a["id"] == local_app.cs_application_id), None
-            )
-            if match:
-                to_remove.append(match)
-                update_local_application(local_app, match)
-
-        for match in to_remove:
-            cs_apps.remove(match)
-
-        for new_app in cs_apps:
-            create_local_application(new_app, workspace)
-
+    reconcile.apply(
+        Application,
+        changes.update,
+        [new_application(app, workspaces[app["id"]]) for app in changes.create],
+    )
+    logger.info(f"Applications synced from Chirpstack: {changes}")
     return last_response
 
 
@@ -1350,31 +1411,72 @@ def device_activation_status(device):
     return status
 
 
-def get_devices_from_chirpstack():
-    """Sync devices from Chirpstack to local DB per application."""
-    local_apps = Application.objects.exclude(cs_application_id__isnull=True)
+def fetch_remote_devices(apps=None):
+    """Devices of every synced application, keyed by application id."""
+    if apps is None:
+        apps = list(Application.objects.exclude(cs_application_id__isnull=True))
+    return fetch_devices_by_application(apps, CHIRPSTACK_DEVICE_URL, HEADERS)
+
+
+def get_devices_from_chirpstack(remote=None):
+    """
+    Sync devices from Chirpstack to local DB per application. `remote` is an
+    already fetched dict from fetch_remote_devices.
+    """
+    local_apps = list(
+        Application.objects.exclude(cs_application_id__isnull=True).select_related(
+            "workspace"
+        )
+    )
+    if remote is None:
+        remote = fetch_remote_devices(local_apps)
     last_response = None
 
+    cs_devices = {}
+    apps = {}
     for app in local_apps:
-        workspace = app.workspace
-        cs_devices, response = fetch_devices(app, CHIRPSTACK_DEVICE_URL, HEADERS)
+        results, response = remote.get(app.id, ([], None))
         last_response = response
+        for dev in results:
+            dev_eui = dev["devEui"].lower()
+            cs_devices[dev_eui] = dev
+            apps[dev_eui] = app
+
+    local = {
+        dev.dev_eui.lower(): dev
+        for dev in Device.objects.filter(
+            Q(application__in=local_apps) | Q(dev_eui__in=list(cs_devices))
+        )
+    }
+    profile_ids = device_profile_ids()
+    changes = reconcile.diff(
+        local,
+        cs_devices,
+        lambda match, dev: device_values(match, dev, profile_ids),
+    )
 
-        local_devices = Device.objects.filter(application=app)
-        to_remove = []
-
-        for local_dev in local_devices:
-            match = next(
-                (d for d in cs_devices if d["devEui"] == local_dev.dev_eui), None
+    new_devices = []
+    if changes.create:
+        first_app = apps[changes.create[0]["devEui"].lower()]
+        device_type = get_default_type()
+        machine = get_default_machine(first_app.workspace)
+        for new_dev in changes.create:
+            profile_id = profile_ids.get(new_dev.get("deviceProfileId"))
+            if not profile_id:
+                logger.warning(
+                    f"DeviceProfile {new_dev.get('deviceProfileId')} not found. Device {new_dev['devEui']} was not created."
+                )
+                continue
+            new_devices.append(
+                new_device(
+                    new_dev,
+                    apps[new_dev["devEui"].lower()],
+                    profile_id,
+                    device_type,
+                    machine,
+                )
             )
-            if match:
-                to_remove.append(match)
-                update_local_device(local_dev, match)
-
-        for match in to_remove:
-            cs_devices.remove(match)
-
-        for new_dev in cs_devices:
-            create_local_device(new_dev, app, workspace)
 
+    reconcile.apply(Device, changes.update, new_devices)
+    logger.info(f"Devices synced from Chirpstack: {changes}")
     return last_response
@@ -0,0 +1,133 @@
+"""
+Paginated, concurrent reads from the ChirpStack REST API.
+
+ChirpStack list endpoints return at most `limit` items per call together
+with a `totalCount`, so a single request silently truncates large tenants.
+fetch_all walks every page; fetch_concurrently runs many list calls (one per
+tenant or application) in a thread pool, and get_concurrently does the same
+for single-object GETs. All requests share one keep-alive
+session and at most CHIRPSTACK_SYNC_CONCURRENCY are in flight at a time.
+
+Only HTTP happens in worker threads; callers reconcile the results with the
+database on their own thread.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+PAGE_SIZE = 100
+REQUEST_TIMEOUT = 30
+
+_session = None
+_session_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings.CHIRPSTACK_SYNC_CONCURRENCY)
+
+
+def get_session():
+    """Shared session, pooled to CHIRPSTACK_SYNC_CONCURRENCY connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=settings.CHIRPSTACK_SYNC_CONCURRENCY,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=["GET"],
+                ),
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def _get(url, headers, params):
+    with _slots:
+        return get_session().get(
+            url, headers=headers, params=params, timeout=REQUEST_TIMEOUT
+        )
+
+
+def fetch_all(url, headers, params=None):
+    """
+    Fetch every page of a ChirpStack list endpoint.
+
+    Returns (results, response), where response is the last response
+    received. If a page fails, the results gathered so far are returned with
+    the failing response, so callers can check `response.status_code`.
+    """
+    params = dict(params or {})
+    results = []
+    offset = 0
+
+    while True:
+        response = _get(url, headers, {**params, "limit": PAGE_SIZE, "offset": offset})
+        if response.status_code != 200:
+            logger.error(
+                f"Error fetching {url} (offset {offset}): {response.status_code} {response.text}"
+            )
+            return results, response
+
+        body = response.json()
+        page = body.get("result", [])
+        results.extend(page)
+        offset += len(page)
+
+        total = int(body.get("totalCount") or 0)
+        if not page or len(page) < PAGE_SIZE or offset >= total:
+            return results, response
+
+
+def fetch_concurrently(calls, headers):
+    """
+    Run fetch_all for many list calls in parallel.
+
+    `calls` maps a key (e.g. a tenant id) to (url, params). Returns a dict
+    mapping each key to its (results, response). A call that raises is
+    logged and mapped to ([], None).
+    """
+    if not calls:
+        return {}
+
+    def run(item):
+        key, (url, params) = item
+        try:
+            return key, fetch_all(url, headers, params)
+        except requests.RequestException as e:
+            logger.error(f"Error fetching {url} with {params}: {e}")
+            return key, ([], None)
+
+    workers = min(len(calls), settings.CHIRPSTACK_SYNC_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(run, calls.items()))
+
+
+def get_concurrently(urls, headers):
+    """
+    GET many single-object URLs in parallel. `urls` maps a key to a URL;
+    returns a dict mapping each key to its response, or None if it raised.
+    """
+    if not urls:
+        return {}
+
+    def run(item):
+        key, url = item
+        try:
+            return key, _get(url, headers, None)
+        except requests.RequestException as e:
+            logger.error(f"Error fetching {url}: {e}")
+            return key, None
+
+    workers = min(len(urls), settings.CHIRPSTACK_SYNC_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(run, urls.items()))
@@ -1,35 +1,41 @@
-import datetime as dt
 from loguru import logger
-import requests
+from .fetcher import fetch_all, fetch_concurrently
 from .models import ApiUser, DeviceProfile
+from .reconcile import SYNCED, parse_timestamp
 from organizations.helpers import get_or_create_default_workspace, get_global_tenant
 from infrastructure.models import Application, Type, Machine, Device
 from django.conf import settings
 
 
+def _ok(results, response):
+    """Results of a fetch, or [] if any page of it failed."""
+    if response is not None and response.status_code == 200:
+        return results, response
+    return [], response
+
+
 def fetch_chirpstack_users(api_url, headers):
     """Fetch global users from Chirpstack API."""
-    response = requests.get(api_url, headers=headers, params={"limit": 100})
-    if response and response.status_code == 200:
-        return response.json().get("result", []), response
-    return [], response
+    return _ok(*fetch_all(api_url, headers))
 
 
 def fetch_tenant_user_mapping(tenants, tenant_url, headers):
     """Map Chirpstack user IDs to their tenants and roles."""
+    tenants = {t.id: t for t in tenants if t.cs_tenant_id}
+    fetched = fetch_concurrently(
+        {
+            tenant_id: (f"{tenant_url}/{tenant.cs_tenant_id}/users", None)
+            for tenant_id, tenant in tenants.items()
+        },
+        headers,
+    )
+
     mapping = {}
-    for tenant in tenants:
-        if not tenant.cs_tenant_id:
-            continue
-        resp = requests.get(
-            f"{tenant_url}/{tenant.cs_tenant_id}/users",
-            headers=headers,
-            params={"limit": 100},
-        )
-        if resp.status_code != 200:
+    for tenant_id, tenant in tenants.items():
+        tenant_users, resp = _ok(*fetched[tenant_id])
+        if resp is None or resp.status_code != 200:
             continue
 
-        tenant_users = resp.json().get("result", [])
         for tu in tenant_users:
             uid = tu["userId"]
             mapping.setdefault(uid, []).append(
@@ -43,52 +49,53 @@ def fetch_tenant_user_mapping(tenants, tenant_url, headers):
     return mapping
 
 
-def resolve_workspace_for_user(user_id, user_tenant_mapping):
+def workspace_cache():
+    """
+    get_or_create_default_workspace memoized for one reconciliation pass.
+    Passing None resolves the global tenant's workspace.
+    """
+    cache = {}
+
+    def get(tenant):
+        key = tenant.id if tenant else None
+        if key not in cache:
+            cache[key] = get_or_create_default_workspace(tenant or get_global_tenant())
+        return cache[key]
+
+    return get
+
+
+def resolve_workspace_for_user(user_id, user_tenant_mapping, workspace_for):
     """Ensure user always has a workspace. Falls back to 'emasa tenant' if none."""
     tenant_info_list = user_tenant_mapping.get(user_id, [])
-    if tenant_info_list:
-        tenant = tenant_info_list[0]["tenant"]
-    else:
-        tenant = get_global_tenant()
-    return get_or_create_default_workspace(tenant), tenant_info_list
-
-
-def update_existing_user(instance, match, user_tenant_mapping):
-    """Update fields for an existing ApiUser instance from Chirpstack data."""
-    instance.cs_user_id = match["id"]
-    instance.is_active = match.get("isActive", instance.is_active)
-    instance.is_admin = match.get("isAdmin", instance.is_admin)
-    instance.note = match.get("note", instance.note)
-    instance.sync_status = "SYNCED"
-    instance.sync_error = ""
-    instance.last_synced_at = dt.datetime.now()
+    tenant = tenant_info_list[0]["tenant"] if tenant_info_list else None
+    return workspace_for(tenant), tenant_info_list
+
 
+def api_user_values(match, instance, user_tenant_mapping, workspace_for):
+    """Field values of an existing ApiUser according to Chirpstack data."""
     workspace, tenant_info_list = resolve_workspace_for_user(
-        match["id"], user_tenant_mapping
+        match["id"], user_tenant_mapping, workspace_for
     )
-    instance.workspace = workspace
+    values = {
+        "cs_user_id": match["id"],
+        "is_active": match.get("isActive", instance.is_active),
+        "is_admin": match.get("isAdmin", instance.is_admin),
+        "note": match.get("note", instance.note),
+        "workspace_id": workspace.id,
+        **SYNCED,
+    }
     if tenant_info_list:
-        instance.is_tenant_admin = tenant_info_list[0]["isAdmin"]
+        values["is_tenant_admin"] = tenant_info_list[0]["isAdmin"]
+    return values
 
-    instance.save()
-
-
-def create_new_user(new_instance, user_tenant_mapping):
-    """Create a new ApiUser in local DB from Chirpstack data."""
-    if ApiUser.objects.filter(email=new_instance["email"]).exists():
-        return None
 
+def new_api_user(new_instance, user_tenant_mapping, workspace_for):
+    """Unsaved ApiUser built from Chirpstack data."""
     workspace, tenant_info_list = resolve_workspace_for_user(
-        new_instance["id"], user_tenant_mapping
+        new_instance["id"], user_tenant_mapping, workspace_for
     )
 
-    exists = ApiUser.objects.filter(cs_user_id=new_instance["id"]).exists()
-    if exists:
-        logger.warning(
-            f"ApiUser {new_instance['id']} already exists, skipping creation"
-        )
-        return None
-
     api_user = ApiUser(
         email=new_instance["email"],
         cs_user_id=new_instance["id"],
@@ -99,7 +106,6 @@ def create_new_user(new_instance, user_tenant_mapping):
         password="",
         sync_error="Please set a new password and assign this user to a desired workspace",
         sync_status="SYNCED",
-        last_synced_at=dt.datetime.now(),
     )
 
     if tenant_info_list:
@@ -107,66 +113,81 @@ def create_new_user(new_instance, user_tenant_mapping):
         api_user.is_tenant_device_admin = tenant_info_list[0]["isDeviceAdmin"]
         api_user.is_tenant_gateway_admin = tenant_info_list[0]["isGatewayAdmin"]
 
-    api_user.save()
     return api_user
 
 
-def fetch_device_profiles(tenant, device_profile_url, headers):
-    """Fetch device profiles for a tenant from Chirpstack."""
-    response = requests.get(
-        device_profile_url,
-        headers=headers,
-        params={"limit": 100, "tenantId": tenant.cs_tenant_id},
-    )
-    if response.status_code != 200:
-        logger.error(f"Error fetching device profiles for tenant {tenant.cs_tenant_id}")
-        return [], response
-    return response.json().get("result", []), response
-
-
-def update_local_device_profile(local_dp, match, workspace):
-    """Update fields for a local DeviceProfile based on Chirpstack data."""
-    local_dp.name = match.get("name", local_dp.name)
-    local_dp.description = match.get("description", local_dp.description)
-    local_dp.region = match.get("region", local_dp.region)
-    local_dp.adr_algorithm_id = match.get("adrAlgorithmId", local_dp.adr_algorithm_id)
-    local_dp.mac_version = match.get("macVersion", local_dp.mac_version)
-    local_dp.reg_param_revision = match.get(
-        "regParamsRevision", local_dp.reg_param_revision
-    )
-    local_dp.supports_otaa = match.get("supportsOtaa", local_dp.supports_otaa)
-    local_dp.supports_class_b = match.get("supportsClassB", local_dp.supports_class_b)
-    local_dp.supports_class_c = match.get("supportsClassC", local_dp.supports_class_c)
-    local_dp.abp_rx1_delay = match.get("abpRx1Delay", local_dp.abp_rx1_delay)
-    local_dp.abp_rx1_dr_offset = match.get("abpRx1DrOffset", local_dp.abp_rx1_dr_offset)
-    local_dp.abp_rx2_dr = match.get("abpRx2Dr", local_dp.abp_rx2_dr)
-    local_dp.abp_rx2_freq = match.get("abpRx2Freq", local_dp.abp_rx2_freq)
-    local_dp.is_rlay = match.get("isRelay", local_dp.is_rlay)
-    local_dp.is_rlay_ed = match.get("isRelayEd", local_dp.is_rlay_ed)
-    local_dp.flush_queue_on_activate = match.get(
-        "flushQueueOnActivate", local_dp.flush_queue_on_activate
-    )
-    local_dp.uplink_interval = match.get("uplinkInterval", local_dp.uplink_interval)
-    local_dp.workspace = workspace
-    local_dp.sync_status = "SYNCED"
-    local_dp.sync_error = ""
-    local_dp.last_synced_at = dt.datetime.now()
-    local_dp.save()
-    logger.debug(
-        f"DeviceProfile {local_dp.cs_device_profile_id} - {local_dp.name} updated"
+def fetch_gateways_by_tenant(tenants, gateway_url, headers):
+    """Fetch the gateways of many tenants concurrently, keyed by tenant id."""
+    fetched = fetch_concurrently(
+        {t.id: (gateway_url, {"tenantId": t.cs_tenant_id}) for t in tenants},
+        headers,
     )
+    for tenant in tenants:
+        results, response = _ok(*fetched[tenant.id])
+        if response is None or response.status_code != 200:
+            logger.error(f"Error fetching gateways for tenant {tenant.cs_tenant_id}")
+        fetched[tenant.id] = (results, response)
+    return fetched
 
 
-def create_local_device_profile(new_dp, workspace):
-    """Create a new DeviceProfile in local DB from Chirpstack data."""
-    exists = DeviceProfile.objects.filter(cs_device_profile_id=new_dp["id"]).exists()
-    if exists:
-        logger.warning(
-            f"DeviceProfile {new_dp['id']} already exists, skipping creation"
-        )
-        return None
+def fetch_device_profiles(tenant, device_profile_url, headers):
+    """Fetch device profiles for a tenant from Chirpstack."""
+    return fetch_device_profiles_by_tenant([tenant], device_profile_url, headers)[
+        tenant.id
+    ]
+
 
-    dp = DeviceProfile(
+def fetch_device_profiles_by_tenant(tenants, device_profile_url, headers):
+    """Fetch the device profiles of many tenants concurrently, keyed by tenant id."""
+    fetched = fetch_concurrently(
+        {t.id: (device_profile_url, {"tenantId": t.cs_tenant_id}) for t in tenants},
+        headers,
+    )
+    for tenant in tenants:
+        results, response = _ok(*fetched[tenant.id])
+        if response is None or response.status_code != 200:
+            logger.error(
+                f"Error fetching device profiles for tenant {tenant.cs_tenant_id}"
+            )
+        fetched[tenant.id] = (results, response)
+    return fetched
+
+
+# Chirpstack field -> DeviceProfile attribute, for fields updated on sync
+DEVICE_PROFILE_FIELDS = {
+    "name": "name",
+    "description": "description",
+    "region": "region",
+    "adrAlgorithmId": "adr_algorithm_id",
+    "macVersion": "mac_version",
+    "regParamsRevision": "reg_param_revision",
+    "supportsOtaa": "supports_otaa",
+    "supportsClassB": "supports_class_b",
+    "supportsClassC": "supports_class_c",
+    "abpRx1Delay": "abp_rx1_delay",
+    "abpRx1DrOffset": "abp_rx1_dr_offset",
+    "abpRx2Dr": "abp_rx2_dr",
+    "abpRx2Freq": "abp_rx2_freq",
+    "isRelay": "is_rlay",
+    "isRelayEd": "is_rlay_ed",
+    "flushQueueOnActivate": "flush_queue_on_activate",
+    "uplinkInterval": "uplink_interval",
+}
+
+
+def device_profile_values(match, local_dp):
+    """Field values of a local DeviceProfile according to Chirpstack data."""
+    values = {
+        attr: match.get(key, getattr(local_dp, attr))
+        for key, attr in DEVICE_PROFILE_FIELDS.items()
+    }
+    values.update(SYNCED)
+    return values
+
+
+def new_device_profile(new_dp, workspace):
+    """Unsaved DeviceProfile built from Chirpstack data."""
+    return DeviceProfile(
         cs_device_profile_id=new_dp["id"],
         name=new_dp["name"],
         description="Imported from Chirpstack",
@@ -188,81 +209,70 @@ def create_local_device_profile(new_dp, workspace):
         supports_class_c=new_dp.get("supportsClassC", False),
         sync_status="SYNCED",
         sync_error="",
-        last_synced_at=dt.datetime.now(),
-    )
-    dp.save()
-    logger.debug(
-        f"DeviceProfile {dp.cs_device_profile_id} - {dp.name} created from Chirpstack"
     )
-    return dp
 
 
 def fetch_applications(tenant, application_url, headers):
     """Fetch applications for a tenant from Chirpstack."""
-    response = requests.get(
-        application_url,
-        headers=headers,
-        params={"limit": 100, "tenantId": tenant.cs_tenant_id},
-    )
-    if response.status_code != 200:
-        logger.error(f"Error fetching applications for tenant {tenant.cs_tenant_id}")
-        return [], response
-    return response.json().get("result", []), response
-
-
-def update_local_application(local_app, match):
-    """Update an existing local Application with Chirpstack data."""
-    local_app.name = match.get("name", local_app.name)
-    local_app.description = match.get("description", local_app.description)
-    local_app.sync_status = "SYNCED"
-    local_app.sync_error = ""
-    local_app.last_synced_at = dt.datetime.now()
-    local_app.save()
-    logger.debug(
-        f"Application {local_app.cs_application_id} - {local_app.name} updated"
+    return fetch_applications_by_tenant([tenant], application_url, headers)[tenant.id]
+
+
+def fetch_applications_by_tenant(tenants, application_url, headers):
+    """Fetch the applications of many tenants concurrently, keyed by tenant id."""
+    fetched = fetch_concurrently(
+        {t.id: (application_url, {"tenantId": t.cs_tenant_id}) for t in tenants},
+        headers,
     )
+    for tenant in tenants:
+        results, response = _ok(*fetched[tenant.id])
+        if response is None or response.status_code != 200:
+            logger.error(
+                f"Error fetching applications for tenant {tenant.cs_tenant_id}"
+            )
+        fetched[tenant.id] = (results, response)
+    return fetched
 
 
-def create_local_application(new_app, workspace):
-    """Create a new Application in the local DB from Chirpstack data."""
-    exists = Application.objects.filter(cs_application_id=new_app["id"]).exists()
-    if exists:
-        logger.warning(f"Application {new_app['id']} already exists, skipping creation")
-        return None
+def application_values(match, local_app):
+    """Field values of a local Application according to Chirpstack data."""
+    return {
+        "name": match.get("name", local_app.name),
+        "description": match.get("description", local_app.description),
+        **SYNCED,
+    }
 
-    default_type = Type.objects.filter(name="Generic").first()
-    if not default_type:
-        default_type = Type.objects.create(
-            name="Generic", description="Generic device type"
-        )
 
-    app = Application(
+def new_application(new_app, workspace):
+    """Unsaved Application built from Chirpstack data."""
+    return Application(
         cs_application_id=new_app["id"],
         name=new_app.get("name", ""),
         description=new_app.get("description", ""),
         workspace=workspace,
         sync_status="SYNCED",
         sync_error="",
-        last_synced_at=dt.datetime.now(),
     )
-    app.save()
-    logger.debug(
-        f"Application {app.cs_application_id} - {app.name} created from Chirpstack"
-    )
-    return app
 
 
 def fetch_devices(app, device_url, headers):
     """Fetch devices for a given application from Chirpstack."""
-    response = requests.get(
-        device_url,
-        headers=headers,
-        params={"limit": 100, "applicationId": app.cs_application_id},
+    return fetch_devices_by_application([app], device_url, headers)[app.id]
+
+
+def fetch_devices_by_application(apps, device_url, headers):
+    """Fetch the devices of many applications concurrently, keyed by app id."""
+    fetched = fetch_concurrently(
+        {a.id: (device_url, {"applicationId": a.cs_application_id}) for a in apps},
+        headers,
     )
-    if response.status_code != 200:
-        logger.error(f"Error fetching devices for application {app.cs_application_id}")
-        return [], response
-    return response.json().get("result", []), response
+    for app in apps:
+        results, response = _ok(*fetched[app.id])
+        if response is None or response.status_code != 200:
+            logger.error(
+                f"Error fetching devices for application {app.cs_application_id}"
+            )
+        fetched[app.id] = (results, response)
+    return fetched
 
 
 def get_device_profile(profile_id):
@@ -274,41 +284,38 @@ def get_device_profile(profile_id):
         return None
 
 
-def update_local_device(local_dev, match):
-    """Update an existing local Device with Chirpstack data."""
-    dp = DeviceProfile.objects.filter(
-        cs_device_profile_id=match["deviceProfileId"]
-    ).first()
-
-    local_dev.name = match.get("name", local_dev.name)
-    local_dev.description = match.get("description", local_dev.description)
-    local_dev.device_profile = dp if dp else local_dev.device_profile
-    local_dev.last_seen_at = match.get("lastSeenAt")
-    local_dev.sync_status = "SYNCED"
-    local_dev.sync_error = ""
-    local_dev.last_synced_at = dt.datetime.now()
-    local_dev.save()
-    logger.debug(f"Device {local_dev.dev_eui} updated")
-
+def device_profile_ids():
+    """Map Chirpstack device profile ids to local DeviceProfile ids."""
+    return dict(
+        DeviceProfile.objects.exclude(cs_device_profile_id__isnull=True).values_list(
+            "cs_device_profile_id", "id"
+        )
+    )
 
-def create_local_device(new_dev, app, workspace):
-    """Create a new Device in the local DB from Chirpstack data."""
-    exists = Device.objects.filter(dev_eui=new_dev["devEui"].lower()).exists()
 
-    if exists:
-        logger.warning(f"Device {new_dev['devEui']} already exists, skipping creation")
-        return None
+def device_values(match, local_dev, profile_ids):
+    """Field values of a local Device according to Chirpstack data."""
+    return {
+        "name": match.get("name", local_dev.name),
+        "description": match.get("description", local_dev.description),
+        "device_profile_id": profile_ids.get(
+            match.get("deviceProfileId"), local_dev.device_profile_id
+        ),
+        "last_seen_at": parse_timestamp(match.get("lastSeenAt")),
+        **SYNCED,
+    }
 
-    dp = DeviceProfile.objects.filter(
-        cs_device_profile_id=new_dev["deviceProfileId"]
-    ).first()
 
+def get_default_type():
     default_type = Type.objects.filter(name="Generic").first()
     if not default_type:
         default_type = Type.objects.create(
             name="Generic", description="Generic device type"
         )
+    return default_type
 
+
+def get_default_machine(workspace):
     default_machine = Machine.objects.filter(name="Generic Machine").first()
     if not default_machine:
         default_machine = Machine.objects.create(
@@ -316,22 +323,23 @@ def create_local_device(new_dev, app, workspace):
             workspace=workspace,
             description="Default machine",
         )
+    return default_machine
+
 
-    dev = Device(
-        dev_eui=new_dev["devEui"],
+def new_device(new_dev, app, profile_id, device_type, machine):
+    """Unsaved Device built from Chirpstack data."""
+    return Device(
+        # Device.save() lowercases dev_eui, but bulk_create skips save()
+        dev_eui=new_dev["devEui"].lower(),
         name=new_dev.get("name", ""),
         description=new_dev.get("description", ""),
         application=app,
-        workspace=workspace,
-        machine=default_machine,
-        device_type=default_type,
-        device_profile=dp,
+        workspace=app.workspace,
+        machine=machine,
+        device_type=device_type,
+        device_profile_id=profile_id,
         is_disabled=False,
-        last_seen_at=new_dev.get("lastSeenAt"),
+        last_seen_at=parse_timestamp(new_dev.get("lastSeenAt")),
         sync_status="SYNCED",
         sync_error="",
-        last_synced_at=dt.datetime.now(),
     )
-    dev.save()
-    logger.debug(f"Device {dev.dev_eui} - {dev.name} created from Chirpstack")
-    return dev
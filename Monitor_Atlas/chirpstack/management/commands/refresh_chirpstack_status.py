@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chirpstack.status import run_refresher
+
+
+class Command(BaseCommand):
+    help = "Keep device and gateway status (last seen, state, disabled) in sync with ChirpStack."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refresh once and exit.",
+        )
+
+    def handle(self, *args, **options):
+        run_refresher(once=options["once"])
@@ -6,6 +6,12 @@ from chirpstack.chirpstack_api import (
     sync_api_user_get,
     sync_application_get,
     sync_device_profile_get,
+    fetch_remote_api_users,
+    fetch_remote_applications,
+    fetch_remote_device_profiles,
+    fetch_remote_devices,
+    fetch_remote_gateways,
+    fetch_remote_tenants,
     get_api_user_from_chirpstack,
     get_tenant_from_chirpstack,
     get_device_profiles_from_chirpstack,
@@ -16,10 +22,10 @@ from chirpstack.chirpstack_api import (
 
 from infrastructure.models import Device, Gateway, Application
 from chirpstack.models import ApiUser, DeviceProfile
-from organizations.models import Workspace, Tenant
+from organizations.models import Tenant
 from django.core.management.base import BaseCommand
-from django.apps import apps
 from django.db import transaction
+from django.utils import timezone
 from loguru import logger
 
 
@@ -66,167 +72,166 @@ class Command(BaseCommand):
             self.style.SUCCESS("✅ Initial synchronization with ChirpStack complete.")
         )
 
-    def sync_tenants(self):
-        self.stdout.write(self.style.HTTP_INFO("Synchronizing Tenants..."))
-        for tenant in Tenant.objects.all():
+    def push_missing(self, label, queryset, remote_ids, id_of, sync_get, name_of):
+        """
+        Make sure every local object exists in ChirpStack. Objects already in
+        the fetched remote list are marked synced in one update; only the
+        missing ones go through their per-object sync (which creates them).
+
+        Returns the number of objects that had to be pushed.
+        """
+        present, missing = [], []
+        for obj in queryset:
+            (present if id_of(obj) in remote_ids else missing).append(obj)
+
+        queryset.model.objects.filter(pk__in=[o.pk for o in present]).update(
+            sync_status="SYNCED", sync_error="", last_synced_at=timezone.now()
+        )
+        if present:
+            self.stdout.write(
+                self.style.SUCCESS(f"✔ {len(present)} {label}s already in ChirpStack.")
+            )
+
+        for obj in missing:
             try:
-                sync_tenant_get(tenant)
+                sync_get(obj)
                 self.stdout.write(
-                    self.style.SUCCESS(f"✔ Tenant {tenant.name} synchronized.")
+                    self.style.SUCCESS(f"✔ {label} {name_of(obj)} synchronized.")
                 )
             except Exception as e:
                 logger.exception(e)
                 self.stdout.write(
-                    self.style.ERROR(f"✘ Error synchronizing Tenant {tenant.name}: {e}")
+                    self.style.ERROR(
+                        f"✘ Error synchronizing {label} {name_of(obj)}: {e}"
+                    )
                 )
-        self.stdout.write(self.style.NOTICE("Fetching Tenants from ChirpStack..."))
-        response = get_tenant_from_chirpstack()
+        return len(missing)
+
+    def fetched(self, label, response):
+        if response is not None and response.status_code == 200:
+            return True
+        self.stdout.write(
+            self.style.ERROR(
+                f"✘ Error fetching {label} from ChirpStack: "
+                f"{response.text if response is not None else 'no response'}"
+            )
+        )
+        return False
+
+    def report_pull(self, label, response):
         if response is None:
             self.stdout.write(
-                self.style.NOTICE("ℹ No tenant changes returned from ChirpStack.")
+                self.style.NOTICE(f"ℹ No {label} changes returned from ChirpStack.")
             )
         elif response and response.status_code == 200:
-            self.stdout.write(self.style.SUCCESS("✔ Tenants fetched successfully."))
+            self.stdout.write(self.style.SUCCESS(f"✔ {label} fetched successfully."))
         else:
             self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching Tenants: {response.text}")
+                self.style.ERROR(f"✘ Error fetching {label}: {response.text}")
             )
 
+    def sync_tenants(self):
+        self.stdout.write(self.style.HTTP_INFO("Synchronizing Tenants..."))
+        remote = fetch_remote_tenants()
+        if not self.fetched("Tenants", remote[1]):
+            return
+
+        pushed = self.push_missing(
+            "Tenant",
+            Tenant.objects.all(),
+            {t["id"] for t in remote[0]},
+            lambda t: t.cs_tenant_id,
+            sync_tenant_get,
+            lambda t: t.name,
+        )
+        self.stdout.write(self.style.NOTICE("Fetching Tenants from ChirpStack..."))
+        response = get_tenant_from_chirpstack(None if pushed else remote)
+        self.report_pull("Tenants", response)
+
     def sync_gateways(self):
         self.stdout.write(self.style.HTTP_INFO("Synchronizing Gateways..."))
-        for gw in Gateway.objects.all():
-            try:
-                sync_gateway_get(gw)
-                self.stdout.write(
-                    self.style.SUCCESS(f"✔ Gateway {gw.name} synchronized.")
-                )
-            except Exception as e:
-                logger.exception(e)
-                self.stdout.write(
-                    self.style.ERROR(f"✘ Error synchronizing Gateway {gw.name}: {e}")
-                )
+        remote = fetch_remote_gateways()
+        if not self.fetched("Gateways", remote[1]):
+            return
+
+        pushed = self.push_missing(
+            "Gateway",
+            Gateway.objects.select_related("workspace__tenant", "location"),
+            {g["gatewayId"] for g in remote[0]},
+            lambda g: g.cs_gateway_id,
+            sync_gateway_get,
+            lambda g: g.name,
+        )
         self.stdout.write(self.style.NOTICE("Fetching Gateways from ChirpStack..."))
-        response = get_gateway_from_chirpstack()
-        if response is None:
-            self.stdout.write(
-                self.style.NOTICE("ℹ No gateway changes returned from ChirpStack.")
-            )
-        elif response and response.status_code == 200:
-            self.stdout.write(self.style.SUCCESS("✔ Gateways fetched successfully."))
-        else:
-            self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching Gateways: {response.text}")
-            )
+        response = get_gateway_from_chirpstack(None if pushed else remote)
+        self.report_pull("Gateways", response)
 
     def sync_api_users(self):
         self.stdout.write(self.style.HTTP_INFO("Synchronizing APIUsers..."))
-        for u in ApiUser.objects.all():
-            try:
-                sync_api_user_get(u)
-                self.stdout.write(
-                    self.style.SUCCESS(f"✔ APIUser {u.email} synchronized.")
-                )
-            except Exception as e:
-                logger.exception(e)
-                self.stdout.write(
-                    self.style.ERROR(f"✘ Error synchronizing APIUser {u.email}: {e}")
-                )
+        remote = fetch_remote_api_users()
+        if not self.fetched("APIUsers", remote[1]):
+            return
+
+        pushed = self.push_missing(
+            "APIUser",
+            ApiUser.objects.all(),
+            {u["id"] for u in remote[0]},
+            lambda u: u.cs_user_id,
+            sync_api_user_get,
+            lambda u: u.email,
+        )
         self.stdout.write(self.style.NOTICE("Fetching APIUsers from ChirpStack..."))
-        response = get_api_user_from_chirpstack()
-        if response is None:
-            self.stdout.write(
-                self.style.NOTICE("ℹ No APIUser changes returned from ChirpStack.")
-            )
-        elif response and response.status_code == 200:
-            self.stdout.write(self.style.SUCCESS("✔ APIUsers fetched successfully."))
-        else:
-            self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching APIUsers: {response.text}")
-            )
+        response = get_api_user_from_chirpstack(None if pushed else remote)
+        self.report_pull("APIUsers", response)
 
     def sync_applications(self):
         self.stdout.write(self.style.HTTP_INFO("Synchronizing Applications..."))
-        for app in Application.objects.all():
-            try:
-                sync_application_get(app)
-                self.stdout.write(
-                    self.style.SUCCESS(f"✔ Application {app.name} synchronized.")
-                )
-            except Exception as e:
-                logger.exception(e)
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"✘ Error synchronizing Application {app.name}: {e}"
-                    )
-                )
+        remote = fetch_remote_applications()
+        remote_ids = {a["id"] for results, _ in remote.values() for a in results}
+
+        pushed = self.push_missing(
+            "Application",
+            Application.objects.select_related("workspace__tenant"),
+            remote_ids,
+            lambda a: a.cs_application_id,
+            sync_application_get,
+            lambda a: a.name,
+        )
         self.stdout.write(self.style.NOTICE("Fetching Applications from ChirpStack..."))
-        response = get_applications_from_chirpstack()
-        if response is None:
-            self.stdout.write(
-                self.style.NOTICE("ℹ No application changes returned from ChirpStack.")
-            )
-        elif response and response.status_code == 200:
-            self.stdout.write(
-                self.style.SUCCESS("✔ Applications fetched successfully.")
-            )
-        else:
-            self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching Applications: {response.text}")
-            )
+        response = get_applications_from_chirpstack(None if pushed else remote)
+        self.report_pull("Applications", response)
 
     def sync_device_profiles(self):
         self.stdout.write(self.style.HTTP_INFO("Synchronizing DeviceProfiles..."))
-        for dp in DeviceProfile.objects.all():
-            try:
-                sync_device_profile_get(dp)
-                self.stdout.write(
-                    self.style.SUCCESS(f"✔ DeviceProfile {dp.name} synchronized.")
-                )
-            except Exception as e:
-                logger.exception(e)
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"✘ Error synchronizing DeviceProfile {dp.name}: {e}"
-                    )
-                )
-        response = get_device_profiles_from_chirpstack()
-        if response is None:
-            self.stdout.write(
-                self.style.NOTICE(
-                    "ℹ No device profile changes returned from ChirpStack."
-                )
-            )
-        elif response and response.status_code == 200:
-            self.stdout.write(
-                self.style.SUCCESS("✔ DeviceProfiles fetched successfully.")
-            )
-        else:
-            self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching DeviceProfiles: {response.text}")
-            )
+        remote = fetch_remote_device_profiles()
+        remote_ids = {dp["id"] for results, _ in remote.values() for dp in results}
+
+        pushed = self.push_missing(
+            "DeviceProfile",
+            DeviceProfile.objects.select_related("workspace__tenant"),
+            remote_ids,
+            lambda dp: dp.cs_device_profile_id,
+            sync_device_profile_get,
+            lambda dp: dp.name,
+        )
+        response = get_device_profiles_from_chirpstack(None if pushed else remote)
+        self.report_pull("DeviceProfiles", response)
 
     def sync_devices(self):
         self.stdout.write(self.style.HTTP_INFO("Synchronizing Devices..."))
-        for device in Device.objects.all():
-            try:
-                sync_device_get(device)
-                self.stdout.write(
-                    self.style.SUCCESS(f"✔ Device {device.name} synchronized.")
-                )
-            except Exception as e:
-                logger.exception(e)
-                self.stdout.write(
-                    self.style.ERROR(f"✘ Error synchronizing Device {device.name}: {e}")
-                )
+        remote = fetch_remote_devices()
+        remote_ids = {
+            d["devEui"].lower() for results, _ in remote.values() for d in results
+        }
+
+        pushed = self.push_missing(
+            "Device",
+            Device.objects.select_related("application", "device_profile"),
+            remote_ids,
+            lambda d: d.dev_eui.lower(),
+            sync_device_get,
+            lambda d: d.name,
+        )
         self.stdout.write(self.style.NOTICE("Fetching Devices from ChirpStack..."))
-        response = get_devices_from_chirpstack()
-        if response is None:
-            self.stdout.write(
-                self.style.NOTICE("ℹ No device changes returned from ChirpStack.")
-            )
-        elif response and response.status_code == 200:
-            self.stdout.write(self.style.SUCCESS("✔ Devices fetched successfully."))
-        else:
-            self.stdout.write(
-                self.style.ERROR(f"✘ Error fetching Devices: {response.text}")
-            )
+        response = get_devices_from_chirpstack(None if pushed else remote)
+        self.report_pull("Devices", response)
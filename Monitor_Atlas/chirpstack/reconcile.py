@@ -0,0 +1,102 @@
+"""
+Diff-and-apply reconciliation of ChirpStack lists into local tables.
+
+Remote items and local rows are indexed by the same key (ChirpStack id, dev
+EUI, email...), and each remote item is turned into the field values its
+local row should have. A row is only written when the hash of those values
+differs from the hash of what is stored; all writes for an entity type go out
+as bulk_update/bulk_create calls inside one transaction.
+
+bulk_* skip Model.save() and signals, so callers must build new instances
+ready to insert (e.g. with dev_eui already lowercased).
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+BATCH_SIZE = 500
+
+SYNCED = {"sync_status": "SYNCED", "sync_error": ""}
+
+
+def parse_timestamp(value):
+    """ChirpStack timestamps come as RFC 3339 strings."""
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
+def content_hash(values):
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Diff:
+    # remote items with no local row
+    create: list = field(default_factory=list)
+    # (row, values) pairs whose stored content differs
+    update: list = field(default_factory=list)
+    unchanged: int = 0
+    # local rows that are not in ChirpStack
+    missing: list = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"{len(self.create)} new, {len(self.update)} changed, "
+            f"{self.unchanged} unchanged, {len(self.missing)} missing in ChirpStack"
+        )
+
+
+def diff(local, remote, values_for):
+    """
+    Compare `local` (key -> model instance) with `remote` (key -> ChirpStack
+    item). `values_for(item, row)` returns the field values the row should
+    hold, keyed by attribute name (use `workspace_id`, not `workspace`).
+    """
+    result = Diff()
+    for key, item in remote.items():
+        row = local.get(key)
+        if row is None:
+            result.create.append(item)
+            continue
+
+        values = values_for(item, row)
+        stored = {name: getattr(row, name) for name in values}
+        if content_hash(values) == content_hash(stored):
+            result.unchanged += 1
+        else:
+            result.update.append((row, values))
+
+    result.missing = [row for key, row in local.items() if key not in remote]
+    return result
+
+
+def apply(model, updates, new_rows):
+    """
+    Write the changed rows of a diff and insert `new_rows` in one
+    transaction, one bulk statement per batch.
+    """
+    now = timezone.now()
+    rows = []
+    fields = {"last_synced_at"}
+    for row, values in updates:
+        for name, value in values.items():
+            setattr(row, name, value)
+        row.last_synced_at = now
+        fields.update(values)
+        rows.append(row)
+
+    for row in new_rows:
+        row.last_synced_at = now
+
+    with transaction.atomic():
+        if rows:
+            model.objects.bulk_update(rows, sorted(fields), batch_size=BATCH_SIZE)
+        if new_rows:
+            model.objects.bulk_create(new_rows, batch_size=BATCH_SIZE)
@@ -0,0 +1,190 @@
+"""
+Runtime status owned by ChirpStack, kept fresh in the local tables.
+
+Device and gateway list endpoints serve straight from the database; this
+module keeps `last_seen_at`, gateway `state` and device `is_disabled` up to
+date instead. refresh_status() pulls the gateway list of every tenant and the
+device list of every application and bulk-updates only the rows that changed.
+Device list items don't carry `isDisabled`, so the `refresh_chirpstack_status`
+command also GETs every device, at the lower CHIRPSTACK_DISABLED_REFRESH_INTERVAL
+cadence. schedule_refresh() refreshes a handful of rows (e.g. the page a client
+asked to refresh) from a background thread.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from loguru import logger
+
+from infrastructure.models import Device, Gateway
+
+from . import reconcile
+from .chirpstack_api import CHIRPSTACK_DEVICE_URL, CHIRPSTACK_GATEWAYS_URL, HEADERS
+from .fetcher import get_concurrently
+from .helpers import fetch_devices_by_application, fetch_gateways_by_tenant
+
+
+def gateway_status(item, gateway):
+    return {
+        "state": item.get("state", gateway.state),
+        "last_seen_at": reconcile.parse_timestamp(
+            item.get("lastSeenAt", gateway.last_seen_at)
+        ),
+    }
+
+
+def device_status(item, device):
+    return {
+        "last_seen_at": reconcile.parse_timestamp(
+            item.get("lastSeenAt", device.last_seen_at)
+        ),
+        "is_disabled": item.get("isDisabled", device.is_disabled),
+    }
+
+
+def _apply(model, local, remote, values_for):
+    changes = reconcile.diff(local, remote, values_for)
+    reconcile.apply(model, changes.update, [])
+    return len(changes.update)
+
+
+def refresh_gateways(gateways):
+    """
+    Refresh the status of these gateways with one list call per tenant.
+    Returns the number of gateways that changed.
+    """
+    gateways = list(gateways.select_related("workspace__tenant"))
+    tenants = {
+        g.workspace.tenant.id: g.workspace.tenant
+        for g in gateways
+        if g.workspace.tenant.cs_tenant_id
+    }
+
+    remote = {}
+    fetched = fetch_gateways_by_tenant(
+        list(tenants.values()), CHIRPSTACK_GATEWAYS_URL, HEADERS
+    )
+    for results, _ in fetched.values():
+        remote.update((g["gatewayId"], g) for g in results)
+
+    return _apply(
+        Gateway, {g.cs_gateway_id: g for g in gateways}, remote, gateway_status
+    )
+
+
+def refresh_devices(devices, detail=False):
+    """
+    Refresh the status of these devices. By default this is one list call
+    per application; device list items don't carry `isDisabled`, so
+    detail=True GETs each device instead (meant for small sets).
+    Returns the number of devices that changed.
+    """
+    devices = list(devices.select_related("application"))
+
+    remote = {}
+    if detail:
+        responses = get_concurrently(
+            {d.dev_eui: f"{CHIRPSTACK_DEVICE_URL}/{d.dev_eui}" for d in devices},
+            HEADERS,
+        )
+        for dev_eui, response in responses.items():
+            if response is not None and response.status_code == 200:
+                body = response.json()
+                remote[dev_eui] = {
+                    **body.get("device", {}),
+                    "lastSeenAt": body.get("lastSeenAt"),
+                }
+    else:
+        apps = {
+            d.application.id: d.application
+            for d in devices
+            if d.application.cs_application_id
+        }
+        fetched = fetch_devices_by_application(
+            list(apps.values()), CHIRPSTACK_DEVICE_URL, HEADERS
+        )
+        for results, _ in fetched.values():
+            remote.update((d["devEui"].lower(), d) for d in results)
+
+    return _apply(
+        Device, {d.dev_eui.lower(): d for d in devices}, remote, device_status
+    )
+
+
+def refresh_status(detail=False):
+    """
+    Refresh every gateway and device. detail=True also refreshes device
+    `is_disabled` (see refresh_devices). Returns (gateways, devices) changed.
+    """
+    gateways = refresh_gateways(Gateway.objects.all())
+    devices = refresh_devices(Device.objects.all(), detail=detail)
+    logger.info(
+        f"ChirpStack status refreshed: {gateways} gateways and {devices} devices changed"
+    )
+    return gateways, devices
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def schedule_refresh(model, ids):
+    """
+    Refresh these Device or Gateway rows from a background thread, so the
+    request that asked for it doesn't wait on ChirpStack. Rows that already
+    have a refresh in flight are skipped.
+    """
+    label = model._meta.label
+    with _pending_lock:
+        ids = {pk for pk in ids if (label, pk) not in _pending}
+        _pending.update((label, pk) for pk in ids)
+    if not ids:
+        return
+
+    thread = threading.Thread(
+        target=_refresh_in_background, args=(model, ids), daemon=True
+    )
+    thread.start()
+
+
+def _refresh_in_background(model, ids):
+    label = model._meta.label
+    try:
+        if model is Device:
+            refresh_devices(Device.objects.filter(id__in=ids), detail=True)
+        else:
+            refresh_gateways(Gateway.objects.filter(id__in=ids))
+    except Exception as e:
+        logger.exception(f"Error refreshing {label} status: {e}")
+    finally:
+        with _pending_lock:
+            _pending.difference_update((label, pk) for pk in ids)
+        connections.close_all()
+
+
+def run_refresher(once=False):
+    """
+    Refresh every CHIRPSTACK_STATUS_REFRESH_INTERVAL seconds until stopped,
+    with a detail pass every CHIRPSTACK_DISABLED_REFRESH_INTERVAL seconds.
+    """
+    logger.info("ChirpStack status refresher started")
+    detailed_at = None
+    while True:
+        started = time.monotonic()
+        detail = (
+            detailed_at is None
+            or started - detailed_at >= settings.CHIRPSTACK_DISABLED_REFRESH_INTERVAL
+        )
+        try:
+            refresh_status(detail=detail)
+            if detail:
+                detailed_at = started
+        except Exception as e:
+            logger.exception(f"Error refreshing ChirpStack status: {e}")
+
+        if once:
+            return
+        elapsed = time.monotonic() - started
+        time.sleep(max(0, settings.CHIRPSTACK_STATUS_REFRESH_INTERVAL - elapsed))
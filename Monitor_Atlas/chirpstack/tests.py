@@ -1,3 +1,201 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from chirpstack import fetcher, status
+from chirpstack.chirpstack_api import get_devices_from_chirpstack
+from chirpstack.models import DeviceProfile
+from infrastructure.models import Application, Device, Type
+from organizations.models import Subscription, Tenant, Workspace
+
+
+def page(items, total):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {"result": items, "totalCount": total}
+    return response
+
+
+class FetchAllTests(TestCase):
+    def test_fetches_every_page(self):
+        items = [{"id": str(i)} for i in range(fetcher.PAGE_SIZE + 5)]
+        session = mock.Mock()
+        session.get.side_effect = [
+            page(items[: fetcher.PAGE_SIZE], len(items)),
+            page(items[fetcher.PAGE_SIZE :], len(items)),
+        ]
+
+        with mock.patch.object(fetcher, "get_session", return_value=session):
+            results, response = fetcher.fetch_all("http://cs/api/devices", {})
+
+        self.assertEqual(results, items)
+        self.assertEqual(response.status_code, 200)
+        offsets = [c.kwargs["params"]["offset"] for c in session.get.call_args_list]
+        self.assertEqual(offsets, [0, fetcher.PAGE_SIZE])
+
+    def test_returns_partial_results_on_error(self):
+        error = mock.Mock(status_code=500, text="boom")
+        session = mock.Mock()
+        session.get.side_effect = [
+            page([{"id": str(i)} for i in range(fetcher.PAGE_SIZE)], 250),
+            error,
+        ]
+
+        with mock.patch.object(fetcher, "get_session", return_value=session):
+            results, response = fetcher.fetch_all("http://cs/api/devices", {})
+
+        self.assertEqual(len(results), fetcher.PAGE_SIZE)
+        self.assertIs(response, error)
+
+    def test_fetch_concurrently_keys_results(self):
+        session = mock.Mock()
+        session.get.side_effect = lambda url, **kwargs: page(
+            [{"id": kwargs["params"]["tenantId"]}], 1
+        )
+
+        with mock.patch.object(fetcher, "get_session", return_value=session):
+            results = fetcher.fetch_concurrently(
+                {
+                    1: ("http://cs/api/apps", {"tenantId": "a"}),
+                    2: ("http://cs/api/apps", {"tenantId": "b"}),
+                },
+                {},
+            )
+
+        self.assertEqual(results[1][0], [{"id": "a"}])
+        self.assertEqual(results[2][0], [{"id": "b"}])
+
+
+class DeviceFixtureMixin:
+    def setUp(self):
+        subscription = Subscription.objects.create(
+            name="sub",
+            description="sub",
+            can_have_gateways=False,
+            max_device_count=0,
+            max_gateway_count=0,
+        )
+        tenant = Tenant.objects.create(
+            name="tenant", subscription=subscription, cs_tenant_id="t-1"
+        )
+        workspace = Workspace.objects.create(
+            name="Default", description="ws", tenant=tenant
+        )
+        self.device_type = Type.objects.create(name="Generic", description="sensor")
+        self.profile = DeviceProfile.objects.create(
+            cs_device_profile_id="dp-1",
+            name="profile",
+            description="profile",
+            region="US915",
+            workspace=workspace,
+            abp_rx1_delay=1,
+            abp_rx1_dr_offset=0,
+            abp_rx2_dr=8,
+            abp_rx2_freq=923300000,
+        )
+        self.app = Application.objects.create(
+            name="app", workspace=workspace, cs_application_id="app-1"
+        )
+        for dev_eui, name in [("aa01", "same"), ("aa02", "old"), ("aa04", "local")]:
+            Device.objects.create(
+                dev_eui=dev_eui,
+                name=name,
+                description="",
+                workspace=workspace,
+                device_type=self.device_type,
+                device_profile=self.profile,
+                application=self.app,
+                sync_status="SYNCED",
+                sync_error="",
+            )
+
+    def remote(self, *devices):
+        response = mock.Mock(status_code=200)
+        items = [
+            {"devEui": dev_eui, "name": name, "deviceProfileId": "dp-1"}
+            for dev_eui, name in devices
+        ]
+        return {self.app.id: (items, response)}
+
+
+class DeviceReconcileTests(DeviceFixtureMixin, TestCase):
+    def test_applies_only_the_diff(self):
+        unchanged_at = Device.objects.get(dev_eui="aa01").last_synced_at
+
+        get_devices_from_chirpstack(
+            self.remote(("AA01", "same"), ("aa02", "new name"), ("AA03", "created"))
+        )
+
+        self.assertEqual(
+            Device.objects.get(dev_eui="aa01").last_synced_at, unchanged_at
+        )
+        self.assertEqual(Device.objects.get(dev_eui="aa02").name, "new name")
+        created = Device.objects.get(dev_eui="aa03")
+        self.assertEqual(created.application, self.app)
+        self.assertEqual(created.device_profile, self.profile)
+        self.assertEqual(created.device_type, self.device_type)
+        self.assertTrue(Device.objects.filter(dev_eui="aa04").exists())
+
+    def test_second_pass_writes_nothing(self):
+        remote = self.remote(("aa01", "same"), ("aa02", "new name"))
+        get_devices_from_chirpstack(remote)
+
+        with mock.patch.object(Device.objects, "bulk_update") as bulk_update:
+            get_devices_from_chirpstack(remote)
+        bulk_update.assert_not_called()
+
+
+class StatusRefreshTests(DeviceFixtureMixin, TestCase):
+    def test_refresh_updates_only_changed_status(self):
+        remote = self.remote(("aa01", "same"), ("aa02", "old"))
+        items, _ = remote[self.app.id]
+        items[1]["lastSeenAt"] = "2024-05-01T10:00:00Z"
+
+        with mock.patch.object(
+            status, "fetch_devices_by_application", return_value=remote
+        ):
+            changed = status.refresh_devices(Device.objects.all())
+
+        self.assertEqual(changed, 1)
+        self.assertEqual(
+            Device.objects.get(dev_eui="aa02").last_seen_at.isoformat(),
+            "2024-05-01T10:00:00+00:00",
+        )
+        self.assertIsNone(Device.objects.get(dev_eui="aa01").last_seen_at)
+
+    def test_detail_refresh_updates_is_disabled(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "device": {"devEui": "aa01", "isDisabled": True},
+            "lastSeenAt": None,
+        }
+
+        with mock.patch.object(
+            status, "get_concurrently", return_value={"aa01": response}
+        ):
+            changed = status.refresh_devices(
+                Device.objects.filter(dev_eui="aa01"), detail=True
+            )
+
+        self.assertEqual(changed, 1)
+        self.assertTrue(Device.objects.get(dev_eui="aa01").is_disabled)
+
+    @override_settings(
+        CHIRPSTACK_STATUS_REFRESH_INTERVAL=60, CHIRPSTACK_DISABLED_REFRESH_INTERVAL=3600
+    )
+    def test_refresher_runs_detail_pass_at_lower_cadence(self):
+        class Stop(Exception):
+            pass
+
+        with (
+            mock.patch.object(status, "refresh_status") as refresh_status,
+            mock.patch.object(status.time, "monotonic") as monotonic,
+            mock.patch.object(status.time, "sleep", side_effect=[None, None, Stop]),
+        ):
+            monotonic.side_effect = [0, 0, 60, 60, 3600, 3600]
+            with self.assertRaises(Stop):
+                status.run_refresher()
+
+        self.assertEqual(
+            [c.kwargs["detail"] for c in refresh_status.call_args_list],
+            [True, False, True],
+        )
@@ -1,3 +1,186 @@
+from unittest import mock
+
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from chirpstack.models import DeviceProfile
+from organizations.models import Subscription, Tenant, Workspace
+from users.models import User
+
+from .models import Application, Device, Type
+from .views import LATEST_METRICS_MAX_DEVICES
+
+
+class DeviceFixtureMixin:
+    url = "/api/v1/infrastructure/device/"
+
+    def setUp(self):
+        subscription = Subscription.objects.create(
+            name="sub",
+            description="sub",
+            can_have_gateways=False,
+            max_device_count=0,
+            max_gateway_count=0,
+        )
+        tenant = Tenant.objects.create(name="tenant", subscription=subscription)
+        workspace = Workspace.objects.create(name="ws", description="ws", tenant=tenant)
+        device_type = Type.objects.create(name="sensor", description="sensor")
+        profile = DeviceProfile.objects.create(
+            name="profile",
+            description="profile",
+            region="US915",
+            workspace=workspace,
+            abp_rx1_delay=1,
+            abp_rx1_dr_offset=0,
+            abp_rx2_dr=8,
+            abp_rx2_freq=923300000,
+        )
+        application = Application.objects.create(name="app", workspace=workspace)
+        self.devices = [
+            Device.objects.create(
+                dev_eui=f"aa0{i}",
+                name=f"device {i}",
+                description="",
+                workspace=workspace,
+                device_type=device_type,
+                device_profile=profile,
+                application=application,
+            )
+            for i in range(3)
+        ]
+
+        user = User.objects.create_superuser(
+            username="admin",
+            password="password",
+            name="admin",
+            last_name="User",
+            email="admin@example.com",
+            phone="123",
+            tenant=tenant,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+
+class DeviceListTests(DeviceFixtureMixin, TestCase):
+    def test_list_is_served_from_the_database(self):
+        with (
+            mock.patch("infrastructure.views.sync_device_get") as sync_device_get,
+            mock.patch("infrastructure.views.schedule_refresh") as schedule_refresh,
+        ):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        sync_device_get.assert_not_called()
+        schedule_refresh.assert_not_called()
+
+    def test_refresh_schedules_the_listed_devices(self):
+        with mock.patch("infrastructure.views.schedule_refresh") as schedule_refresh:
+            response = self.client.get(self.url, {"refresh": "true"})
+
+        self.assertEqual(response.status_code, 200)
+        model, ids = schedule_refresh.call_args.args
+        self.assertIs(model, Device)
+        self.assertCountEqual(ids, [d.id for d in self.devices])
+
+
+class HistoricMetricsTests(DeviceFixtureMixin, TestCase):
+    def test_points_are_streamed_from_hermes(self):
+        device = self.devices[0]
+        hermes = mock.Mock(
+            status_code=200, headers={"Content-Type": "application/x-ndjson"}
+        )
+        hermes.iter_content.return_value = iter([b'{"value":1.0}\n', b'{"value":2.0}\n'])
+
+        with (
+            self.settings(HERMES_API_URL="http://hermes"),
+            mock.patch("infrastructure.views.requests.get", return_value=hermes) as get,
+        ):
+            response = self.client.get(
+                f"{self.url}{device.id}/historic_metrics/",
+                {
+                    "start": "2024-01-01T00:00:00Z",
+                    "end": "2024-01-02T00:00:00Z",
+                    "measurement_type": "voltage",
+                    "output": "ndjson",
+                    "limit": "100",
+                },
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            b"".join(response.streaming_content), b'{"value":1.0}\n{"value":2.0}\n'
+        )
+        params = get.call_args.kwargs["params"]
+        self.assertEqual(params["output"], "ndjson")
+        self.assertEqual(params["limit"], "100")
+        self.assertNotIn("after", params)
+        hermes.close.assert_called_once()
+
+    def test_hermes_response_is_closed_when_client_disconnects(self):
+        device = self.devices[0]
+        hermes = mock.Mock(status_code=200, headers={})
+        hermes.iter_content.return_value = iter([b"[", b"{}", b"]"])
+
+        with (
+            self.settings(HERMES_API_URL="http://hermes"),
+            mock.patch("infrastructure.views.requests.get", return_value=hermes),
+        ):
+            response = self.client.get(
+                f"{self.url}{device.id}/historic_metrics/",
+                {
+                    "start": "2024-01-01T00:00:00Z",
+                    "end": "2024-01-02T00:00:00Z",
+                    "measurement_type": "voltage",
+                },
+            )
+
+        self.assertEqual(next(iter(response.streaming_content)), b"[")
+        hermes.close.assert_not_called()
+        response.close()
+        hermes.close.assert_called_once()
+
+
+class LatestMetricsTests(DeviceFixtureMixin, TestCase):
+    def test_one_hermes_call_for_many_devices(self):
+        first, second = self.devices[:2]
+        hermes = mock.Mock(status_code=200)
+        hermes.json.return_value = {
+            first.dev_eui: {"voltage": {"ch1": {"value": 220.0}}},
+            second.dev_eui: {},
+        }
+
+        with (
+            self.settings(HERMES_API_URL="http://hermes"),
+            mock.patch("infrastructure.views.requests.get", return_value=hermes) as get,
+        ):
+            response = self.client.get(
+                f"{self.url}latest_metrics/", {"ids": f"{first.id},{second.id},missing"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                first.id: {"voltage": {"ch1": {"value": 220.0}}},
+                second.id: {},
+            },
+        )
+        get.assert_called_once()
+        self.assertCountEqual(
+            get.call_args.kwargs["params"],
+            [("dev_eui", first.dev_eui), ("dev_eui", second.dev_eui)],
+        )
+
+    def test_ids_are_required(self):
+        response = self.client.get(f"{self.url}latest_metrics/")
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    def test_too_many_ids_are_rejected(self):
+        ids = ",".join(f"device-{i}" for i in range(LATEST_METRICS_MAX_DEVICES + 1))
+        with mock.patch("infrastructure.views.requests.get") as get:
+            response = self.client.get(f"{self.url}latest_metrics/", {"ids": ids})
+        self.assertEqual(response.status_code, 400)
+        get.assert_not_called()
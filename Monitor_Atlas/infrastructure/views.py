@@ -3,6 +3,7 @@ from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db.models import Count
+from django.http import StreamingHttpResponse
 
 from .serializers import (
     GatewaySerializer,
@@ -27,7 +28,7 @@ from .models import (
 
 from organizations.models import Tenant
 from roles.permissions import HasPermission, IsServiceOrHasPermission
-from guardian.shortcuts import get_objects_for_user, get_users_with_perms
+from guardian.shortcuts import get_objects_for_user
 
 from chirpstack.chirpstack_api import (
     sync_gateway_create,
@@ -46,6 +47,7 @@ from chirpstack.chirpstack_api import (
     deactivate_device,
     device_activation_status,
 )
+from chirpstack.status import schedule_refresh
 
 from rest_framework import status
 
@@ -61,6 +63,25 @@ from roles.helpers import assign_created_instance_permissions
 
 from django.utils import timezone
 
+# Most devices Hermes /measurements/latest accepts per call (LATEST_VALUES_MAX_DEVICES)
+LATEST_METRICS_MAX_DEVICES = 500
+
+
+def _relay(response, chunk_size=64 * 1024):
+    """
+    Chunks of a streamed `requests` response. Closing the generator (Django
+    does when the response ends or the client disconnects) closes the
+    upstream response, returning its connection to the pool.
+    """
+    try:
+        yield from response.iter_content(chunk_size=chunk_size)
+    finally:
+        response.close()
+
+
+def wants_refresh(request):
+    return request.query_params.get("refresh", "").lower() in ("1", "true")
+
 
 @extend_schema_view(
     list=extend_schema(description="Gateway List (ChirpStack)"),
@@ -121,8 +142,9 @@ class GatewayViewSet(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         """
-        List a queryset of gateways and sync each one with Chirpstack before
-        returning the response.
+        List gateways from the database. Their status is kept fresh by the
+        ChirpStack status refresher; pass ?refresh=true to also refresh the
+        listed gateways in the background.
 
         """
         workspace = request.query_params.get("workspace", None)
@@ -131,17 +153,16 @@ class GatewayViewSet(viewsets.ModelViewSet):
             queryset = self.queryset.filter(workspace__id=workspace)
         else:
             queryset = self.filter_queryset(self.get_queryset())
-
-        for gateway in queryset:
-            sync_gateway_get(gateway)
-            gateway.refresh_from_db()
+        queryset = queryset.select_related("location", "workspace__tenant")
 
         page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        if wants_refresh(request):
+            schedule_refresh(Gateway, [gateway.id for gateway in rows])
+
+        serializer = self.get_serializer(rows, many=True)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
     def perform_update(self, serializer):
@@ -421,6 +442,9 @@ class TypeViewSet(viewsets.ModelViewSet):
                     "end": "2024-01-07T00:00:00Z",
                     "measurement_type": "voltage",
                     "channel": "ch1",
+                    "output": "ndjson",
+                    "limit": 10000,
+                    "after": "2024-01-02T13:45:00Z",
                 },
             ),
         ],
@@ -503,23 +527,29 @@ class DeviceViewSet(viewsets.ModelViewSet):
         instance.delete()
 
     def list(self, request, *args, **kwargs):
+        """
+        List devices from the database. Their status is kept fresh by the
+        ChirpStack status refresher; pass ?refresh=true to also refresh the
+        listed devices in the background.
+        """
         workspace = request.query_params.get("workspace", None)
 
         if workspace:
             queryset = self.queryset.filter(workspace__id=workspace)
         else:
             queryset = self.filter_queryset(self.get_queryset())
-
-        for device in queryset:
-            sync_device_get(device)
-            device.refresh_from_db()
+        queryset = queryset.select_related(
+            "workspace__tenant", "machine", "device_type"
+        )
 
         page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        if wants_refresh(request):
+            schedule_refresh(Device, [device.id for device in rows])
+
+        serializer = self.get_serializer(rows, many=True)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
@@ -843,10 +873,10 @@ class DeviceViewSet(viewsets.ModelViewSet):
             "assigned_users": [],
         }
 
-        users_queryset = get_users_with_perms(device)
-        for user in users_queryset:
+        # Served from the recipient index kept by notifications.signals
+        for recipient in device.recipients.select_related("user"):
             payload["assigned_users"].append(
-                {"user_id": user.id, "username": user.username}
+                {"user_id": recipient.user.id, "username": recipient.user.username}
             )
 
         return Response(payload)
@@ -964,6 +994,85 @@ class DeviceViewSet(viewsets.ModelViewSet):
 
         return Response(response.json())
 
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[HasPermission],
+        scope="device",
+    )
+    def latest_metrics(self, request):
+        """
+        Latest value of every measurement and channel of many devices in one
+        request to Hermes (e.g. for a dashboard of device cards).
+
+        Endpoint: GET /measurements/latest
+        Query Parameters:
+            - ids: Comma-separated device ids (at most LATEST_METRICS_MAX_DEVICES);
+              devices the user can't view are skipped
+
+        Returns {device_id: {measurement: {channel: {value, time, received_at}}}}.
+        """
+        ids = [pk for pk in request.query_params.get("ids", "").split(",") if pk]
+        if not ids:
+            return Response(
+                {"message": "Missing required query parameter: ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(set(ids)) > LATEST_METRICS_MAX_DEVICES:
+            return Response(
+                {
+                    "message": f"At most {LATEST_METRICS_MAX_DEVICES} ids are allowed per request"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        devices = list(self.get_queryset().filter(id__in=ids).only("id", "dev_eui"))
+        if not devices:
+            return Response({})
+
+        hermes_url = getattr(settings, "HERMES_API_URL", "")
+        if not hermes_url:
+            logger.error("HERMES_API_URL is not configured")
+            return Response(
+                {"message": "Hermes service not configured"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        url = f"{hermes_url}/measurements/latest"
+
+        headers = {"X-API-Key": getattr(settings, "SERVICE_API_KEY", "")}
+
+        params = [("dev_eui", device.dev_eui) for device in devices]
+
+        try:
+            response = requests.get(url, headers=headers, timeout=5, params=params)
+            logger.debug(
+                f"Request: {response.request.method} {response.request.url} - Status: {response.status_code}"
+            )
+
+        except requests.RequestException as e:
+            logger.error(
+                f"Connection error fetching latest metrics from Hermes for {len(devices)} devices: {e}"
+            )
+            return Response(
+                {"message": "Hermes service unavailable"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+
+        if response.status_code != 200:
+            logger.error(
+                f"Error fetching latest metrics from Hermes for {len(devices)} devices: {response.status_code} {response.text}"
+            )
+            return Response(
+                {"message": "Error fetching latest metrics from Hermes"},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+
+        values = response.json()
+        return Response(
+            {device.id: values.get(device.dev_eui, {}) for device in devices}
+        )
+
     @action(
         detail=True,
         methods=["get"],
@@ -1138,10 +1247,17 @@ class DeviceViewSet(viewsets.ModelViewSet):
         if channel:
             params["channel"] = channel
 
+        # Paging and output format are passed through to Hermes
+        for name in ("output", "limit", "after"):
+            if request.query_params.get(name):
+                params[name] = request.query_params[name]
+
         try:
-            response = requests.get(url, headers=headers, timeout=5, params=params)
+            response = requests.get(
+                url, headers=headers, timeout=5, params=params, stream=True
+            )
             logger.debug(
-                f"Request: {response.request.method} {response.request.url} - Status: {response.status_code} {response.text}"
+                f"Request: {response.request.method} {response.request.url} - Status: {response.status_code}"
             )
 
         except requests.RequestException as e:
@@ -1162,18 +1278,12 @@ class DeviceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_502_BAD_GATEWAY,
             )
 
-        try:
-            response_json = response.json()
-        except ValueError:
-            logger.error(
-                f"Invalid JSON response from Hermes for device {device.dev_eui}: {response.text}"
-            )
-            return Response(
-                {"message": "Invalid response from Hermes service"},
-                status=status.HTTP_502_BAD_GATEWAY,
-            )
-
-        return Response(response_json)
+        # Relay the points as Hermes streams them instead of buffering the
+        # whole range in memory
+        return StreamingHttpResponse(
+            _relay(response),
+            content_type=response.headers.get("Content-Type", "application/json"),
+        )
 
     @action(
         detail=False,
@@ -1,6 +1,12 @@
 from django.contrib import admin
 
-from .models import FCMDevice, Notification, NotificationSettings
+from .models import (
+    DeviceRecipient,
+    FCMDevice,
+    FCMDispatchJob,
+    Notification,
+    NotificationSettings,
+)
 
 
 @admin.register(FCMDevice)
@@ -21,3 +27,25 @@ class NotificationAdmin(admin.ModelAdmin):
 class NotificationSettingsAdmin(admin.ModelAdmin):
     list_display = ["id", "user", "created_at", "updated_at"]
     search_fields = ["user__username"]
+
+
+@admin.register(DeviceRecipient)
+class DeviceRecipientAdmin(admin.ModelAdmin):
+    list_display = ["id", "device", "user"]
+    search_fields = ["device__dev_eui", "user__username"]
+
+
+@admin.register(FCMDispatchJob)
+class FCMDispatchJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "title",
+        "status",
+        "attempts",
+        "success_count",
+        "failure_count",
+        "invalid_token_count",
+        "created_at",
+    ]
+    list_filter = ["status", "topic"]
+    search_fields = ["title"]
@@ -0,0 +1,251 @@
+"""
+Background FCM delivery.
+
+NotificationsEngine queues one FCMDispatchJob per multicast; this module
+sends them. Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so
+several workers can run side by side, and claiming pushes next_attempt_at
+forward so a job held by a worker that died is picked up again later.
+Tokens that fail transiently are retried with exponential backoff; tokens FCM
+reports as unregistered are deactivated in one update per batch.
+"""
+
+import random
+import time
+from datetime import timedelta
+
+import firebase_admin
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from firebase_admin import exceptions, messaging
+from loguru import logger
+
+from .models import FCMDevice, FCMDispatchJob
+
+# Seconds a claimed job stays invisible to other workers
+CLAIM_LEASE_SECONDS = 300
+
+TRANSIENT_ERRORS = (
+    exceptions.UnavailableError,
+    exceptions.InternalError,
+    exceptions.DeadlineExceededError,
+    exceptions.ResourceExhaustedError,
+    exceptions.UnknownError,
+)
+INVALID_TOKEN_ERRORS = (exceptions.NotFoundError, messaging.SenderIdMismatchError)
+
+
+def retry_delay(attempts):
+    """Exponential backoff from FCM_RETRY_BASE_DELAY, with jitter."""
+    delay = settings.FCM_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def claim_jobs(limit):
+    """Claim up to `limit` due jobs for this worker."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            FCMDispatchJob.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:limit]
+        )
+        for job in jobs:
+            job.attempts += 1
+            job.next_attempt_at = now + timedelta(seconds=CLAIM_LEASE_SECONDS)
+        FCMDispatchJob.objects.bulk_update(jobs, ["attempts", "next_attempt_at"])
+    return jobs
+
+
+def _build_message(job, tokens):
+    return messaging.MulticastMessage(
+        tokens=[t["fcm_token"] for t in tokens],
+        notification=messaging.Notification(title=job.title, body=job.message),
+        data={
+            "type": job.type,
+            "topic": job.topic,
+            **{k: str(v) for k, v in (job.extra_data or {}).items()},
+        },
+        android=messaging.AndroidConfig(
+            priority="high",
+            notification=messaging.AndroidNotification(
+                channel_id=job.type if job.type in ("warning", "error") else "info",
+            ),
+        ),
+        apns=messaging.APNSConfig(
+            payload=messaging.APNSPayload(aps=messaging.Aps(sound="default")),
+        ),
+    )
+
+
+def _retry_or_fail(job, error, token_ids):
+    job.last_error = str(error)[:1000]
+    if job.attempts >= settings.FCM_MAX_ATTEMPTS:
+        job.status = "failed"
+        job.failure_count += len(token_ids)
+        job.token_ids = []
+        logger.error(
+            f"Giving up on FCM job {job.id} after {job.attempts} attempts: {error}"
+        )
+    else:
+        job.status = "pending"
+        job.token_ids = token_ids
+        job.next_attempt_at = timezone.now() + timedelta(
+            seconds=retry_delay(job.attempts)
+        )
+        logger.warning(
+            f"FCM job {job.id} attempt {job.attempts} failed for {len(token_ids)} tokens: {error}"
+        )
+
+
+def send_job(job):
+    """
+    Send one job's multicast and update its counters and status in memory.
+    Returns the ids of the tokens FCM reported as invalid.
+    """
+    tokens = list(
+        FCMDevice.objects.filter(id__in=job.token_ids, is_active=True).values(
+            "id", "fcm_token"
+        )
+    )
+    if not tokens:
+        job.status = "sent"
+        job.token_ids = []
+        return set()
+
+    try:
+        response = messaging.send_each_for_multicast(_build_message(job, tokens))
+    except Exception as e:
+        _retry_or_fail(job, e, [t["id"] for t in tokens])
+        return set()
+
+    invalid_ids = set()
+    retry_ids = []
+    last_error = None
+    for token, resp in zip(tokens, response.responses):
+        if resp.success:
+            job.success_count += 1
+        elif isinstance(resp.exception, INVALID_TOKEN_ERRORS):
+            invalid_ids.add(token["id"])
+        elif isinstance(resp.exception, TRANSIENT_ERRORS):
+            retry_ids.append(token["id"])
+            last_error = resp.exception
+        else:
+            job.failure_count += 1
+            job.last_error = str(resp.exception)[:1000]
+            logger.warning(
+                f"FCM send failed for token {token['fcm_token'][:20]}...: {resp.exception}"
+            )
+
+    job.invalid_token_count += len(invalid_ids)
+    if retry_ids:
+        _retry_or_fail(job, last_error, retry_ids)
+    else:
+        job.status = "sent"
+        job.token_ids = []
+    return invalid_ids
+
+
+def process_jobs(jobs):
+    """Send claimed jobs, then save them and deactivate invalid tokens in bulk."""
+    if not jobs:
+        return 0
+
+    if not firebase_admin._apps:
+        logger.warning("Firebase not initialized; skipping FCM dispatch")
+        return 0
+
+    invalid_ids = set()
+    for job in jobs:
+        invalid_ids |= send_job(job)
+        job.updated_at = timezone.now()
+
+    FCMDispatchJob.objects.bulk_update(
+        jobs,
+        [
+            "status",
+            "attempts",
+            "token_ids",
+            "next_attempt_at",
+            "success_count",
+            "failure_count",
+            "invalid_token_count",
+            "last_error",
+            "updated_at",
+        ],
+    )
+
+    if invalid_ids:
+        FCMDevice.objects.filter(id__in=invalid_ids).update(is_active=False)
+        logger.info(f"Deactivated {len(invalid_ids)} invalid FCM tokens")
+
+    return len(jobs)
+
+
+def prune_jobs():
+    """Delete finished jobs older than FCM_JOB_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=settings.FCM_JOB_RETENTION_DAYS)
+    deleted, _ = FCMDispatchJob.objects.filter(
+        status__in=["sent", "failed"], created_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def run_worker(once=False):
+    """Claim and send due jobs until stopped (or one pass with once=True)."""
+    logger.info("FCM dispatch worker started")
+    last_prune = 0.0
+
+    while True:
+        try:
+            jobs = claim_jobs(settings.FCM_WORKER_BATCH_SIZE)
+            process_jobs(jobs)
+
+            if time.monotonic() - last_prune > 3600:
+                prune_jobs()
+                last_prune = time.monotonic()
+        except Exception as e:
+            jobs = []
+            logger.exception(f"Error in FCM dispatch worker: {e}")
+
+        if once:
+            return
+        if len(jobs) < settings.FCM_WORKER_BATCH_SIZE:
+            time.sleep(settings.FCM_WORKER_POLL_INTERVAL)
+
+
+def delivery_stats(hours=24):
+    """Job and token counts for jobs created in the last `hours` hours."""
+    since = timezone.now() - timedelta(hours=hours)
+    jobs = FCMDispatchJob.objects.filter(created_at__gte=since)
+
+    by_status = dict(
+        jobs.values_list("status").annotate(count=Count("id")).order_by()
+    )
+    totals = jobs.aggregate(
+        delivered=Sum("success_count"),
+        failed=Sum("failure_count"),
+        invalid_tokens=Sum("invalid_token_count"),
+    )
+
+    oldest_pending = (
+        FCMDispatchJob.objects.filter(status="pending")
+        .order_by("created_at")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+
+    return {
+        "window_hours": hours,
+        "jobs": {
+            status: by_status.get(status, 0)
+            for status, _ in FCMDispatchJob.STATUS_CHOICES
+        },
+        "tokens": {key: value or 0 for key, value in totals.items()},
+        "oldest_pending_seconds": (
+            (timezone.now() - oldest_pending).total_seconds()
+            if oldest_pending
+            else 0
+        ),
+    }
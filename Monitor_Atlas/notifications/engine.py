@@ -1,24 +1,26 @@
+from django.conf import settings
 from django.db.models import QuerySet
 
 from loguru import logger
 
-from .models import FCMDevice, Notification, NotificationSettings
+from .dispatcher import process_jobs
+from .models import FCMDevice, FCMDispatchJob, Notification, NotificationSettings
 
-import firebase_admin
-from firebase_admin import messaging
+# Max tokens per FCM multicast request
+FCM_MULTICAST_LIMIT = 500
 
 
 class NotificationsEngine:
     @staticmethod
     def send_notification(users, title, message, type, topic, extra_data=None):
         if not users:
-            return {"notified": 0, "skipped": 0, "invalid_tokens_cleaned": 0}
+            return {"notified": 0, "skipped": 0, "queued": 0}
 
         opted_in_users = _filter_users_by_topic_preferences(users, topic)
 
         if not opted_in_users:
             logger.debug(f"All users skipped for topic '{topic}' due to preferences")
-            return {"notified": 0, "skipped": len(users), "invalid_tokens_cleaned": 0}
+            return {"notified": 0, "skipped": len(users), "queued": 0}
 
         _persist_notifications(opted_in_users, title, message, type, topic)
 
@@ -29,17 +31,85 @@ class NotificationsEngine:
             return {
                 "notified": 0,
                 "skipped": len(users) - len(opted_in_users),
-                "invalid_tokens_cleaned": 0,
+                "queued": 0,
             }
 
-        cleaned_count = _dispatch_fcm(tokens, title, message, type, topic, extra_data)
+        queued = _dispatch_fcm(tokens, title, message, type, topic, extra_data)
 
         return {
             "notified": len(opted_in_users),
             "skipped": len(users) - len(opted_in_users),
-            "invalid_tokens_cleaned": cleaned_count,
+            "queued": queued,
         }
 
+    @staticmethod
+    def send_notifications_batch(alerts, topic):
+        """
+        Send many notifications at once.
+
+        Each alert is a dict with `users`, `title`, `message`, `type` and
+        optionally `extra_data`. Preferences and FCM tokens are loaded for
+        all users together, every Notification row is written in a single
+        bulk_create, and one FCM multicast per alert is queued for the
+        dispatch worker.
+
+        Returns one {"notified", "skipped"} dict per alert, in order.
+        """
+        all_users = {u.id: u for alert in alerts for u in alert["users"]}
+        if not all_users:
+            return [{"notified": 0, "skipped": 0} for _ in alerts]
+
+        opted_in = _filter_users_by_topic_preferences(list(all_users.values()), topic)
+        opted_in_ids = {u.id for u in opted_in}
+
+        tokens_by_user = {}
+        for token in _fetch_active_tokens(opted_in):
+            tokens_by_user.setdefault(token["user_id"], []).append(token)
+
+        notifications = []
+        fcm_groups = []
+        results = []
+        for alert in alerts:
+            users = alert["users"]
+            opted_in = [u for u in users if u.id in opted_in_ids]
+            notifications.extend(
+                Notification(
+                    title=alert["title"],
+                    message=alert["message"],
+                    type=alert["type"],
+                    topic=topic,
+                    user=user,
+                )
+                for user in opted_in
+            )
+
+            tokens = [t for u in opted_in for t in tokens_by_user.get(u.id, [])]
+            if tokens:
+                fcm_groups.append(
+                    (
+                        tokens,
+                        alert["title"],
+                        alert["message"],
+                        alert["type"],
+                        alert.get("extra_data"),
+                    )
+                )
+
+            results.append(
+                {
+                    "notified": len(opted_in) if tokens else 0,
+                    "skipped": len(users) - len(opted_in),
+                }
+            )
+
+        Notification.objects.bulk_create(notifications)
+        logger.debug(f"Persisted {len(notifications)} notification records")
+
+        if fcm_groups:
+            _dispatch_fcm_multicast(fcm_groups, topic)
+
+        return results
+
 
 def _filter_users_by_topic_preferences(users, topic):
     if not isinstance(users, QuerySet):
@@ -83,58 +153,40 @@ def _fetch_active_tokens(users):
 
 
 def _dispatch_fcm(tokens, title, message, type, topic, extra_data):
-    if not firebase_admin._apps:
-        logger.warning("Firebase not initialized; skipping FCM dispatch")
-        return 0
-
-    android_config = messaging.AndroidConfig(
-        priority="high",
-        notification=messaging.AndroidNotification(
-            channel_id=type if type in ("warning", "error") else "info",
-        ),
+    return _dispatch_fcm_multicast(
+        [(tokens, title, message, type, extra_data)], topic
     )
 
-    apns_config = messaging.APNSConfig(
-        payload=messaging.APNSPayload(
-            aps=messaging.Aps(sound="default"),
-        ),
-    )
 
-    fcm_messages = []
-    for token_info in tokens:
-        msg = messaging.Message(
-            token=token_info["fcm_token"],
-            notification=messaging.Notification(title=title, body=message),
-            data={
-                "type": type,
-                "topic": topic,
-                **(extra_data or {}),
-            },
-            android=android_config,
-            apns=apns_config,
-        )
-        fcm_messages.append(msg)
-
-    response = messaging.send_each(fcm_messages)
-
-    invalid_token_ids = set()
-    for idx, resp in enumerate(response.responses):
-        if not resp.success:
-            exc = resp.exception
-            if exc is not None:
-                try:
-                    from firebase_admin.exceptions import NotFoundError
-                    if isinstance(exc, NotFoundError):
-                        invalid_token_ids.add(tokens[idx]["id"])
-                        continue
-                except ImportError:
-                    pass
-                logger.warning(
-                    f"FCM send failed for token {tokens[idx]['fcm_token'][:20]}...: {exc}"
+def _dispatch_fcm_multicast(groups, topic):
+    """
+    Queue one FCMDispatchJob per (tokens, title, message, type, extra_data)
+    group, split into chunks of FCM_MULTICAST_LIMIT tokens. The jobs are sent
+    by the run_fcm_worker command, or right away if FCM_ASYNC_DISPATCH is off.
+
+    Returns the number of jobs queued.
+    """
+    jobs = []
+    for tokens, title, message, type, extra_data in groups:
+        for start in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+            chunk = tokens[start : start + FCM_MULTICAST_LIMIT]
+            jobs.append(
+                FCMDispatchJob(
+                    title=title,
+                    message=message,
+                    type=type,
+                    topic=topic,
+                    extra_data=extra_data or {},
+                    token_ids=[t["id"] for t in chunk],
                 )
+            )
+
+    FCMDispatchJob.objects.bulk_create(jobs)
+    logger.debug(f"Queued {len(jobs)} FCM dispatch jobs")
 
-    if invalid_token_ids:
-        FCMDevice.objects.filter(id__in=invalid_token_ids).update(is_active=False)
-        logger.info(f"Deactivated {len(invalid_token_ids)} invalid FCM tokens")
+    if not settings.FCM_ASYNC_DISPATCH:
+        for job in jobs:
+            job.attempts = 1
+        process_jobs(jobs)
 
-    return len(invalid_token_ids)
+    return len(jobs)
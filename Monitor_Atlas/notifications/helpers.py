@@ -1,25 +1,59 @@
-from guardian.shortcuts import get_users_with_perms
-
 from infrastructure.models import Device
 from users.models import User
 
+from .models import DeviceRecipient
+
 
 def get_users_for_device(dev_eui):
-    device = Device.objects.filter(dev_eui=dev_eui).first()
-    if not device:
+    users = [
+        recipient.user
+        for recipient in DeviceRecipient.objects.filter(
+            device__dev_eui=dev_eui
+        ).select_related("user")
+    ]
+    if not users and not Device.objects.filter(dev_eui=dev_eui).exists():
         raise ValueError(f"Device with dev_eui '{dev_eui}' not found.")
 
-    users = get_users_with_perms(device, only_with_perms_in=["view_device"])
     superuser = User.objects.filter(is_superuser=True).first()
 
-    result = list(users)
-
     if superuser and superuser not in users:
-        result.append(superuser)
+        users.append(superuser)
 
-    if not result:
+    if not users:
         raise ValueError(
             f"No users found with permission to view device '{dev_eui}'."
         )
 
+    return users
+
+
+def get_users_for_devices(dev_euis):
+    """
+    Batch version of get_users_for_device.
+
+    Reads the recipients of every device from the DeviceRecipient index (see
+    notifications/recipients.py) and adds the first superuser, in a fixed
+    number of queries regardless of how many devices are passed.
+
+    Returns a dict mapping each existing dev_eui to its list of users.
+    Unknown dev_euis are left out.
+    """
+    devices = dict(
+        Device.objects.filter(dev_eui__in=set(dev_euis)).values_list("id", "dev_eui")
+    )
+    if not devices:
+        return {}
+
+    result = {dev_eui: [] for dev_eui in devices.values()}
+    for recipient in DeviceRecipient.objects.filter(
+        device_id__in=list(devices)
+    ).select_related("user"):
+        result[devices[recipient.device_id]].append(recipient.user)
+
+    superuser = User.objects.filter(is_superuser=True).first()
+    if superuser:
+        for users in result.values():
+            if superuser not in users:
+                users.append(superuser)
+
     return result
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from infrastructure.models import Device
+from notifications.recipients import (
+    push_mapping_invalidations,
+    rebuild_device_recipients,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the device recipient index from object permissions. Needed "
+        "after permission changes that skip signals, such as bulk assign_perm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--notify-hermes",
+            action="store_true",
+            help="Ask Hermes to reload the mapping of the devices that changed.",
+        )
+
+    def handle(self, *args, **options):
+        changed = rebuild_device_recipients()
+        self.stdout.write(
+            self.style.SUCCESS(f"✔ Recipients updated for {len(changed)} devices.")
+        )
+
+        if options["notify_hermes"] and changed:
+            dev_euis = Device.objects.filter(id__in=changed).values_list(
+                "dev_eui", flat=True
+            )
+            push_mapping_invalidations(list(dev_euis), background=False)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from notifications.dispatcher import run_worker
+
+
+class Command(BaseCommand):
+    help = "Send queued FCM push notifications (FCMDispatchJob) in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the jobs that are due and exit.",
+        )
+
+    def handle(self, *args, **options):
+        run_worker(once=options["once"])
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_device_recipients(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    Device = apps.get_model("infrastructure", "Device")
+    DeviceRecipient = apps.get_model("notifications", "DeviceRecipient")
+    UserObjectPermission = apps.get_model("guardian", "UserObjectPermission")
+    GroupObjectPermission = apps.get_model("guardian", "GroupObjectPermission")
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Membership = User._meta.get_field("groups").remote_field.through
+
+    content_type = ContentType.objects.filter(
+        app_label="infrastructure", model="device"
+    ).first()
+    if content_type is None:
+        return
+
+    perm_filter = {
+        "content_type": content_type,
+        "permission__content_type": content_type,
+        "permission__codename": "view_device",
+    }
+    device_ids = set(Device.objects.values_list("id", flat=True))
+
+    pairs = {
+        (object_pk, user_id)
+        for object_pk, user_id in UserObjectPermission.objects.filter(
+            **perm_filter
+        ).values_list("object_pk", "user_id")
+        if object_pk in device_ids
+    }
+
+    members_by_group = {}
+    for group_id, user_id in Membership.objects.values_list("group_id", "user_id"):
+        members_by_group.setdefault(group_id, set()).add(user_id)
+    for object_pk, group_id in GroupObjectPermission.objects.filter(
+        **perm_filter
+    ).values_list("object_pk", "group_id"):
+        if object_pk in device_ids:
+            for user_id in members_by_group.get(group_id, ()):
+                pairs.add((object_pk, user_id))
+
+    DeviceRecipient.objects.bulk_create(
+        [DeviceRecipient(device_id=d, user_id=u) for d, u in pairs],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('guardian', '0001_initial'),
+        ('infrastructure', '0005_measurements_label'),
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='infrastructure.device')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_recipients', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'user'), name='unique_device_recipient')],
+            },
+        ),
+        migrations.RunPython(backfill_device_recipients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:19
+
+import django.utils.timezone
+import organizations.hasher
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_device_recipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FCMDispatchJob',
+            fields=[
+                ('id', models.CharField(default=organizations.hasher.generate_id, editable=False, max_length=16, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('type', models.CharField(max_length=10)),
+                ('topic', models.CharField(max_length=20)),
+                ('extra_data', models.JSONField(blank=True, default=dict)),
+                ('token_ids', models.JSONField(default=list, help_text='FCMDevice ids still to be sent to')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('success_count', models.PositiveIntegerField(default=0)),
+                ('failure_count', models.PositiveIntegerField(default=0)),
+                ('invalid_token_count', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='notificatio_status_03c049_idx')],
+            },
+        ),
+    ]
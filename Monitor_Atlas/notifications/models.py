@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from organizations.hasher import generate_id
 
 
@@ -56,3 +57,63 @@ class NotificationSettings(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class DeviceRecipient(models.Model):
+    """
+    Materialized index of the users that receive a device's alerts: everyone
+    with `view_device` on it, directly or through a group. Kept up to date by
+    the signals in notifications/signals.py; superusers are not stored here
+    and are added at lookup time.
+    """
+
+    device = models.ForeignKey(
+        "infrastructure.Device", on_delete=models.CASCADE, related_name="recipients"
+    )
+    user = models.ForeignKey(
+        "users.User", on_delete=models.CASCADE, related_name="device_recipients"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["device", "user"], name="unique_device_recipient"
+            )
+        ]
+
+
+class FCMDispatchJob(models.Model):
+    """
+    One FCM multicast waiting to be sent (at most 500 tokens), processed by
+    the run_fcm_worker command so requests don't wait on FCM. Counters
+    accumulate over attempts and back the delivery stats.
+    """
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+    id = models.CharField(
+        max_length=16, primary_key=True, default=generate_id, editable=False
+    )
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    type = models.CharField(max_length=10)
+    topic = models.CharField(max_length=20)
+    extra_data = models.JSONField(default=dict, blank=True)
+    token_ids = models.JSONField(
+        default=list, help_text="FCMDevice ids still to be sent to"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    success_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+    invalid_token_count = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
@@ -0,0 +1,188 @@
+"""
+Device -> recipient index used for alert routing.
+
+Resolving who may see a device through guardian means joining user and group
+object permissions with group memberships on every alert. Instead, the result
+is materialized in DeviceRecipient and refreshed whenever one of its inputs
+changes (see notifications/signals.py). After the refresh commits, Hermes is
+asked to reload its cached device-user mapping for the devices whose
+recipients changed.
+"""
+
+import threading
+
+import requests
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from loguru import logger
+
+from infrastructure.models import Device
+from users.models import User
+
+from .models import DeviceRecipient
+
+RECIPIENT_PERMISSION = "view_device"
+
+
+def _permission_filter(device_ids=None):
+    content_type = ContentType.objects.get_for_model(Device)
+    perm_filter = {
+        "content_type": content_type,
+        "permission__content_type": content_type,
+        "permission__codename": RECIPIENT_PERMISSION,
+    }
+    if device_ids is not None:
+        perm_filter["object_pk__in"] = list(device_ids)
+    return perm_filter
+
+
+def compute_device_recipients(device_ids=None):
+    """
+    Resolve the users with `view_device` on each device, directly or through
+    a group, in a fixed number of queries. Pass None for every device.
+
+    Returns a dict mapping device id to a set of user ids.
+    """
+    devices = Device.objects.all()
+    if device_ids is not None:
+        devices = devices.filter(id__in=list(device_ids))
+    recipients = {pk: set() for pk in devices.values_list("id", flat=True)}
+    if not recipients:
+        return recipients
+
+    perm_filter = _permission_filter(None if device_ids is None else recipients)
+
+    for object_pk, user_id in UserObjectPermission.objects.filter(
+        **perm_filter
+    ).values_list("object_pk", "user_id"):
+        if object_pk in recipients:
+            recipients[object_pk].add(user_id)
+
+    group_ids_by_device = {}
+    for object_pk, group_id in GroupObjectPermission.objects.filter(
+        **perm_filter
+    ).values_list("object_pk", "group_id"):
+        if object_pk in recipients:
+            group_ids_by_device.setdefault(object_pk, set()).add(group_id)
+
+    if group_ids_by_device:
+        members_by_group = {}
+        for group_id, user_id in User.groups.through.objects.filter(
+            group_id__in=set().union(*group_ids_by_device.values())
+        ).values_list("group_id", "user_id"):
+            members_by_group.setdefault(group_id, set()).add(user_id)
+
+        for object_pk, group_ids in group_ids_by_device.items():
+            for group_id in group_ids:
+                recipients[object_pk].update(members_by_group.get(group_id, ()))
+
+    return recipients
+
+
+def rebuild_device_recipients(device_ids=None):
+    """
+    Recompute the index for the given devices (all devices if None) and
+    apply only the difference. Returns the ids of the devices whose
+    recipients changed.
+    """
+    recipients = compute_device_recipients(device_ids)
+    if not recipients:
+        return set()
+
+    current = {pk: set() for pk in recipients}
+    stored = DeviceRecipient.objects.all()
+    if device_ids is not None:
+        stored = stored.filter(device_id__in=list(recipients))
+    for device_id, user_id in stored.values_list("device_id", "user_id"):
+        if device_id in current:
+            current[device_id].add(user_id)
+
+    to_create = []
+    to_delete = {}
+    for device_id, user_ids in recipients.items():
+        for user_id in user_ids - current[device_id]:
+            to_create.append(DeviceRecipient(device_id=device_id, user_id=user_id))
+        removed = current[device_id] - user_ids
+        if removed:
+            to_delete[device_id] = removed
+
+    with transaction.atomic():
+        for device_id, user_ids in to_delete.items():
+            DeviceRecipient.objects.filter(
+                device_id=device_id, user_id__in=user_ids
+            ).delete()
+        DeviceRecipient.objects.bulk_create(to_create, ignore_conflicts=True)
+
+    return {r.device_id for r in to_create} | set(to_delete)
+
+
+def devices_for_groups(group_ids):
+    """Ids of the devices a group grants `view_device` on."""
+    return set(
+        GroupObjectPermission.objects.filter(
+            group_id__in=list(group_ids), **_permission_filter()
+        ).values_list("object_pk", flat=True)
+    )
+
+
+def schedule_recipient_refresh(device_ids):
+    """
+    Refresh the index for these devices once the current transaction commits,
+    so it never reflects permission changes that were rolled back.
+    """
+    device_ids = set(device_ids)
+    if device_ids:
+        transaction.on_commit(lambda: refresh_device_recipients(device_ids))
+
+
+def refresh_device_recipients(device_ids):
+    """Rebuild the index for these devices and tell Hermes what changed."""
+    try:
+        changed = rebuild_device_recipients(device_ids)
+    except Exception as e:
+        logger.exception(f"Failed to refresh device recipients: {e}")
+        return
+
+    if changed:
+        dev_euis = list(
+            Device.objects.filter(id__in=changed).values_list("dev_eui", flat=True)
+        )
+        push_mapping_invalidations(dev_euis)
+
+
+def push_mapping_invalidations(dev_euis, background=True):
+    """
+    Ask Hermes to reload its device-user mapping for these devices, by
+    default from a background thread so requests don't wait on Hermes.
+    """
+    if not dev_euis or not getattr(settings, "HERMES_API_URL", ""):
+        return
+
+    if not background:
+        _post_mapping_invalidations(list(dev_euis))
+        return
+
+    thread = threading.Thread(
+        target=_post_mapping_invalidations, args=(list(dev_euis),), daemon=True
+    )
+    thread.start()
+
+
+def _post_mapping_invalidations(dev_euis):
+    url = f"{settings.HERMES_API_URL}/internal/mappings/device-user"
+    headers = {"X-API-Key": getattr(settings, "SERVICE_API_KEY", "")}
+
+    with requests.Session() as session:
+        for dev_eui in dev_euis:
+            try:
+                response = session.post(
+                    url, headers=headers, params={"dev_eui": dev_eui}, timeout=10
+                )
+                if response.status_code != 200:
+                    logger.error(
+                        f"Error refreshing Hermes mapping for {dev_eui}: {response.status_code} {response.text}"
+                    )
+            except requests.RequestException as e:
+                logger.error(f"Failed to refresh Hermes mapping for {dev_eui}: {e}")
@@ -1,8 +1,12 @@
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
 
+from infrastructure.models import Device
 from users.models import User
 from .models import NotificationSettings
+from .recipients import devices_for_groups, schedule_recipient_refresh
 
 
 @receiver(post_save, sender=User)
@@ -18,3 +22,37 @@ def create_notification_settings(sender, instance, created, **kwargs):
                 }
             },
         )
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def refresh_recipients_on_permission_change(sender, instance, **kwargs):
+    """Keep the device recipient index in sync with device object permissions."""
+    if instance.content_type_id == ContentType.objects.get_for_model(Device).id:
+        schedule_recipient_refresh([instance.object_pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def refresh_recipients_on_membership_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Group membership changes, including the ones WorkspaceMembership makes
+    when a user joins, leaves or changes role, affect every device the
+    groups can view.
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        # group.user_set changes: `instance` is the group
+        group_ids = [instance.pk]
+    elif action == "pre_clear":
+        group_ids = list(instance.groups.values_list("id", flat=True))
+    else:
+        group_ids = pk_set or []
+
+    if group_ids:
+        schedule_recipient_refresh(devices_for_groups(group_ids))
@@ -1,3 +1,387 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from firebase_admin import exceptions, messaging
+from guardian.shortcuts import assign_perm, get_users_with_perms, remove_perm
+from rest_framework.test import APIClient
+
+from chirpstack.models import DeviceProfile
+from infrastructure.models import Application, Device, Type
+from notifications.helpers import get_users_for_device, get_users_for_devices
+from notifications.dispatcher import claim_jobs, delivery_stats, process_jobs
+from notifications.models import (
+    DeviceRecipient,
+    FCMDevice,
+    FCMDispatchJob,
+    Notification,
+    NotificationSettings,
+)
+from notifications.recipients import rebuild_device_recipients
+from organizations.models import Subscription, Tenant, Workspace
+from users.models import User
+
+
+class AlertTestMixin:
+    def create_base(self):
+        # Don't reach out to Hermes when the recipient index changes
+        patcher = mock.patch("notifications.recipients.push_mapping_invalidations")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        subscription = Subscription.objects.create(
+            name="sub",
+            description="sub",
+            can_have_gateways=False,
+            max_device_count=0,
+            max_gateway_count=0,
+        )
+        self.tenant = Tenant.objects.create(name="tenant", subscription=subscription)
+        self.workspace = Workspace.objects.create(
+            name="ws",
+            description="ws",
+            tenant=self.tenant,
+        )
+        self.device_type = Type.objects.create(name="sensor", description="sensor")
+        self.device_profile = DeviceProfile.objects.create(
+            name="profile",
+            description="profile",
+            region="US915",
+            workspace=self.workspace,
+            abp_rx1_delay=1,
+            abp_rx1_dr_offset=0,
+            abp_rx2_dr=8,
+            abp_rx2_freq=923300000,
+        )
+        self.application = Application.objects.create(
+            name="app", workspace=self.workspace
+        )
+        self.superuser = self.create_user("admin", is_superuser=True)
+
+    def create_user(self, username, is_superuser=False):
+        create = User.objects.create_superuser if is_superuser else User.objects.create_user
+        return create(
+            username=username,
+            password="password",
+            name=username,
+            last_name="User",
+            email=f"{username}@example.com",
+            phone="123",
+            tenant=self.tenant,
+        )
+
+    def create_device(self, dev_eui):
+        return Device.objects.create(
+            dev_eui=dev_eui,
+            name=dev_eui,
+            description=dev_eui,
+            workspace=self.workspace,
+            device_type=self.device_type,
+            device_profile=self.device_profile,
+            application=self.application,
+        )
+
+
+class GetUsersForDevicesTests(AlertTestMixin, TestCase):
+    def setUp(self):
+        self.create_base()
+        self.direct = self.create_user("direct")
+        self.member = self.create_user("member")
+        self.outsider = self.create_user("outsider")
+
+        self.group = Group.objects.create(name="operators")
+
+        self.device_a = self.create_device("aaaaaaaaaaaaaaaa")
+        self.device_b = self.create_device("bbbbbbbbbbbbbbbb")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.groups.add(self.group)
+            assign_perm("view_device", self.direct, self.device_a)
+            assign_perm("view_device", self.group, self.device_b)
+            assign_perm("change_device", self.outsider, self.device_a)
+
+    def recipients(self, device):
+        return {u.id for u in get_users_for_device(device.dev_eui)}
+
+    def test_matches_single_device_lookup(self):
+        result = get_users_for_devices(
+            [self.device_a.dev_eui, self.device_b.dev_eui]
+        )
+
+        for device in (self.device_a, self.device_b):
+            self.assertEqual(
+                {u.id for u in result[device.dev_eui]}, self.recipients(device)
+            )
+        self.assertEqual(
+            self.recipients(self.device_a), {self.direct.id, self.superuser.id}
+        )
+        self.assertEqual(
+            self.recipients(self.device_b), {self.member.id, self.superuser.id}
+        )
+
+    def test_index_matches_guardian(self):
+        for device in (self.device_a, self.device_b):
+            expected = set(
+                get_users_with_perms(
+                    device, only_with_perms_in=["view_device"]
+                ).values_list("id", flat=True)
+            )
+            self.assertEqual(
+                set(device.recipients.values_list("user_id", flat=True)), expected
+            )
+
+    @mock.patch("notifications.recipients.push_mapping_invalidations")
+    def test_revoking_permission_updates_index(self, push):
+        with self.captureOnCommitCallbacks(execute=True):
+            remove_perm("view_device", self.direct, self.device_a)
+
+        self.assertEqual(self.recipients(self.device_a), {self.superuser.id})
+        push.assert_called_once_with([self.device_a.dev_eui])
+
+    @mock.patch("notifications.recipients.push_mapping_invalidations")
+    def test_group_membership_updates_index(self, push):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outsider.groups.add(self.group)
+        self.assertIn(self.outsider.id, self.recipients(self.device_b))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.clear()
+        self.assertEqual(self.recipients(self.device_b), {self.superuser.id})
+        self.assertEqual(push.call_count, 2)
+
+    @mock.patch("notifications.recipients.push_mapping_invalidations")
+    def test_unchanged_recipients_are_not_pushed(self, push):
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_perm("change_device", self.direct, self.device_a)
+
+        push.assert_not_called()
+
+    def test_rebuild_restores_index(self):
+        DeviceRecipient.objects.all().delete()
+
+        changed = rebuild_device_recipients()
+
+        self.assertEqual(changed, {self.device_a.id, self.device_b.id})
+        self.assertEqual(
+            self.recipients(self.device_a), {self.direct.id, self.superuser.id}
+        )
+
+    def test_unknown_devices_are_left_out(self):
+        result = get_users_for_devices([self.device_a.dev_eui, "ffffffffffffffff"])
+
+        self.assertEqual(list(result), [self.device_a.dev_eui])
+
+    def test_query_count_does_not_grow_with_devices(self):
+        dev_euis = [self.device_a.dev_eui, self.device_b.dev_eui]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                device = self.create_device(f"c{i:015d}")
+                assign_perm("view_device", self.direct, device)
+                dev_euis.append(device.dev_eui)
+
+        with self.assertNumQueries(3):
+            get_users_for_devices(dev_euis)
+
+
+class AlertBatchTests(AlertTestMixin, TestCase):
+    url = "/api/v1/notifications/notifications/alert/batch/"
+
+    def setUp(self):
+        self.create_base()
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_KEY=settings.SERVICE_API_KEY)
+
+        self.user = self.create_user("viewer")
+        self.muted = self.create_user("muted")
+        NotificationSettings.objects.filter(user=self.muted).update(
+            topic_preferences={"alerts": False}
+        )
+
+        self.device_a = self.create_device("aaaaaaaaaaaaaaaa")
+        self.device_b = self.create_device("bbbbbbbbbbbbbbbb")
+        with self.captureOnCommitCallbacks(execute=True):
+            for device in (self.device_a, self.device_b):
+                assign_perm("view_device", self.user, device)
+                assign_perm("view_device", self.muted, device)
+
+    def alert(self, dev_eui, **overrides):
+        return {
+            "title": "Voltage Alert",
+            "message": f"Voltage above maximum on {dev_eui}",
+            "type": "warning",
+            "dev_eui": dev_eui,
+            **overrides,
+        }
+
+    @mock.patch("notifications.engine._dispatch_fcm_multicast")
+    def test_batch_persists_notifications_and_reports_per_alert(self, dispatch):
+        response = self.client.post(
+            self.url,
+            {
+                "alerts": [
+                    self.alert(self.device_a.dev_eui),
+                    self.alert("ffffffffffffffff"),
+                    {"title": "Missing fields"},
+                    self.alert(self.device_b.dev_eui),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]["dev_eui"], self.device_a.dev_eui)
+        self.assertEqual(results[0]["skipped"], 1)
+        self.assertEqual(results[1]["status"], "error")
+        self.assertEqual(results[2]["status"], "error")
+        self.assertEqual(results[3]["dev_eui"], self.device_b.dev_eui)
+
+        # viewer + superuser for each device; the muted user opted out
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertFalse(Notification.objects.filter(user=self.muted).exists())
+        # No active FCM tokens, so nothing to dispatch
+        dispatch.assert_not_called()
+
+    def test_invalid_fields_are_reported_per_alert(self):
+        response = self.client.post(
+            self.url,
+            {
+                "alerts": [
+                    self.alert(["aaaaaaaaaaaaaaaa"]),
+                    self.alert({"dev_eui": "x"}),
+                    self.alert(self.device_a.dev_eui, title=""),
+                    self.alert(self.device_a.dev_eui, type=None),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], ["error"] * 4)
+        self.assertIsNone(results[0]["dev_eui"])
+        self.assertIn("'title'", results[2]["error"])
+        self.assertIn("'type'", results[3]["error"])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_rejects_empty_batch(self):
+        response = self.client.post(self.url, {"alerts": []}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_service_key_or_permission(self):
+        client = APIClient()
+        response = client.post(
+            self.url,
+            {"alerts": [self.alert(self.device_a.dev_eui)]},
+            format="json",
+        )
+
+        self.assertIn(response.status_code, (401, 403))
+
+
+class FCMDispatchTests(AlertTestMixin, TestCase):
+    def setUp(self):
+        self.create_base()
+        self.user = self.create_user("viewer")
+        self.device = self.create_device("aaaaaaaaaaaaaaaa")
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_perm("view_device", self.user, self.device)
+
+        self.tokens = [
+            FCMDevice.objects.create(
+                user=self.user, fcm_token=f"token-{i}", platform="android"
+            )
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_KEY=settings.SERVICE_API_KEY)
+
+    def send_alert(self):
+        return self.client.post(
+            "/api/v1/notifications/notifications/alert/",
+            {
+                "title": "Voltage Alert",
+                "message": "Voltage above maximum",
+                "type": "warning",
+                "dev_eui": self.device.dev_eui,
+            },
+            format="json",
+        )
+
+    @mock.patch("notifications.dispatcher.messaging.send_each_for_multicast")
+    def test_alert_queues_job_without_calling_fcm(self, send):
+        response = self.send_alert()
+
+        self.assertEqual(response.status_code, 200)
+        send.assert_not_called()
+        job = FCMDispatchJob.objects.get()
+        self.assertEqual(job.status, "pending")
+        self.assertEqual(sorted(job.token_ids), sorted(t.id for t in self.tokens))
+        self.assertEqual(job.extra_data, {"dev_eui": self.device.dev_eui})
+
+    @mock.patch("notifications.dispatcher.messaging.send_each_for_multicast")
+    def test_worker_retries_transient_and_deactivates_invalid_tokens(self, send):
+        self.send_alert()
+        job = FCMDispatchJob.objects.get()
+        by_token = {t.fcm_token: t for t in self.tokens}
+        outcomes = {
+            "token-0": None,
+            "token-1": exceptions.NotFoundError("unregistered"),
+            "token-2": exceptions.UnavailableError("try again"),
+        }
+
+        def respond(multicast):
+            return messaging.BatchResponse(
+                [
+                    messaging.SendResponse(
+                        None if outcomes[token] else {"name": "ok"}, outcomes[token]
+                    )
+                    for token in multicast.tokens
+                ]
+            )
+
+        send.side_effect = respond
+        self.assertEqual(process_jobs(claim_jobs(10)), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "pending")
+        self.assertEqual(job.token_ids, [by_token["token-2"].id])
+        self.assertEqual(job.success_count, 1)
+        self.assertEqual(job.invalid_token_count, 1)
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        self.assertFalse(
+            FCMDevice.objects.get(id=by_token["token-1"].id).is_active
+        )
+
+        # Retry once due: only the transient token is sent again
+        outcomes["token-2"] = None
+        FCMDispatchJob.objects.update(next_attempt_at=timezone.now())
+        process_jobs(claim_jobs(10))
+
+        self.assertEqual(send.call_args.args[0].tokens, ["token-2"])
+        job.refresh_from_db()
+        self.assertEqual(job.status, "sent")
+        self.assertEqual(job.success_count, 2)
+        self.assertEqual(job.attempts, 2)
+
+        stats = delivery_stats()
+        self.assertEqual(stats["jobs"]["sent"], 1)
+        self.assertEqual(stats["tokens"]["delivered"], 2)
+        self.assertEqual(stats["tokens"]["invalid_tokens"], 1)
+
+    @override_settings(FCM_MAX_ATTEMPTS=1)
+    @mock.patch("notifications.dispatcher.messaging.send_each_for_multicast")
+    def test_job_fails_after_max_attempts(self, send):
+        send.side_effect = exceptions.UnavailableError("FCM down")
+        self.send_alert()
+
+        process_jobs(claim_jobs(10))
+
+        job = FCMDispatchJob.objects.get()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.failure_count, 3)
+        self.assertIn("FCM down", job.last_error)
@@ -1,7 +1,7 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from drf_spectacular.utils import (
     extend_schema,
     extend_schema_view,
@@ -17,8 +17,9 @@ from .serializers import (
     NotificationSerializer,
     NotificationSettingsSerializer,
 )
+from .dispatcher import delivery_stats
 from .engine import NotificationsEngine
-from .helpers import get_users_for_device
+from .helpers import get_users_for_device, get_users_for_devices
 from roles.permissions import IsServiceOrHasPermission, IsOwnerOrAdmin
 
 _PARAM_USER_ID = OpenApiParameter(
@@ -187,8 +188,49 @@ class NotificationSettingsViewSet(
             )
         ],
     ),
+    alert_batch=extend_schema(
+        description=(
+            "Batch alert endpoint for external services (Hermes). "
+            "Returns one result per alert, in request order."
+        ),
+        examples=[
+            OpenApiExample(
+                "Batch alert example",
+                value={
+                    "alerts": [
+                        {
+                            "title": "Voltage Alert",
+                            "message": "Voltage above maximum limit on ch1.",
+                            "type": "warning",
+                            "dev_eui": "abc123",
+                        },
+                        {
+                            "title": "Current Alert",
+                            "message": "Current below minimum limit on ch2.",
+                            "type": "warning",
+                            "dev_eui": "def456",
+                        },
+                    ]
+                },
+                request_only=True,
+            )
+        ],
+    ),
+    delivery_stats=extend_schema(
+        description=(
+            "FCM delivery stats for dispatch jobs created in the last `hours` "
+            "hours (default 24). Admin only."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="hours", description="Window in hours", required=False, type=int
+            )
+        ],
+    ),
 )
 class NotificationViewSet(viewsets.ModelViewSet):
+    MAX_BATCH_ALERTS = 500
+
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
@@ -262,3 +304,94 @@ class NotificationViewSet(viewsets.ModelViewSet):
             },
             status=200,
         )
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="alert/batch",
+        permission_classes=[IsServiceOrHasPermission],
+    )
+    def alert_batch(self, request):
+        alerts = request.data.get("alerts") if isinstance(request.data, dict) else None
+        if not isinstance(alerts, list) or not alerts:
+            return Response({"error": "'alerts' must be a non-empty list."}, status=400)
+        if len(alerts) > self.MAX_BATCH_ALERTS:
+            return Response(
+                {"error": f"At most {self.MAX_BATCH_ALERTS} alerts per request."},
+                status=400,
+            )
+
+        required_fields = ["title", "message", "type", "dev_eui"]
+        results = [None] * len(alerts)
+        for idx, data in enumerate(alerts):
+            if not isinstance(data, dict):
+                results[idx] = {"status": "error", "error": "Invalid alert."}
+                continue
+            for field in required_fields:
+                value = data.get(field)
+                if not isinstance(value, str) or not value.strip():
+                    dev_eui = data.get("dev_eui")
+                    results[idx] = {
+                        "dev_eui": dev_eui if isinstance(dev_eui, str) else None,
+                        "status": "error",
+                        "error": f"'{field}' must be a non-empty string.",
+                    }
+                    break
+
+        users_by_device = get_users_for_devices(
+            [data["dev_eui"] for idx, data in enumerate(alerts) if results[idx] is None]
+        )
+
+        pending = []
+        for idx, data in enumerate(alerts):
+            if results[idx] is not None:
+                continue
+            dev_eui = data["dev_eui"]
+            if dev_eui not in users_by_device:
+                error = f"Device with dev_eui '{dev_eui}' not found."
+            elif not users_by_device[dev_eui]:
+                error = f"No users found with permission to view device '{dev_eui}'."
+            else:
+                pending.append(idx)
+                continue
+            results[idx] = {"dev_eui": dev_eui, "status": "error", "error": error}
+
+        sent = NotificationsEngine.send_notifications_batch(
+            alerts=[
+                {
+                    "users": users_by_device[alerts[idx]["dev_eui"]],
+                    "title": alerts[idx]["title"],
+                    "message": alerts[idx]["message"],
+                    "type": alerts[idx]["type"],
+                    "extra_data": {"dev_eui": alerts[idx]["dev_eui"]},
+                }
+                for idx in pending
+            ],
+            topic="alerts",
+        )
+
+        for idx, outcome in zip(pending, sent):
+            results[idx] = {
+                "dev_eui": alerts[idx]["dev_eui"],
+                "status": "alert_sent" if outcome["notified"] else "alert_processed",
+                "notified": outcome["notified"],
+                "skipped": outcome["skipped"],
+            }
+
+        return Response(
+            {
+                "status": "alerts_processed",
+                "notified": sum(outcome["notified"] for outcome in sent),
+                "results": results,
+            },
+            status=200,
+        )
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def delivery_stats(self, request):
+        try:
+            hours = int(request.query_params.get("hours", 24))
+        except ValueError:
+            return Response({"error": "'hours' must be an integer."}, status=400)
+
+        return Response(delivery_stats(hours=max(1, hours)))
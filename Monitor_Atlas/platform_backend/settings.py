@@ -304,6 +304,16 @@ MAILGUN_FROM = env("MAILGUN_FROM", default="no-reply@yourdomain.com")
 
 CHIRPSTACK_BASE_URL = env("CHIRPSTACK_BASE_URL", default=None)
 CHIRPSTACK_JWT_TOKEN = env("CHIRPSTACK_JWT_TOKEN", default=None)
+# Max ChirpStack requests in flight during sync_chirpstack
+CHIRPSTACK_SYNC_CONCURRENCY = env.int("CHIRPSTACK_SYNC_CONCURRENCY", default=8)
+# Seconds between status refreshes in the `refresh_chirpstack_status` worker
+CHIRPSTACK_STATUS_REFRESH_INTERVAL = env.int(
+    "CHIRPSTACK_STATUS_REFRESH_INTERVAL", default=60
+)
+# Seconds between refreshes of device `is_disabled`, which needs one GET per device
+CHIRPSTACK_DISABLED_REFRESH_INTERVAL = env.int(
+    "CHIRPSTACK_DISABLED_REFRESH_INTERVAL", default=3600
+)
 
 
 # ============================================================================
@@ -353,3 +363,13 @@ if HERMES_API_URL.startswith("https://") and ":5000" in HERMES_API_URL:
 # ============================================================================
 
 FIREBASE_ADMIN_CREDENTIALS = env("FIREBASE_ADMIN_CREDENTIALS", default=None)
+
+# FCM pushes are queued as FCMDispatchJob rows and sent by the run_fcm_worker
+# management command. Set FCM_ASYNC_DISPATCH=false to send them in-process
+# instead (e.g. in development without a worker).
+FCM_ASYNC_DISPATCH = env.bool("FCM_ASYNC_DISPATCH", default=True)
+FCM_WORKER_POLL_INTERVAL = env.float("FCM_WORKER_POLL_INTERVAL", default=1.0)
+FCM_WORKER_BATCH_SIZE = env.int("FCM_WORKER_BATCH_SIZE", default=20)
+FCM_MAX_ATTEMPTS = env.int("FCM_MAX_ATTEMPTS", default=5)
+FCM_RETRY_BASE_DELAY = env.int("FCM_RETRY_BASE_DELAY", default=15)
+FCM_JOB_RETENTION_DAYS = env.int("FCM_JOB_RETENTION_DAYS", default=7)
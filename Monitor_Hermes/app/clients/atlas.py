@@ -1,13 +1,24 @@
+import time
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from app.settings import settings
 import loguru
+from app.utils.metrics import (
+    ATLAS_IN_FLIGHT,
+    ATLAS_REQUEST_ERRORS,
+    ATLAS_REQUEST_SECONDS,
+)
 
 
 class AtlasClient:
     """
     HTTP client to interact with the Atlas API.
     Automatically handles authentication via X-API-Key.
+
+    Requests go through one long-lived pooled httpx.AsyncClient, so
+    connections to Atlas are kept alive and reused. The pool is opened by
+    start() in the FastAPI lifespan (or lazily on first use) and closed
+    by close() at shutdown.
     """
 
     def __init__(
@@ -30,6 +41,94 @@ class AtlasClient:
             verify_ssl if verify_ssl is not None else settings.ATLAS_VERIFY_SSL
         )
         self.headers = {"X-API-Key": self.api_key, "Content-Type": "application/json"}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Open the pooled HTTP client."""
+        self._get_client()
+        loguru.logger.debug("Atlas HTTP client started")
+
+    async def close(self):
+        """Close the pooled HTTP client and its connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            loguru.logger.debug("Atlas HTTP client closed")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            http2 = settings.ATLAS_HTTP2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    loguru.logger.warning(
+                        "ATLAS_HTTP2 is enabled but the 'h2' package is not "
+                        "installed; using HTTP/1.1"
+                    )
+                    http2 = False
+
+            self._client = httpx.AsyncClient(
+                verify=self.verify_ssl,
+                http2=http2,
+                timeout=settings.ATLAS_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=settings.ATLAS_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.ATLAS_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.ATLAS_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    def pool_connections(self) -> Tuple[int, int]:
+        """
+        Connection pool usage, for the Prometheus gauges.
+
+        Returns:
+            (open, idle) connections in the pool
+        """
+        connections = []
+        if self._client is not None:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        return len(connections), sum(1 for conn in connections if conn.is_idle())
+
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        url = self._get_full_url(endpoint)
+        request_headers = {**self.headers, **(headers or {})}
+        client = self._get_client()
+
+        ATLAS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = await client.request(
+                method,
+                url,
+                headers=request_headers,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                **kwargs,
+            )
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            reason = (
+                str(e.response.status_code)
+                if isinstance(e, httpx.HTTPStatusError)
+                else type(e).__name__
+            )
+            ATLAS_REQUEST_ERRORS.labels(method, reason).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            ATLAS_IN_FLIGHT.dec()
+            ATLAS_REQUEST_SECONDS.labels(method).observe(elapsed)
 
     def _get_full_url(self, endpoint: str) -> str:
         """
@@ -48,7 +147,7 @@ class AtlasClient:
         endpoint: str,
         params: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: float = 30.0,
+        timeout: Optional[float] = None,
     ) -> httpx.Response:
         """
         Perform a GET request to the Atlas API.
@@ -57,7 +156,7 @@ class AtlasClient:
             endpoint: API endpoint (e.g., /api/v1/devices)
             params: Query string parameters
             headers: Additional headers (merged with default headers)
-            timeout: Timeout in seconds
+            timeout: Timeout in seconds (default: ATLAS_TIMEOUT)
 
         Returns:
             httpx Response
@@ -65,14 +164,10 @@ class AtlasClient:
         Raises:
             httpx.HTTPError: If there is any request error
         """
-        url = self._get_full_url(endpoint)
-        request_headers = {**self.headers, **(headers or {})}
-
-        async with httpx.AsyncClient(timeout=timeout, verify=self.verify_ssl) as client:
-            loguru.logger.debug(f"GET request to {url} with params: {params}")
-            response = await client.get(url, params=params, headers=request_headers)
-            response.raise_for_status()
-            return response
+        loguru.logger.debug(f"GET request to {endpoint} with params: {params}")
+        return await self._request(
+            "GET", endpoint, headers=headers, timeout=timeout, params=params
+        )
 
     async def post(
         self,
@@ -80,7 +175,7 @@ class AtlasClient:
         data: Optional[Dict[str, Any]] = None,
         json: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: float = 30.0,
+        timeout: Optional[float] = None,
     ) -> httpx.Response:
         """
         Perform a POST request to the Atlas API.
@@ -90,7 +185,7 @@ class AtlasClient:
             data: Data to send as form data
             json: Data to send as JSON
             headers: Additional headers (merged with default headers)
-            timeout: Timeout in seconds
+            timeout: Timeout in seconds (default: ATLAS_TIMEOUT)
 
         Returns:
             httpx Response
@@ -98,16 +193,15 @@ class AtlasClient:
         Raises:
             httpx.HTTPError: If there is any request error
         """
-        url = self._get_full_url(endpoint)
-        request_headers = {**self.headers, **(headers or {})}
-
-        async with httpx.AsyncClient(timeout=timeout, verify=self.verify_ssl) as client:
-            loguru.logger.debug(f"POST request to {url}")
-            response = await client.post(
-                url, data=data, json=json, headers=request_headers
-            )
-            response.raise_for_status()
-            return response
+        loguru.logger.debug(f"POST request to {endpoint}")
+        return await self._request(
+            "POST",
+            endpoint,
+            headers=headers,
+            timeout=timeout,
+            data=data,
+            json=json,
+        )
 
     async def put(
         self,
@@ -115,7 +209,7 @@ class AtlasClient:
         data: Optional[Dict[str, Any]] = None,
         json: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: float = 30.0,
+        timeout: Optional[float] = None,
     ) -> httpx.Response:
         """
         Perform a PUT request to the Atlas API.
@@ -125,7 +219,7 @@ class AtlasClient:
             data: Data to send as form data
             json: Data to send as JSON
             headers: Additional headers (merged with default headers)
-            timeout: Timeout in seconds
+            timeout: Timeout in seconds (default: ATLAS_TIMEOUT)
 
         Returns:
             httpx Response
@@ -133,16 +227,15 @@ class AtlasClient:
         Raises:
             httpx.HTTPError: If there is any request error
         """
-        url = self._get_full_url(endpoint)
-        request_headers = {**self.headers, **(headers or {})}
-
-        async with httpx.AsyncClient(timeout=timeout, verify=self.verify_ssl) as client:
-            loguru.logger.debug(f"PUT request to {url}")
-            response = await client.put(
-                url, data=data, json=json, headers=request_headers
-            )
-            response.raise_for_status()
-            return response
+        loguru.logger.debug(f"PUT request to {endpoint}")
+        return await self._request(
+            "PUT",
+            endpoint,
+            headers=headers,
+            timeout=timeout,
+            data=data,
+            json=json,
+        )
 
     async def patch(
         self,
@@ -150,7 +243,7 @@ class AtlasClient:
         data: Optional[Dict[str, Any]] = None,
         json: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: float = 30.0,
+        timeout: Optional[float] = None,
     ) -> httpx.Response:
         """
         Perform a PATCH request to the Atlas API.
@@ -160,7 +253,7 @@ class AtlasClient:
             data: Data to send as form data
             json: Data to send as JSON
             headers: Additional headers (merged with default headers)
-            timeout: Timeout in seconds
+            timeout: Timeout in seconds (default: ATLAS_TIMEOUT)
 
         Returns:
             httpx Response
@@ -168,23 +261,22 @@ class AtlasClient:
         Raises:
             httpx.HTTPError: If there is any request error
         """
-        url = self._get_full_url(endpoint)
-        request_headers = {**self.headers, **(headers or {})}
-
-        async with httpx.AsyncClient(timeout=timeout, verify=self.verify_ssl) as client:
-            loguru.logger.debug(f"PATCH request to {url}")
-            response = await client.patch(
-                url, data=data, json=json, headers=request_headers
-            )
-            response.raise_for_status()
-            return response
+        loguru.logger.debug(f"PATCH request to {endpoint}")
+        return await self._request(
+            "PATCH",
+            endpoint,
+            headers=headers,
+            timeout=timeout,
+            data=data,
+            json=json,
+        )
 
     async def delete(
         self,
         endpoint: str,
         params: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: float = 30.0,
+        timeout: Optional[float] = None,
     ) -> httpx.Response:
         """
         Perform a DELETE request to the Atlas API.
@@ -193,7 +285,7 @@ class AtlasClient:
             endpoint: API endpoint (e.g., /api/v1/devices/123)
             params: Query string parameters
             headers: Additional headers (merged with default headers)
-            timeout: Timeout in seconds
+            timeout: Timeout in seconds (default: ATLAS_TIMEOUT)
 
         Returns:
             httpx Response
@@ -201,14 +293,10 @@ class AtlasClient:
         Raises:
             httpx.HTTPError: If there is any request error
         """
-        url = self._get_full_url(endpoint)
-        request_headers = {**self.headers, **(headers or {})}
-
-        async with httpx.AsyncClient(timeout=timeout, verify=self.verify_ssl) as client:
-            loguru.logger.debug(f"DELETE request to {url}")
-            response = await client.delete(url, params=params, headers=request_headers)
-            response.raise_for_status()
-            return response
+        loguru.logger.debug(f"DELETE request to {endpoint}")
+        return await self._request(
+            "DELETE", endpoint, headers=headers, timeout=timeout, params=params
+        )
 
 
 # Singleton instance of the client for reuse across the application
@@ -143,7 +143,9 @@ Error Handling:
 Fallback Mechanism:
     If this endpoint fails:
     1. Save to pending_alerts collection in MongoDB
-    2. Retry worker attempts resend every 5 minutes (max 3 attempts)
+    2. Retry worker resends it with exponential backoff and jitter
+       (ALERT_RETRY_* settings), giving up after ALERT_RETRY_MAX_ATTEMPTS
+       or on a 4xx response
 
 Used by:
     - app.validation.alert_service.send_alert_with_fallback()
@@ -151,6 +153,43 @@ Used by:
 """
 
 
+# =============================================================================
+# BATCH NOTIFICATION ALERT ENDPOINT
+# =============================================================================
+
+"""
+POST /api/v1/notifications/notifications/alert/batch/
+
+Sends many alerts in one request (same fields as the single alert endpoint).
+
+Request Body:
+    {
+        "alerts": [
+            {"title": "...", "message": "...", "type": "warning", "dev_eui": "..."},
+            ...
+        ]
+    }
+
+Response (200 OK):
+    {
+        "status": "alerts_processed",
+        "notified": 5,
+        "results": [
+            {"dev_eui": "...", "status": "alert_sent", "notified": 2, "skipped": 0},
+            {"dev_eui": "...", "status": "error", "error": "Device not found"},
+            ...
+        ]
+    }
+
+    `results` has one entry per alert, in request order.
+
+Used by:
+    - app.workers.alert_retry_worker.retry_pending_alerts() when at least
+      ALERT_RETRY_BATCH_THRESHOLD alerts are due. Falls back to the single
+      alert endpoint if Atlas answers 404/405.
+"""
+
+
 # =============================================================================
 # CLIENT USAGE
 # =============================================================================
@@ -179,4 +218,10 @@ All requests automatically include:
     - X-API-Key header (from SERVICE_API_KEY env var)
     - Content-Type: application/json
     - Base URL (from ATLAS_HOST_URL env var)
+
+All requests share one pooled keep-alive client, opened in the FastAPI
+lifespan with atlas_client.start() and closed with atlas_client.close().
+Pool size, keep-alive and HTTP/2 are configured with the ATLAS_* settings.
+Request latency, errors, in-flight requests and pool usage are exported
+as hermes_atlas_* Prometheus metrics (GET /metrics).
 """
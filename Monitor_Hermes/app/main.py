@@ -1,45 +1,73 @@
 # App starting point
 from typing import Any
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from app.ws.routes import router as ws_router
+from app.ws.manager import manager
 from contextlib import asynccontextmanager
 from app.persistence.mongo import (
     connect_to_mongo,
     close_mongo_connection,
     get_db,
     save_message,
+    index_report,
 )
-from app.persistence.db_helpers import (
-    get_last_messages,
-    aggregations,
-    get_historic_from_date_range,
-)
+from app.persistence.db_helpers import stream_historic_points
+from app.persistence.write_buffer import write_buffer
+from app.persistence.rollups import backfill_rollups, compact_rollups
 from app.redis.redis import connect_to_redis, close_redis_connection
+from app.redis.query_cache import cached_aggregations
+from app.redis.snapshot import last_messages, latest_values_for
 from app.workers.redis_worker import process_messages
 from app.workers.alert_retry_worker import retry_pending_alerts
 from app.persistence.models import MessageIn, DeviceUserMapping
 from app.persistence.device_mapping import get_device_user_mapping_from_atlas, update_device_user_mapping_cache
-from app.validation.measurement_cache import force_refresh_measurement_configs
-from app.mqtt.client import start_mqtt
+from app.validation.measurement_cache import (
+    force_refresh_measurement_configs,
+    listen_for_config_invalidations,
+)
+from app.mqtt.client import start_mqtt, stop_mqtt
 import loguru
 import asyncio
 from datetime import datetime, timezone
-from typing import Optional
+from typing import List, Literal, Optional
 from app.auth.deps import verify_service_api_key
+from app.clients.atlas import atlas_client
+from app.settings import settings
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.utils.metrics import refresh_backlog_gauges, update_runtime_gauges
+from app.utils.serialization import stream_json_array, stream_ndjson
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await connect_to_mongo()
     await connect_to_redis()
+    await atlas_client.start()
     loop = asyncio.get_event_loop()
     db = await get_db()
-    loop.create_task(process_messages(db))
-    loop.create_task(retry_pending_alerts())
+    write_buffer.start(db)
+    tasks = [
+        loop.create_task(process_messages(db)),
+        loop.create_task(retry_pending_alerts()),
+        loop.create_task(listen_for_config_invalidations()),
+        loop.create_task(refresh_backlog_gauges(db)),
+    ]
+    if settings.ROLLUPS_ENABLED:
+        tasks.append(loop.create_task(backfill_rollups(db)))
+    manager.bus.start()
 
     start_mqtt(db, loop)
     yield
+    await stop_mqtt()
+    # Stop every producer before the final flush of the write buffer
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await manager.bus.close()
+    await write_buffer.close()
+    await atlas_client.close()
     await close_mongo_connection()
     await close_redis_connection()
 
@@ -71,7 +99,31 @@ async def get_last_messages_endpoint(
     _: bool = Depends(verify_service_api_key),
 ):
     loguru.logger.debug(f"Fetching last {limit} messages for {dev_eui}")
-    return await get_last_messages(db, dev_eui, limit)
+    return await last_messages(db, dev_eui, limit)
+
+
+@app.get("/measurements/latest")
+async def get_latest_values_endpoint(
+    dev_eui: List[str] = Query(...),
+    db: Any = Depends(get_db),
+    _: bool = Depends(verify_service_api_key),
+):
+    """
+    Get the last received value of every measurement and channel of many
+    devices in one call, e.g. for a dashboard of device cards.
+
+    - **dev_eui**: Device EUI, repeated once per device
+      (at most LATEST_VALUES_MAX_DEVICES)
+
+    Returns {dev_eui: {measurement: {channel: {value, time, received_at}}}};
+    devices without data map to {}.
+    """
+    if len(dev_eui) > settings.LATEST_VALUES_MAX_DEVICES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.LATEST_VALUES_MAX_DEVICES} devices per call",
+        )
+    return await latest_values_for(db, dev_eui)
 
 
 @app.get("/measurements/history")
@@ -98,7 +150,9 @@ async def get_measurements_history(
     loguru.logger.debug(
         f"Fetching history for {dev_eui} ({measurement_type}) from {start} to {end}"
     )
-    return await aggregations(db, dev_eui, measurement_type, start, end, steps, channel)
+    return await cached_aggregations(
+        db, dev_eui, measurement_type, start, end, steps, channel
+    )
 
 
 @app.post("/internal/mappings/device-user")
@@ -159,6 +213,45 @@ async def refresh_measurements_endpoint(
         }
 
 
+@app.post("/internal/rollups/compact")
+async def compact_rollups_endpoint(
+    start: datetime,
+    end: datetime,
+    db: Any = Depends(get_db),
+    _: bool = Depends(verify_service_api_key),
+):
+    """
+    Rebuild the 1m/1h/1d measurement rollups for a date range from the raw
+    time series, e.g. after rollup writes failed.
+    Requires SERVICE_API_KEY authentication.
+    """
+    await compact_rollups(db, start, end)
+    return {"status": "success", "start": start, "end": end}
+
+
+@app.get("/internal/mongo/indexes")
+async def mongo_indexes_endpoint(
+    db: Any = Depends(get_db),
+    _: bool = Depends(verify_service_api_key),
+):
+    """
+    Report declared indexes that are missing, indexes no query has used
+    since the last restart, and indexes that are not declared.
+    Requires SERVICE_API_KEY authentication.
+    """
+    return await index_report(db)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(_: bool = Depends(verify_service_api_key)):
+    """
+    Prometheus metrics for the ingest pipeline, WebSockets, Atlas client
+    and alert backlog. Requires SERVICE_API_KEY authentication.
+    """
+    update_runtime_gauges()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/measurements/historic")
 async def get_historic_measurements_endpoint(
     dev_eui: str,
@@ -166,21 +259,37 @@ async def get_historic_measurements_endpoint(
     start: datetime,
     end: datetime,
     channel: Optional[str] = None,
+    output: Literal["json", "ndjson"] = "json",
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[datetime] = None,
     db: Any = Depends(get_db),
     _: bool = Depends(verify_service_api_key),
 ):
     """
-    Get historic measurements for a device within a date range.
+    Get the raw points of a measurement for a device within a date range,
+    oldest first, streamed as they are read.
 
     - **dev_eui**: Device EUI
     - **measurement_type**: Type of measurement (e.g., "voltage", "current")
     - **start**: Start datetime (ISO 8601)
     - **end**: End datetime (ISO 8601)
     - **channel**: Optional channel filter (e.g., "ch1")
+    - **output**: "json" for a JSON array, "ndjson" for one point per line
+    - **limit**: Optional page size; a page may exceed it to finish its last timestamp
+    - **after**: Continue after this timestamp (the last one of the previous page)
     """
     loguru.logger.debug(
         f"Fetching historic measurements for {dev_eui} ({measurement_type}) from {start} to {end}"
     )
-    return await get_historic_from_date_range(
-        db, dev_eui, measurement_type, start, end, channel
+    points = stream_historic_points(
+        db, dev_eui, measurement_type, start, end, channel, limit, after
+    )
+    if output == "ndjson":
+        return StreamingResponse(
+            stream_ndjson(points, settings.HISTORIC_BATCH_SIZE),
+            media_type="application/x-ndjson",
+        )
+    return StreamingResponse(
+        stream_json_array(points, settings.HISTORIC_BATCH_SIZE),
+        media_type="application/json",
     )
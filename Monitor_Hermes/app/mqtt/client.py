@@ -1,40 +1,255 @@
+import asyncio
+import threading
 import paho.mqtt.client as mqtt
 import json
-from app.mqtt.handlers import handle_message
-from app.persistence.mongo import get_db
+from typing import Callable, Optional, Set
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from app.mqtt.handlers import (
+    broadcast_message,
+    format_payload,
+    handle_message,
+    queue_message,
+)
 import loguru
 from app.settings import settings
+from app.utils.metrics import MQTT_FORMAT_FAILURES, MQTT_MESSAGES_RECEIVED
 
 BROKER_HOST = settings.BROKER_URL
 BROKER_PORT = settings.BROKER_PORT
 TOPIC = "application/+/device/+/event/up"
 
-client = mqtt.Client()
+client: Optional[mqtt.Client] = None
+_mqtt_task: Optional[asyncio.Task] = None
 
+# Backoff (s) between attempts to queue a message while Redis is failing
+QUEUE_RETRY_MIN_DELAY = 0.5
+QUEUE_RETRY_MAX_DELAY = 30
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
+
+def subscription_topic() -> str:
+    """Uplink topic, as an MQTT shared subscription if MQTT_SHARED_GROUP is set."""
+    if settings.MQTT_SHARED_GROUP:
+        return f"$share/{settings.MQTT_SHARED_GROUP}/{TOPIC}"
+    return TOPIC
+
+
+def _create_client(manual_ack: bool = False) -> mqtt.Client:
+    protocol = mqtt.MQTTv5 if settings.MQTT_PROTOCOL_VERSION == 5 else mqtt.MQTTv311
+    mqtt_client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        client_id=settings.MQTT_CLIENT_ID,
+        protocol=protocol,
+        manual_ack=manual_ack,
+    )
+    mqtt_client.max_inflight_messages_set(settings.MQTT_MAX_INFLIGHT)
+    mqtt_client.on_connect = on_connect
+    return mqtt_client
+
+
+def _connect(mqtt_client: mqtt.Client, background: bool = False):
+    """
+    Connect to the broker. Blocks on the TCP connect unless `background`,
+    where the network thread started by loop_start() connects.
+    """
+    properties = None
+    if settings.MQTT_PROTOCOL_VERSION == 5:
+        # Cap the QoS 1/2 messages the broker sends before we acknowledge them
+        properties = Properties(PacketTypes.CONNECT)
+        properties.ReceiveMaximum = settings.MQTT_MAX_INFLIGHT
+    connect = mqtt_client.connect_async if background else mqtt_client.connect
+    connect(BROKER_HOST, BROKER_PORT, settings.MQTT_KEEPALIVE, properties=properties)
+
+
+def on_connect(client, userdata, flags, reason_code, properties=None):
+    if not reason_code.is_failure:
         loguru.logger.debug("Connected to MQTT Broker!")
-        client.subscribe(TOPIC)
-        loguru.logger.debug(f"Subscribed to topic: {TOPIC}")
+        topic = subscription_topic()
+        client.subscribe(topic, qos=settings.MQTT_QOS)
+        loguru.logger.debug(f"Subscribed to topic: {topic}")
     else:
-        loguru.logger.error(f"Failed to connect, return code {rc}")
+        loguru.logger.error(f"Failed to connect, return code {reason_code}")
 
 
 def on_message(client, userdata, msg):
+    MQTT_MESSAGES_RECEIVED.inc()
     try:
         payload = json.loads(msg.payload.decode())
         db = userdata.get("db")
         loop = userdata.get("loop")
         handle_message(payload, db, loop)
     except Exception as e:
+        MQTT_FORMAT_FAILURES.inc()
         loguru.logger.error(f"Error processing message: {e}")
 
 
+class AsyncioHelper:
+    """
+    Drives a paho client from the asyncio event loop instead of a network
+    thread: socket reads/writes run as loop reader/writer callbacks and
+    keep-alive housekeeping runs in a task. The blocking connect runs in an
+    executor, so callbacks fired from it are handed over to the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, mqtt_client: mqtt.Client):
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.client = mqtt_client
+        self.misc: Optional[asyncio.Task] = None
+        mqtt_client.on_socket_open = self.on_socket_open
+        mqtt_client.on_socket_close = self.on_socket_close
+        mqtt_client.on_socket_register_write = self.on_socket_register_write
+        mqtt_client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _on_loop(self, callback, *args):
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._open, client, sock)
+
+    def _open(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+async def _ingest_and_ack(
+    mqtt_client: mqtt.Client, msg, formatted: dict, connected: Callable[[], bool]
+):
+    """
+    Broadcast the message and queue it for ingest, retrying with backoff
+    while Redis fails, then acknowledge it. The session is not persistent:
+    if the connection dropped meanwhile the broker has already discarded
+    the message, so it is queued but not acknowledged. While a message is
+    being retried it keeps its Receive Maximum slot.
+    """
+    queued = await queue_message(formatted)
+    await broadcast_message(formatted)
+
+    delay = QUEUE_RETRY_MIN_DELAY
+    while not queued:
+        loguru.logger.warning(f"Retrying ingest of MQTT message in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, QUEUE_RETRY_MAX_DELAY)
+        queued = await queue_message(formatted)
+
+    if msg.qos > 0 and connected():
+        mqtt_client.ack(msg.mid, msg.qos)
+
+
+async def run_mqtt():
+    """
+    asyncio MQTT subscriber: messages are handled on the event loop without
+    a thread hop. QoS 1/2 messages are acknowledged only once they are in the
+    ingest stream (see _ingest_and_ack); with MQTT v5 the broker sends at
+    most MQTT_MAX_INFLIGHT of them before they are acknowledged. QoS 0
+    messages, and any message over MQTT 3.1.1 (which has no Receive
+    Maximum), are not bounded.
+    Reconnects after MQTT_RECONNECT_DELAY seconds when the connection drops.
+    """
+    global client
+    loop = asyncio.get_running_loop()
+    mqtt_client = _create_client(manual_ack=settings.MQTT_QOS > 0)
+    AsyncioHelper(loop, mqtt_client)
+    client = mqtt_client
+
+    disconnected = asyncio.Event()
+    pending: Set[asyncio.Task] = set()
+    # Bumped on every disconnect; message ids are only valid within one
+    connection = 0
+
+    def on_disconnect(client, userdata, flags, reason_code, properties=None):
+        nonlocal connection
+        connection += 1
+        loguru.logger.warning(f"Disconnected from MQTT Broker: {reason_code}")
+        disconnected.set()
+
+    def on_message_async(client, userdata, msg):
+        MQTT_MESSAGES_RECEIVED.inc()
+        try:
+            formatted = format_payload(json.loads(msg.payload))
+        except Exception as e:
+            formatted = None
+            loguru.logger.error(f"Error processing message: {e}")
+        if not formatted:
+            MQTT_FORMAT_FAILURES.inc()
+            loguru.logger.error(
+                "Skipping message because payload could not be formatted"
+            )
+            if msg.qos > 0:
+                client.ack(msg.mid, msg.qos)
+            return
+
+        received_on = connection
+        task = loop.create_task(
+            _ingest_and_ack(client, msg, formatted, lambda: connection == received_on)
+        )
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    mqtt_client.on_disconnect = on_disconnect
+    mqtt_client.on_message = on_message_async
+
+    try:
+        while True:
+            disconnected.clear()
+            try:
+                # paho connects with a blocking socket call
+                await loop.run_in_executor(None, _connect, mqtt_client)
+                loguru.logger.debug("MQTT client started on the event loop")
+                await disconnected.wait()
+            except (OSError, mqtt.WebsocketConnectionError) as e:
+                loguru.logger.error(f"Failed to connect to MQTT Broker: {e}")
+            await asyncio.sleep(settings.MQTT_RECONNECT_DELAY)
+    finally:
+        mqtt_client.disconnect()
+
+
 def start_mqtt(db, loop):
+    """Start the MQTT subscriber in the mode selected by MQTT_MODE."""
+    global client, _mqtt_task
+    if settings.MQTT_MODE == "asyncio":
+        _mqtt_task = loop.create_task(run_mqtt())
+        return
+
+    client = _create_client()
     client.user_data_set({"db": db, "loop": loop})
-    client.on_connect = on_connect
     client.on_message = on_message
-    client.connect(BROKER_HOST, BROKER_PORT, 60)
+    _connect(client, background=True)
     client.loop_start()
     loguru.logger.debug("MQTT client started and running in background")
+
+
+async def stop_mqtt():
+    global _mqtt_task
+    if _mqtt_task is not None:
+        _mqtt_task.cancel()
+        try:
+            await _mqtt_task
+        except asyncio.CancelledError:
+            pass
+        _mqtt_task = None
+    elif client is not None:
+        client.disconnect()
+        client.loop_stop()
@@ -2,6 +2,8 @@ from app.persistence.models import MessageIn
 from app.persistence.mongo import save_message
 from app.ws.manager import manager
 from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.utils.metrics import MQTT_FORMAT_FAILURES
 import asyncio
 import loguru
 import json
@@ -13,7 +15,7 @@ def format_payload(payload: dict) -> dict | None:
 
     This is the SINGLE normalization point. The output is used for:
     - Broadcasting to websockets (immediate)
-    - Pushing to Redis queue
+    - Pushing to the Redis ingest stream
     - Persistence in MongoDB (via worker)
 
     Args:
@@ -115,37 +117,74 @@ def format_payload(payload: dict) -> dict | None:
         raise
 
 
+async def queue_message(formatted: dict) -> bool:
+    """Add a formatted message to the ingest stream.
+    Args:
+        formatted (dict): Payload normalized by format_payload.
+    Returns:
+        bool: Whether the message was added to the ingest stream.
+    """
+    try:
+        client = get_redis_client()
+        await client.xadd(
+            settings.INGEST_STREAM_KEY,
+            {"data": json.dumps(formatted)},
+            maxlen=settings.INGEST_STREAM_MAXLEN,
+            approximate=True,
+        )
+        return True
+    except RuntimeError:
+        loguru.logger.error("Redis client not initialized, skipping redis push")
+    except Exception as e:
+        loguru.logger.error(f"Failed to push message to ingest stream: {e}")
+    return False
+
+
+async def broadcast_message(formatted: dict):
+    """Broadcast a formatted message to the WebSocket clients of its tenant."""
+    tenant_id = formatted.get("tenant_id") or formatted.get("tenantId")
+    if not tenant_id:
+        loguru.logger.error(
+            "No tenant_id available in formatted payload, skipping broadcast"
+        )
+        return
+
+    try:
+        await manager.broadcast(formatted, tenant_id)
+        loguru.logger.debug(f"Message broadcasted to tenant {tenant_id}")
+    except Exception:
+        loguru.logger.exception(f"Failed to broadcast message to tenant {tenant_id}")
+
+
+async def ingest_message(formatted: dict) -> bool:
+    """Queue a formatted message for the worker and broadcast it to its tenant.
+    Args:
+        formatted (dict): Payload normalized by format_payload.
+    Returns:
+        bool: Whether the message was added to the ingest stream.
+    """
+    queued = await queue_message(formatted)
+    await broadcast_message(formatted)
+    return queued
+
+
 def handle_message(payload: dict, db, loop):
-    """Handle incoming MQTT messages.
+    """Handle incoming MQTT messages received on the paho network thread.
     Args:
         payload (dict): The incoming message payload.
         db: The database connection.
+        loop: The event loop ingest_message is scheduled on.
     """
     try:
         formatted = format_payload(payload)
         if not formatted:
+            MQTT_FORMAT_FAILURES.inc()
             loguru.logger.error(
                 "Skipping message because payload could not be formatted"
             )
             return
 
-        try:
-            client = get_redis_client()
-            asyncio.run_coroutine_threadsafe(
-                client.lpush("messages", json.dumps(formatted)), loop
-            )
-        except RuntimeError:
-            loguru.logger.error("Redis client not initialized, skipping redis push")
-
-        tenant_id = formatted.get("tenant_id") or formatted.get("tenantId")
-        if not tenant_id:
-            loguru.logger.error(
-                "No tenant_id available in formatted payload, skipping broadcast"
-            )
-            return
-
-        asyncio.run_coroutine_threadsafe(manager.broadcast(formatted, tenant_id), loop)
-        loguru.logger.debug(f"Message broadcasted to tenant {tenant_id}")
+        asyncio.run_coroutine_threadsafe(ingest_message(formatted), loop)
 
     except Exception:
         loguru.logger.exception("Failed to handle message")
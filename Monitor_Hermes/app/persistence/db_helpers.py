@@ -1,14 +1,22 @@
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from app.persistence.models import MessageDB
+from app.persistence.rollups import Rollup, pick_rollup, rollup_aggregations
+from app.settings import settings
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 
-async def get_last_messages(db, dev_eui: str, limit: int = 5) -> List[MessageDB]:
+MAX_LAST_MESSAGES = 50
+
+
+def clamp_last_limit(limit: int) -> int:
     if limit <= 0:
-        limit = 5
-    elif limit > 50:
-        limit = 50
+        return 5
+    return min(limit, MAX_LAST_MESSAGES)
+
+
+async def get_last_messages(db, dev_eui: str, limit: int = 5) -> List[MessageDB]:
+    limit = clamp_last_limit(limit)
     cursor = db.messages.find({"dev_eui": dev_eui}).sort("timestamp", -1).limit(limit)
     messages = []
     async for doc in cursor:
@@ -17,6 +25,23 @@ async def get_last_messages(db, dev_eui: str, limit: int = 5) -> List[MessageDB]
     return messages
 
 
+def history_step(
+    start: datetime, end: datetime, steps: int
+) -> Tuple[int, Optional[Rollup]]:
+    """
+    Bucket width in milliseconds for `steps` points between start and end,
+    and the rollup to read them from (None for raw points). With a rollup,
+    the width is rounded up to a whole number of rollup buckets.
+    """
+    duration_ms = (end - start).total_seconds() * 1000
+    interval_ms = max(1, int(duration_ms / max(1, steps)))
+
+    rollup = pick_rollup(interval_ms) if settings.ROLLUPS_ENABLED else None
+    if rollup:
+        interval_ms = -(-interval_ms // rollup.width_ms) * rollup.width_ms
+    return interval_ms, rollup
+
+
 async def aggregations(
     db,
     dev_eui: str,
@@ -28,7 +53,9 @@ async def aggregations(
 ) -> List[Dict[str, Any]]:
     """
     Generates aggregated time series data (min, max, avg) for a given range and resolution.
-    Optimized for MongoDB Time Series collections.
+    Steps of a minute or more are served from the coarsest rollup that fits
+    (see history_step); finer steps group the raw points of the MongoDB Time
+    Series collection.
     """
     # Validate steps
     if steps < 1:
@@ -38,9 +65,27 @@ async def aggregations(
     if end < start:
         start, end = end, start
 
-    # Calculate interval in milliseconds
-    duration_ms = (end - start).total_seconds() * 1000
-    interval_ms = max(1, int(duration_ms / steps))
+    interval_ms, rollup = history_step(start, end, steps)
+    return await aggregate_buckets(
+        db, dev_eui, measurement_type, start, end, interval_ms, rollup, channel
+    )
+
+
+async def aggregate_buckets(
+    db,
+    dev_eui: str,
+    measurement_type: str,
+    start: datetime,
+    end: datetime,
+    interval_ms: int,
+    rollup: Optional[Rollup] = None,
+    channel: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """min/max/avg per channel in epoch-aligned buckets of `interval_ms`."""
+    if rollup:
+        return await rollup_aggregations(
+            db, rollup, dev_eui, measurement_type, start, end, interval_ms, channel
+        )
 
     # Build Match Stage
     match_stage = {
@@ -94,17 +139,33 @@ async def aggregations(
     return results
 
 
-async def get_historic_from_date_range(
+def _point(doc: Dict[str, Any]) -> Dict[str, Any]:
+    ts = doc["ts"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return {"timestamp": ts, "channel": doc["meta"]["c"], "value": doc["val"]}
+
+
+async def stream_historic_points(
     db,
     dev_eui: str,
     measurement_type: str,
     start: datetime,
     end: datetime,
     channel: Optional[str] = None,
-) -> List[MessageDB]:
+    limit: Optional[int] = None,
+    after: Optional[datetime] = None,
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Retrieves historical measurement data for a specified device and measurement type within a given date range.
-    It uses messages collection to fetch the data, since it needs to be the raw data for detailed analysis.
+    Yields the raw points of one measurement of a device between start and
+    end, oldest first, as {"timestamp", "channel", "value"}.
+    Reads the `measurements_history` time series through its meta.d/meta.m/ts
+    index and projects only the returned fields, one cursor batch of
+    HISTORIC_BATCH_SIZE points at a time.
+
+    Keyset pagination: with `limit`, a page holds at least `limit` points
+    and always ends with every point of its last timestamp, so passing that
+    timestamp back as `after` continues with the next one.
 
     Parameters:
     - db: Database connection
@@ -113,25 +174,35 @@ async def get_historic_from_date_range(
     - start: Start datetime for the range
     - end: End datetime for the range
     - channel: Optional channel filter
+    - limit: Optional page size
+    - after: Only points strictly after this datetime
     """
-    match_stage = {
-        "dev_eui": dev_eui,
-        "timestamp": {
-            "$gte": start,
-            "$lte": end,
-        },
-        f"payload.measurements.{measurement_type}": {"$exists": True},
-    }
+    ts_filter: Dict[str, Any] = {"$gte": start, "$lte": end}
+    if after is not None:
+        ts_filter["$gt"] = after
 
+    match_stage = {"meta.d": dev_eui, "meta.m": measurement_type, "ts": ts_filter}
     if channel:
-        match_stage[f"payload.measurements.{measurement_type}.{channel}"] = {
-            "$exists": True
-        }
+        match_stage["meta.c"] = channel
 
-    cursor = db.messages.find(match_stage).sort("timestamp", 1)
+    projection = {"ts": 1, "meta.c": 1, "val": 1}
+    cursor = db.measurements_history.find(
+        match_stage, projection, batch_size=settings.HISTORIC_BATCH_SIZE
+    ).sort("ts", 1)
+    if limit:
+        cursor = cursor.limit(limit)
 
-    messages = []
+    count, last_ts, last_ids = 0, None, set()
     async for doc in cursor:
-        doc["_id"] = str(doc["_id"])
-        messages.append(MessageDB(**doc))
-    return messages
+        count += 1
+        if doc["ts"] != last_ts:
+            last_ts, last_ids = doc["ts"], set()
+        last_ids.add(doc["_id"])
+        yield _point(doc)
+
+    if limit and count == limit:
+        # The page may have stopped inside its last timestamp; finish it
+        tail = db.measurements_history.find({**match_stage, "ts": last_ts}, projection)
+        async for doc in tail:
+            if doc["_id"] not in last_ids:
+                yield _point(doc)
@@ -13,8 +13,18 @@ from app.persistence.models import DeviceUserMapping
 from app.persistence.mongo import get_users_for_device, save_device_user_mapping
 from app.redis.redis import get_redis_client
 from app.clients.atlas import atlas_client
+from app.settings import settings
+from app.utils.lru_cache import LRUCache
+from app.utils.singleflight import SingleFlight
 
 REDIS_TTL = 7200  # 2 hours
+NEGATIVE_CACHE_SIZE = 10000
+
+# Devices Atlas reported as unknown (404), to avoid asking again on every uplink
+_unknown_devices = LRUCache(
+    maxsize=NEGATIVE_CACHE_SIZE, ttl=settings.ATLAS_NEGATIVE_CACHE_TTL
+)
+_inflight = SingleFlight()
 
 
 async def get_device_user_mapping(db, dev_eui: str) -> Optional[DeviceUserMapping]:
@@ -26,7 +36,18 @@ async def get_device_user_mapping(db, dev_eui: str) -> Optional[DeviceUserMappin
     2. Check MongoDB
     3. Fetch from Atlas API
     4. Save to Mongo & Redis if found
+
+    Concurrent misses for the same device share a single lookup, and
+    devices unknown to Atlas are not looked up again for
+    ATLAS_NEGATIVE_CACHE_TTL seconds.
     """
+    if _unknown_devices.get(dev_eui):
+        return None
+
+    return await _inflight.do(dev_eui, lambda: _load_device_user_mapping(db, dev_eui))
+
+
+async def _load_device_user_mapping(db, dev_eui: str) -> Optional[DeviceUserMapping]:
     redis_key = f"device_user_map:{dev_eui}"
 
     # 1. Try Redis
@@ -81,6 +102,14 @@ async def get_device_user_mapping(db, dev_eui: str) -> Optional[DeviceUserMappin
         loguru.logger.info(f"Fetched and cached mapping for {dev_eui}")
         return new_mapping
 
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            loguru.logger.debug(f"Device {dev_eui} not found in Atlas")
+            _unknown_devices.set(dev_eui, True)
+        else:
+            loguru.logger.warning(
+                f"Atlas API error fetching mapping for {dev_eui}: {e}"
+            )
     except httpx.HTTPError as e:
         loguru.logger.warning(f"Atlas API error fetching mapping for {dev_eui}: {e}")
     except Exception as e:
@@ -121,6 +150,7 @@ async def get_device_user_mapping_from_atlas(
 
         await save_device_user_mapping(db, new_mapping)
         await _cache_mapping_in_redis(new_mapping)
+        _unknown_devices.pop(dev_eui)
 
         loguru.logger.info(f"Fetched and cached mapping for {dev_eui} from Atlas")
         return new_mapping
@@ -140,6 +170,7 @@ async def update_device_user_mapping_cache(db, mapping: DeviceUserMapping):
     """
     await save_device_user_mapping(db, mapping)
     await _cache_mapping_in_redis(mapping)
+    _unknown_devices.pop(mapping.dev_eui)
     loguru.logger.info(f"Updated mapping for {mapping.dev_eui} (Mongo + Redis)")
 
 
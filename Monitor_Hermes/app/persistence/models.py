@@ -50,6 +50,7 @@ class PendingAlert(BaseModel):
     max_retries: int = 3
     status: str = "pending"
     last_retry_at: Optional[datetime] = None
+    next_attempt_at: Optional[datetime] = None
     sent_via_websocket: bool = False
     error_message: Optional[str] = None
 
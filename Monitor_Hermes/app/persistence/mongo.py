@@ -1,6 +1,8 @@
-from pymongo import AsyncMongoClient, ASCENDING
+import asyncio
+from bson import ObjectId
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, UpdateOne
 from app.settings import settings
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from app.persistence.models import (
     MessageIn,
     DeviceMeasurementConfigs,
@@ -8,7 +10,9 @@ from app.persistence.models import (
     PendingAlert,
     DeviceUserMapping,
 )
-from typing import List, Optional
+from app.persistence.rollups import KEY_FIELDS, ROLLUPS
+from app.redis.snapshot import update_snapshots
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 import loguru
 
 client: AsyncMongoClient = None
@@ -18,14 +22,141 @@ async def get_db():
     return client[settings.MONGO_DB]
 
 
-async def create_indexes():
-    """Creates TTL indexes for data retention."""
-    db = await get_db()
-    # Create TTL index for messages (3 months = 90 days = 7,776,000 seconds)
-    await db.messages.create_index(
-        [("timestamp", ASCENDING)], expireAfterSeconds=7776000
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    options: Dict[str, Any] = {}
+
+
+# Unique bucket keys of the rollup collections: the $merge of
+# compact_rollups needs them and they keep concurrent update_rollups upserts
+# from creating duplicate buckets, so they are built before startup goes on.
+ROLLUP_KEY_INDEXES = [
+    IndexSpec(
+        rollup.collection,
+        [(field, ASCENDING) for field in KEY_FIELDS],
+        {"unique": True},
     )
-    loguru.logger.debug("TTL indexes created/verified")
+    for rollup in ROLLUPS
+]
+
+# Every index Hermes queries rely on. ensure_indexes() builds the missing
+# ones at startup and index_report() compares them with what exists.
+REQUIRED_INDEXES = [
+    # Retention (3 months = 90 days = 7,776,000 seconds)
+    IndexSpec("messages", [("timestamp", ASCENDING)], {"expireAfterSeconds": 7776000}),
+    # /messages/last
+    IndexSpec("messages", [("dev_eui", ASCENDING), ("timestamp", DESCENDING)]),
+    # Per-tenant message reads
+    IndexSpec("messages", [("tenant_id", ASCENDING), ("timestamp", DESCENDING)]),
+    IndexSpec("device_measurement_configs", [("dev_eui", ASCENDING)], {"unique": True}),
+    IndexSpec("device_user_mapping", [("dev_eui", ASCENDING)], {"unique": True}),
+    # Due-alert lookups of the retry worker
+    IndexSpec("pending_alerts", [("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+    # Tenant queries on the time series
+    IndexSpec("measurements_history", [("meta.t", ASCENDING), ("ts", ASCENDING)]),
+    # Raw point reads of /measurements/historic by device and measurement
+    IndexSpec(
+        "measurements_history",
+        [("meta.d", ASCENDING), ("meta.m", ASCENDING), ("ts", ASCENDING)],
+    ),
+    *ROLLUP_KEY_INDEXES,
+    *[
+        IndexSpec(
+            rollup.collection,
+            [("ts", ASCENDING)],
+            {"expireAfterSeconds": rollup.retention},
+        )
+        for rollup in ROLLUPS
+        if rollup.retention
+    ],
+]
+
+index_task: Optional[asyncio.Task] = None
+
+
+async def ensure_indexes(db, specs: List[IndexSpec] = REQUIRED_INDEXES):
+    """
+    Create the indexes of `specs` that don't exist yet. Runs as a background
+    task so startup doesn't wait for builds on large collections; an index
+    that can't be built (e.g. unique over duplicate data) is logged and shows
+    up as missing in index_report().
+    """
+    for spec in specs:
+        try:
+            await db[spec.collection].create_index(spec.keys, **spec.options)
+        except Exception as e:
+            loguru.logger.error(
+                f"Failed to create index {spec.keys} on {spec.collection}: {e}"
+            )
+    loguru.logger.debug("Indexes created/verified")
+
+
+def _keys(key) -> List[Tuple[str, Any]]:
+    """Index key as (field, direction) pairs; numeric directions as ints."""
+    pairs = key.items() if isinstance(key, dict) else key
+    return [
+        (field, direction if isinstance(direction, str) else int(direction))
+        for field, direction in pairs
+    ]
+
+
+async def index_report(db) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Compare the indexes of every collection in REQUIRED_INDEXES with the
+    declared ones:
+    - missing: declared but not built
+    - unused: built but never used since `since` (per $indexStats, which
+      resets on restart); TTL indexes are used by the TTL monitor and
+      are not listed
+    - undeclared: built but not in REQUIRED_INDEXES
+    """
+    report: Dict[str, List[Dict[str, Any]]] = {
+        "missing": [],
+        "unused": [],
+        "undeclared": [],
+    }
+
+    for collection in dict.fromkeys(spec.collection for spec in REQUIRED_INDEXES):
+        declared = [s.keys for s in REQUIRED_INDEXES if s.collection == collection]
+        existing = await db[collection].index_information()
+        built = [_keys(info["key"]) for info in existing.values()]
+
+        for keys in declared:
+            if keys not in built:
+                report["missing"].append({"collection": collection, "keys": dict(keys)})
+
+        for name, info in existing.items():
+            keys = _keys(info["key"])
+            if name != "_id_" and keys not in declared:
+                report["undeclared"].append(
+                    {"collection": collection, "name": name, "keys": dict(keys)}
+                )
+
+        try:
+            cursor = await db[collection].aggregate([{"$indexStats": {}}])
+            stats = await cursor.to_list(None)
+        except Exception as e:
+            loguru.logger.warning(f"Failed to read index stats of {collection}: {e}")
+            continue
+        for stat in stats:
+            info = existing.get(stat["name"], {})
+            if (
+                stat["name"] == "_id_"
+                or "expireAfterSeconds" in info
+                or stat["accesses"]["ops"]
+            ):
+                continue
+            report["unused"].append(
+                {
+                    "collection": collection,
+                    "name": stat["name"],
+                    "keys": dict(_keys(stat["key"])),
+                    "since": stat["accesses"]["since"],
+                }
+            )
+
+    return report
 
 
 async def create_timeseries_collection():
@@ -43,8 +174,6 @@ async def create_timeseries_collection():
                 },
                 expireAfterSeconds=7776000,  # 3 months retention
             )
-            # Create index for tenant queries if needed, though meta+ts is default
-            await db.measurements_history.create_index([("meta.t", 1), ("ts", 1)])
             loguru.logger.info("Created time series collection 'measurements_history'")
         except Exception as e:
             loguru.logger.error(f"Failed to create time series collection: {e}")
@@ -64,15 +193,21 @@ async def create_timeseries_collection():
 
 
 async def connect_to_mongo():
-    global client
+    global client, index_task
     client = AsyncMongoClient(settings.MONGO_URI)
     loguru.logger.debug("Connected to MongoDB")
-    await create_indexes()
+    # The time series collection must exist before its indexes are built
     await create_timeseries_collection()
+    db = await get_db()
+    # Rollups are written (and backfilled) right after startup
+    await ensure_indexes(db, ROLLUP_KEY_INDEXES)
+    index_task = asyncio.create_task(ensure_indexes(db))
 
 
 async def close_mongo_connection():
     global client
+    if index_task and not index_task.done():
+        index_task.cancel()
     if client:
         client.close()
         loguru.logger.debug("Closed MongoDB connection")
@@ -82,6 +217,7 @@ async def save_message(db, message: MessageIn):
     doc = message.model_dump()
     doc["timestamp"] = datetime.now(timezone.utc)
     result = await db.messages.insert_one(doc)
+    await update_snapshots([doc])
     return str(result.inserted_id)
 
 
@@ -121,36 +257,99 @@ async def get_device_measurement_configs(
 
 async def save_pending_alert(db, alert: PendingAlert):
     doc = alert.model_dump()
+    if doc.get("next_attempt_at") is None:
+        doc["next_attempt_at"] = doc["created_at"]
     result = await db.pending_alerts.insert_one(doc)
     return str(result.inserted_id)
 
 
-async def get_pending_alerts(db, limit: int = 100) -> List[dict]:
-    cursor = db.pending_alerts.find(
-        {"status": "pending", "retry_count": {"$lt": 3}}
-    ).limit(limit)
-    return await cursor.to_list(length=limit)
+async def claim_due_pending_alerts(
+    db, limit: int, lease_seconds: float
+) -> List[dict]:
+    """
+    Atomically claim up to `limit` pending alerts whose next attempt is due.
 
+    Claiming pushes next_attempt_at forward by `lease_seconds`, so other
+    replicas skip the alert while it is being sent and it becomes due again
+    if the claimer dies before recording the outcome.
 
-async def update_pending_alert_status(
-    db,
-    alert_id: str,
-    status: str,
-    retry_count: Optional[int] = None,
-    error_message: Optional[str] = None,
-):
-    update_doc = {
-        "status": status,
-        "last_retry_at": datetime.now(timezone.utc),
+    The batch is claimed in three round trips whatever its size: read the
+    due candidates, lease those still due with one update_many tagged with
+    a claim id, then read back the alerts carrying that claim id (a
+    concurrent claimer may have won some of the candidates).
+    """
+    now = datetime.now(timezone.utc)
+    lease_until = now + timedelta(seconds=lease_seconds)
+    due = {
+        "status": "pending",
+        # Alerts queued before next_attempt_at existed have it null
+        "$or": [
+            {"next_attempt_at": {"$lte": now}},
+            {"next_attempt_at": None},
+        ],
     }
 
-    if retry_count is not None:
-        update_doc["retry_count"] = retry_count
+    cursor = (
+        db.pending_alerts.find(due, {"_id": 1})
+        .sort("next_attempt_at", ASCENDING)
+        .limit(limit)
+    )
+    ids = [doc["_id"] for doc in await cursor.to_list(length=limit)]
+    if not ids:
+        return []
+
+    claim_id = ObjectId()
+    await db.pending_alerts.update_many(
+        {"_id": {"$in": ids}, **due},
+        {
+            "$set": {
+                "next_attempt_at": lease_until,
+                "last_retry_at": now,
+                "claim_id": claim_id,
+            }
+        },
+    )
+    cursor = db.pending_alerts.find({"_id": {"$in": ids}, "claim_id": claim_id}).sort(
+        "next_attempt_at", ASCENDING
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def mark_pending_alerts_sent(db, alert_ids: List[Any]):
+    if not alert_ids:
+        return
+    await db.pending_alerts.update_many(
+        {"_id": {"$in": alert_ids}},
+        {"$set": {"status": "sent", "last_retry_at": datetime.now(timezone.utc)}},
+    )
 
-    if error_message is not None:
-        update_doc["error_message"] = error_message
 
-    await db.pending_alerts.update_one({"_id": alert_id}, {"$set": update_doc})
+async def reschedule_pending_alerts(db, updates: List[Dict[str, Any]]):
+    """
+    Record failed attempts in one bulk write. Each update has `_id`,
+    `status`, `retry_count`, `next_attempt_at` and `error_message`.
+    """
+    if not updates:
+        return
+    now = datetime.now(timezone.utc)
+    await db.pending_alerts.bulk_write(
+        [
+            UpdateOne(
+                {"_id": u["_id"]},
+                {
+                    "$set": {
+                        "status": u["status"],
+                        "retry_count": u["retry_count"],
+                        "next_attempt_at": u["next_attempt_at"],
+                        "error_message": u["error_message"],
+                        "last_retry_at": now,
+                    }
+                },
+            )
+            for u in updates
+        ],
+        ordered=False,
+    )
 
 
 async def save_device_user_mapping(db, mapping: DeviceUserMapping):
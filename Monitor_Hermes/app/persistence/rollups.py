@@ -0,0 +1,351 @@
+"""
+Pre-aggregated rollups of the `measurements_history` time series.
+
+Each rollup collection holds one document per device, measurement, channel
+and bucket (1 minute, 1 hour or 1 day) with the count, sum, min and max of
+the raw points that fall in it. The write buffer folds every flushed batch
+of points into all of them with one unordered bulk upsert per collection, and
+`/measurements/history` reads the coarsest rollup whose bucket fits in the
+requested step instead of grouping raw points.
+
+compact_rollups() recomputes the rollups of a time range from the raw
+points; it backfills data ingested before rollups existed and repairs
+buckets after a failed rollup write.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import loguru
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+class Rollup(NamedTuple):
+    collection: str
+    width_ms: int
+    # TTL in seconds, None keeps buckets forever
+    retention: Optional[int]
+
+
+# Finest first
+ROLLUPS = [
+    Rollup("measurements_rollup_1m", 60_000, 90 * 86400),
+    Rollup("measurements_rollup_1h", 3_600_000, 730 * 86400),
+    Rollup("measurements_rollup_1d", 86_400_000, None),
+]
+
+KEY_FIELDS = ["d", "m", "c", "ts"]
+
+# Days recomputed per aggregation when compacting
+COMPACT_CHUNK = timedelta(days=1)
+
+# How long a replica may hold the backfill before another one takes over
+BACKFILL_LOCK = timedelta(hours=1)
+
+# Wait after the day rollups were enabled ends before recompacting it, so
+# late uplinks of that day are in
+ENABLING_DAY_GRACE = timedelta(minutes=15)
+
+
+def _epoch_ms(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+
+def bucket_start(ts: datetime, width_ms: int) -> datetime:
+    """Start of the epoch-aligned bucket of `width_ms` containing `ts`."""
+    ms = _epoch_ms(ts)
+    return datetime.fromtimestamp((ms - ms % width_ms) / 1000, tz=timezone.utc)
+
+
+def _bucket_expr(field: str, width_ms: int) -> Dict[str, Any]:
+    return {
+        "$toDate": {
+            "$subtract": [
+                {"$toLong": field},
+                {"$mod": [{"$toLong": field}, width_ms]},
+            ]
+        }
+    }
+
+
+def pick_rollup(interval_ms: int) -> Optional[Rollup]:
+    """Coarsest rollup whose buckets fit in one step, or None for raw points."""
+    fitting = [r for r in ROLLUPS if r.width_ms <= interval_ms]
+    return fitting[-1] if fitting else None
+
+
+def fold_points(
+    points: List[Dict[str, Any]], width_ms: int
+) -> Dict[Tuple[str, str, str, datetime], Dict[str, Any]]:
+    """Aggregate raw points into buckets of `width_ms`."""
+    buckets: Dict[Tuple[str, str, str, datetime], Dict[str, Any]] = {}
+    for point in points:
+        meta = point["meta"]
+        val = point["val"]
+        key = (meta["d"], meta["m"], meta["c"], bucket_start(point["ts"], width_ms))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = {
+                "t": meta.get("t"),
+                "count": 1,
+                "sum": val,
+                "min": val,
+                "max": val,
+            }
+        else:
+            bucket["count"] += 1
+            bucket["sum"] += val
+            bucket["min"] = min(bucket["min"], val)
+            bucket["max"] = max(bucket["max"], val)
+    return buckets
+
+
+async def update_rollups(db, points: List[Dict[str, Any]]):
+    """Fold a batch of raw time series points into every rollup."""
+    if not points:
+        return
+
+    for rollup in ROLLUPS:
+        ops = [
+            UpdateOne(
+                {"d": d, "m": m, "c": c, "ts": ts},
+                {
+                    "$inc": {"count": bucket["count"], "sum": bucket["sum"]},
+                    "$min": {"min": bucket["min"]},
+                    "$max": {"max": bucket["max"]},
+                    "$setOnInsert": {"t": bucket["t"]},
+                },
+                upsert=True,
+            )
+            for (d, m, c, ts), bucket in fold_points(points, rollup.width_ms).items()
+        ]
+        await db[rollup.collection].bulk_write(ops, ordered=False)
+
+
+async def rollup_aggregations(
+    db,
+    rollup: Rollup,
+    dev_eui: str,
+    measurement_type: str,
+    start: datetime,
+    end: datetime,
+    interval_ms: int,
+    channel: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Same output as db_helpers.aggregations, computed from a rollup.
+    `interval_ms` must be a multiple of the rollup's bucket width; the range
+    is widened to whole rollup buckets.
+    """
+    match_stage = {
+        "d": dev_eui,
+        "m": measurement_type,
+        "ts": {"$gte": bucket_start(start, rollup.width_ms), "$lte": end},
+    }
+    if channel:
+        match_stage["c"] = channel
+
+    pipeline = [
+        {"$match": match_stage},
+        {
+            "$group": {
+                "_id": {"channel": "$c", "time": _bucket_expr("$ts", interval_ms)},
+                "count": {"$sum": "$count"},
+                "sum": {"$sum": "$sum"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"},
+            }
+        },
+        {"$sort": {"_id.time": 1}},
+        {
+            "$project": {
+                "_id": 0,
+                "timestamp": "$_id.time",
+                "channel": "$_id.channel",
+                "avg": {"$round": [{"$divide": ["$sum", "$count"]}, 2]},
+                "min": "$min",
+                "max": "$max",
+            }
+        },
+    ]
+
+    cursor = await db[rollup.collection].aggregate(pipeline)
+    return await cursor.to_list(None)
+
+
+def _compact_pipeline(
+    source_is_raw: bool, rollup: Rollup, start: datetime, end: datetime
+) -> List[Dict[str, Any]]:
+    if source_is_raw:
+        key = {"d": "$meta.d", "m": "$meta.m", "c": "$meta.c"}
+        tenant, count, total = "$meta.t", 1, "$val"
+        low, high = "$val", "$val"
+    else:
+        key = {"d": "$d", "m": "$m", "c": "$c"}
+        tenant, count, total = "$t", "$count", "$sum"
+        low, high = "$min", "$max"
+
+    return [
+        {"$match": {"ts": {"$gte": start, "$lt": end}}},
+        {
+            "$group": {
+                "_id": {**key, "ts": _bucket_expr("$ts", rollup.width_ms)},
+                "t": {"$first": tenant},
+                "count": {"$sum": count},
+                "sum": {"$sum": total},
+                "min": {"$min": low},
+                "max": {"$max": high},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "d": "$_id.d",
+                "m": "$_id.m",
+                "c": "$_id.c",
+                "ts": "$_id.ts",
+                "t": 1,
+                "count": 1,
+                "sum": 1,
+                "min": 1,
+                "max": 1,
+            }
+        },
+        {
+            "$merge": {
+                "into": rollup.collection,
+                "on": KEY_FIELDS,
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+async def compact_rollups(db, start: datetime, end: datetime):
+    """
+    Recompute every rollup for [start, end) from the raw points, one day at a
+    time: 1m from raw, then each coarser level from the one below. The range
+    is widened to whole days so no bucket is rebuilt from partial data.
+    Increments that land in a bucket while it is being replaced are lost, so
+    run this on ranges that are not receiving data (e.g. backfills).
+    """
+    coarsest = ROLLUPS[-1].width_ms
+    chunk_start = bucket_start(start, coarsest)
+    end = bucket_start(end, coarsest) + timedelta(milliseconds=coarsest)
+
+    while chunk_start < end:
+        chunk_end = min(chunk_start + COMPACT_CHUNK, end)
+        source = db.measurements_history
+        for level, rollup in enumerate(ROLLUPS):
+            cursor = await source.aggregate(
+                _compact_pipeline(level == 0, rollup, chunk_start, chunk_end)
+            )
+            await cursor.to_list(None)
+            source = db[rollup.collection]
+        chunk_start = chunk_end
+
+    loguru.logger.info(f"Compacted rollups from {start} to {end}")
+
+
+async def _lease(db, task: str, now: datetime, **on_insert) -> Optional[Dict]:
+    """
+    Take the `rollup_state` lock of a one-off task. Returns its state, or
+    None if the task is done or another replica holds the lock.
+    """
+    update: Dict[str, Any] = {"$set": {"locked_until": now + BACKFILL_LOCK}}
+    if on_insert:
+        update["$setOnInsert"] = on_insert
+    try:
+        return await db.rollup_state.find_one_and_update(
+            {
+                "_id": task,
+                "done_at": {"$exists": False},
+                "locked_until": {"$not": {"$gt": now}},
+            },
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+
+
+async def _release(db, task: str, done: bool):
+    """Release a task lock, marking the task done or letting it be retried."""
+    update: Dict[str, Any] = {"$unset": {"locked_until": ""}}
+    if done:
+        update["$set"] = {"done_at": datetime.now(timezone.utc)}
+    try:
+        await db.rollup_state.update_one({"_id": task}, update)
+    except Exception as e:
+        loguru.logger.warning(f"Failed to release rollup task {task}: {e}")
+
+
+async def backfill_rollups(db):
+    """
+    Build the rollups from the raw history once, on first startup.
+
+    Live ingest folds points into the rollups from the moment they are
+    enabled, so the backfill stops at the start of that day: compacting
+    later buckets would replace increments made meanwhile. Once that day is
+    over (plus ENABLING_DAY_GRACE) it is compacted too, which completes its
+    1h/1d buckets. Locks in `rollup_state` make sure a single replica runs
+    each step, and an unfinished step is retried on the next startup.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        state = await _lease(db, "backfill", now, enabled_at=now)
+        if state is not None:
+            await _backfill(db, state["enabled_at"])
+        state = await db.rollup_state.find_one({"_id": "backfill"})
+    except Exception as e:
+        loguru.logger.exception(f"Failed to backfill rollups: {e}")
+        return
+
+    if state is not None and "done_at" in state:
+        await _compact_enabling_day(db, state["enabled_at"])
+
+
+async def _backfill(db, enabled_at: datetime):
+    done = False
+    try:
+        cutoff = bucket_start(enabled_at, ROLLUPS[-1].width_ms)
+        first = await db.measurements_history.find_one(
+            {"ts": {"$lt": cutoff}}, sort=[("ts", ASCENDING)]
+        )
+        if first is not None:
+            loguru.logger.info(
+                f"Backfilling rollups from measurements_history up to {cutoff}"
+            )
+            # compact_rollups widens the end to a whole day
+            await compact_rollups(
+                db, first["ts"], cutoff - timedelta(milliseconds=1)
+            )
+        done = True
+    finally:
+        await _release(db, "backfill", done)
+
+
+async def _compact_enabling_day(db, enabled_at: datetime):
+    day = bucket_start(enabled_at, ROLLUPS[-1].width_ms)
+    due = day + timedelta(milliseconds=ROLLUPS[-1].width_ms) + ENABLING_DAY_GRACE
+    wait = (due - datetime.now(timezone.utc)).total_seconds()
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+    done = False
+    try:
+        if await _lease(db, "enabling_day", datetime.now(timezone.utc)) is None:
+            return
+        try:
+            await compact_rollups(db, day, day)
+            done = True
+        finally:
+            await _release(db, "enabling_day", done)
+    except Exception as e:
+        loguru.logger.exception(f"Failed to compact rollups of {day}: {e}")
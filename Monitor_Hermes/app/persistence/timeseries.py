@@ -1,14 +1,13 @@
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
 import loguru
 from pymongo.errors import BulkWriteError
 from pymongo.database import Database
 
 
-async def transform_and_insert_timeseries(db: Database, payload: Dict[str, Any]):
+def build_timeseries_docs(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    Transforms the raw payload into time series documents and inserts them into MongoDB.
-    Uses insert_many with ordered=False for performance and fault tolerance.
+    Transforms the raw payload into time series documents.
     Ensures values are stored as floats for correct aggregation.
     """
     ts_docs = []
@@ -17,7 +16,7 @@ async def transform_and_insert_timeseries(db: Database, payload: Dict[str, Any])
     tenant_id = payload.get("tenant_id")
 
     if not dev_eui or not tenant_id:
-        return
+        return ts_docs
 
     base_meta = {
         "d": dev_eui,
@@ -50,6 +49,17 @@ async def transform_and_insert_timeseries(db: Database, payload: Dict[str, Any])
                     except (ValueError, TypeError):
                         continue
 
+    return ts_docs
+
+
+async def transform_and_insert_timeseries(db: Database, payload: Dict[str, Any]):
+    """
+    Transforms the raw payload into time series documents and inserts them into MongoDB.
+    Uses insert_many with ordered=False for performance and fault tolerance.
+    """
+    dev_eui = payload.get("dev_eui")
+    ts_docs = build_timeseries_docs(payload)
+
     if not ts_docs:
         return
 
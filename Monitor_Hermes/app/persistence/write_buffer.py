@@ -0,0 +1,320 @@
+"""
+Write-behind buffer for ingest persistence.
+Accumulates message documents and time series points across many uplinks
+and flushes them to MongoDB with unordered insert_many calls.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import loguru
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.persistence.models import MessageIn
+from app.persistence.rollups import update_rollups
+from app.redis.snapshot import update_snapshots
+from app.settings import settings
+from app.utils.metrics import WORKER_STAGE_SECONDS
+
+
+class WriteBufferFull(Exception):
+    """The buffer did not drain below max_pending within the backpressure timeout."""
+
+
+class WriteBuffer:
+    """
+    Buffers documents for the `messages` and `measurements_history` collections.
+    Time series points are also folded into the rollup collections once
+    they are written.
+
+    A flush happens when either collection reaches `max_batch` documents or
+    every `flush_interval` seconds, whichever comes first. When more than
+    `max_pending` documents are waiting (e.g. MongoDB is down), producers are
+    blocked until a flush succeeds, so the backlog stays in the Redis queue
+    instead of in process memory; after `backpressure_timeout` seconds they
+    get WriteBufferFull.
+
+    Messages can carry an `ack_id` (e.g. a Redis Stream entry id) and the
+    time series points built from them; once the message and all of its
+    points are persisted, its ack id is passed to `ack_handler`.
+
+    Every document gets its `_id` before it is buffered (derived from the
+    stream entry id by the ingest worker). Messages retried after a transient
+    error or redelivered after a crash are deduplicated by the unique `_id`
+    index; the time series collection has none, so points that may already
+    be stored are looked up and skipped (see _insert_points).
+    """
+
+    def __init__(
+        self,
+        max_batch: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        backpressure_timeout: Optional[float] = None,
+    ):
+        self.max_batch = max(1, max_batch or settings.WRITE_BUFFER_MAX_BATCH)
+        self.flush_interval = (
+            flush_interval
+            if flush_interval is not None
+            else settings.WRITE_BUFFER_FLUSH_INTERVAL_MS / 1000
+        )
+        self.max_pending = max(
+            self.max_batch, max_pending or settings.WRITE_BUFFER_MAX_PENDING
+        )
+        self.backpressure_timeout = (
+            backpressure_timeout
+            if backpressure_timeout is not None
+            else settings.WRITE_BUFFER_BACKPRESSURE_TIMEOUT
+        )
+        self.db = None
+        self.ack_handler: Optional[Callable[[List[str]], Awaitable[None]]] = None
+        self._messages: List[Dict[str, Any]] = []
+        self._points: List[Dict[str, Any]] = []
+        # ack id -> documents of that message not persisted yet
+        self._acks: Dict[str, int] = {}
+        # document _id -> ack id of the message it belongs to
+        self._doc_acks: Dict[ObjectId, str] = {}
+        # points whose last insert failed and may have been partly written;
+        # they were never folded into the rollups
+        self._retry_points: Set[ObjectId] = set()
+        # points of redelivered messages, possibly stored (and rolled up) by
+        # an earlier delivery
+        self._redelivered_points: Set[ObjectId] = set()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._points)
+
+    def start(self, db):
+        """Bind the database and start the periodic flusher task."""
+        self.db = db
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        loguru.logger.debug("Write buffer started")
+
+    async def close(self):
+        """Stop the flusher task and flush everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+        if self.pending:
+            loguru.logger.error(
+                f"Write buffer closed with {self.pending} unflushed documents"
+            )
+        loguru.logger.debug("Write buffer closed")
+
+    def pending_ack(self, ack_id: str) -> bool:
+        """Whether a message with this ack id is buffered and not yet acked."""
+        return ack_id in self._acks
+
+    async def add_message(
+        self,
+        message: MessageIn,
+        ack_id: Optional[str] = None,
+        points: Optional[List[Dict[str, Any]]] = None,
+        doc_id: Optional[ObjectId] = None,
+        redelivered: bool = False,
+    ) -> str:
+        """
+        Queue a message document and its time series points for insertion.
+        `doc_id` overrides the generated ObjectId (e.g. to make a redelivered
+        message a duplicate key); `redelivered` marks a message that may have
+        been stored before, whose points are checked before insertion.
+        Returns the ObjectId as a string, like save_message.
+        """
+        doc = message.model_dump()
+        doc["_id"] = doc_id or ObjectId()
+        doc["timestamp"] = datetime.now(timezone.utc)
+        points = points or []
+        for point in points:
+            point.setdefault("_id", ObjectId())
+        if redelivered:
+            self._redelivered_points.update(point["_id"] for point in points)
+
+        if ack_id is not None:
+            self._acks[ack_id] = 1 + len(points)
+            for _id in [doc["_id"], *(point["_id"] for point in points)]:
+                self._doc_acks[_id] = ack_id
+
+        self._messages.append(doc)
+        self._points.extend(points)
+        await self._after_add()
+        return str(doc["_id"])
+
+    async def add_points(self, points: List[Dict[str, Any]]):
+        """Queue time series points that don't belong to an acked message."""
+        if not points:
+            return
+        for point in points:
+            point.setdefault("_id", ObjectId())
+        self._points.extend(points)
+        await self._after_add()
+
+    async def flush(self):
+        """Write all buffered documents to MongoDB."""
+        async with self._lock:
+            messages, self._messages = self._messages, []
+            points, self._points = self._points, []
+
+            with WORKER_STAGE_SECONDS.labels("flush").time():
+                failed_messages = await self._insert("messages", messages)
+                failed_points, new_points = await self._insert_points(points)
+
+            # Keep documents that could not be written because of a transient
+            # error (not a per-document write error) for the next flush.
+            self._messages[:0] = failed_messages
+            self._points[:0] = failed_points
+
+            stored_messages = [] if failed_messages else messages
+            stored_points = [] if failed_points else points
+
+            if stored_messages:
+                with WORKER_STAGE_SECONDS.labels("snapshots").time():
+                    await update_snapshots(stored_messages)
+
+            if new_points:
+                await self._rollup(new_points)
+
+            await self._ack(stored_messages + stored_points)
+
+    async def _rollup(self, points: List[Dict[str, Any]]):
+        if not settings.ROLLUPS_ENABLED:
+            return
+        try:
+            with WORKER_STAGE_SECONDS.labels("rollups").time():
+                await update_rollups(self.db, points)
+        except Exception as e:
+            # The raw points are stored; compact_rollups can rebuild the buckets
+            loguru.logger.error(f"Failed to update rollups for {len(points)} points: {e}")
+
+    async def _ack(self, docs: List[Dict[str, Any]]):
+        """Acknowledge the messages whose documents are now all persisted."""
+        ack_ids = []
+        for doc in docs:
+            ack_id = self._doc_acks.pop(doc["_id"], None)
+            if ack_id is None:
+                continue
+            self._acks[ack_id] -= 1
+            if self._acks[ack_id] <= 0:
+                del self._acks[ack_id]
+                ack_ids.append(ack_id)
+        if not ack_ids or self.ack_handler is None:
+            return
+        try:
+            await self.ack_handler(ack_ids)
+        except Exception as e:
+            loguru.logger.error(f"Failed to acknowledge {len(ack_ids)} messages: {e}")
+
+    async def _after_add(self):
+        if len(self._messages) >= self.max_batch or len(self._points) >= self.max_batch:
+            await self.flush()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.backpressure_timeout
+        while self.pending >= self.max_pending:
+            if loop.time() >= deadline:
+                raise WriteBufferFull(
+                    f"Write buffer still full ({self.pending} documents) after "
+                    f"{self.backpressure_timeout}s"
+                )
+            loguru.logger.warning(
+                f"Write buffer full ({self.pending} documents), applying backpressure"
+            )
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _insert(
+        self, collection: str, docs: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        if not docs:
+            return []
+        if self.db is None:
+            return docs
+
+        try:
+            await self.db[collection].insert_many(docs, ordered=False)
+            loguru.logger.debug(f"Flushed {len(docs)} documents to '{collection}'")
+        except BulkWriteError as bwe:
+            loguru.logger.warning(
+                f"Partial flush to '{collection}': {bwe.details['nInserted']} inserted, "
+                f"{len(bwe.details['writeErrors'])} failed."
+            )
+        except Exception as e:
+            loguru.logger.error(
+                f"Failed to flush {len(docs)} documents to '{collection}': {e}"
+            )
+            return docs
+        return []
+
+    async def _insert_points(
+        self, points: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Insert time series points, skipping those already stored by an
+        earlier, failed insert_many or an earlier delivery of their message.
+        Returns the points to keep for the next flush and, on success, the
+        points to fold into the rollups: points stored by an earlier
+        delivery were already counted there.
+        """
+        suspect = [
+            p
+            for p in points
+            if p["_id"] in self._retry_points or p["_id"] in self._redelivered_points
+        ]
+        stored: Set[ObjectId] = set()
+        if suspect and self.db is not None:
+            try:
+                cursor = self.db.measurements_history.find(
+                    {
+                        "_id": {"$in": [p["_id"] for p in suspect]},
+                        "ts": {
+                            "$gte": min(p["ts"] for p in suspect),
+                            "$lte": max(p["ts"] for p in suspect),
+                        },
+                    },
+                    {"_id": 1},
+                )
+                stored = {doc["_id"] async for doc in cursor}
+            except Exception as e:
+                loguru.logger.error(f"Failed to check retried points: {e}")
+                return points, []
+
+        to_insert = [p for p in points if p["_id"] not in stored]
+        failed = await self._insert("measurements_history", to_insert)
+        if failed:
+            # Whatever this attempt wrote is ours and not rolled up yet
+            ids = [p["_id"] for p in to_insert]
+            self._redelivered_points.difference_update(ids)
+            self._retry_points.update(ids)
+            return points, []
+
+        new_points = [
+            p
+            for p in points
+            if p["_id"] not in stored or p["_id"] in self._retry_points
+        ]
+        ids = [p["_id"] for p in points]
+        self._retry_points.difference_update(ids)
+        self._redelivered_points.difference_update(ids)
+        return [], new_points
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                loguru.logger.exception(f"Error in write buffer flusher: {e}")
+
+
+write_buffer = WriteBuffer()
@@ -0,0 +1,152 @@
+"""
+Read-through Redis cache for the history endpoints.
+
+/measurements/history ranges are split into epoch-aligned buckets of the
+aggregation step. A bucket that ended more than QUERY_CACHE_GRACE_SECONDS
+ago is closed and its rows are kept in Redis for QUERY_CACHE_TTL; only
+missing closed buckets and the open trailing ones are read from MongoDB, in
+a single query.
+
+Redis errors fall back to querying MongoDB.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import loguru
+
+from app.persistence.db_helpers import aggregate_buckets, history_step
+from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.utils.serialization import dumps, loads
+
+# Buckets per Redis hash; bounds hash size and lets unused pages expire
+PAGE_BUCKETS = 256
+
+Rows = List[Dict[str, Any]]
+
+
+def _ms(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+
+def _dt(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def _page_key(key: str, bucket: int, width_ms: int) -> str:
+    return f"{key}:{bucket // (width_ms * PAGE_BUCKETS)}"
+
+
+async def _read_buckets(
+    key: str, buckets: List[int], width_ms: int
+) -> Dict[int, Rows]:
+    client = get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        for bucket in buckets:
+            pipe.hget(_page_key(key, bucket, width_ms), str(bucket))
+        values = await pipe.execute()
+    return {b: loads(v) for b, v in zip(buckets, values) if v is not None}
+
+
+async def _store_buckets(key: str, rows_by_bucket: Dict[int, Rows], width_ms: int):
+    pages: Dict[str, Dict[str, str]] = {}
+    for bucket, rows in rows_by_bucket.items():
+        pages.setdefault(_page_key(key, bucket, width_ms), {})[str(bucket)] = dumps(
+            rows
+        )
+
+    client = get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        for page, mapping in pages.items():
+            pipe.hset(page, mapping=mapping)
+            pipe.expire(page, settings.QUERY_CACHE_TTL)
+        await pipe.execute()
+
+
+async def read_through(
+    key: str,
+    start_ms: int,
+    end_ms: int,
+    width_ms: int,
+    compute: Callable[[int, int], Awaitable[Rows]],
+    bucket_of: Callable[[Dict[str, Any]], int],
+) -> Rows:
+    """
+    Rows for [start_ms, end_ms), in bucket order, split into buckets of
+    `width_ms`. compute(from_ms, to_ms) queries a range of whole buckets and
+    bucket_of(row) gives the bucket a computed row belongs to.
+    """
+    first = start_ms - start_ms % width_ms
+    buckets = list(range(first, max(end_ms, first + 1), width_ms))
+    closed_before = int(time.time() * 1000) - settings.QUERY_CACHE_GRACE_SECONDS * 1000
+    closed = [b for b in buckets if b + width_ms <= closed_before]
+
+    rows_by_bucket: Dict[int, Rows] = {}
+    if closed:
+        try:
+            rows_by_bucket = await _read_buckets(key, closed, width_ms)
+        except Exception as e:
+            loguru.logger.warning(f"Query cache read failed for {key}: {e}")
+
+    missing = [b for b in buckets if b not in rows_by_bucket]
+    if missing:
+        fresh: Dict[int, Rows] = {b: [] for b in missing}
+        for row in await compute(missing[0], missing[-1] + width_ms):
+            bucket = bucket_of(row)
+            if bucket in fresh:
+                fresh[bucket].append(row)
+        rows_by_bucket.update(fresh)
+
+        to_store = {b: fresh[b] for b in missing if b + width_ms <= closed_before}
+        if to_store:
+            try:
+                await _store_buckets(key, to_store, width_ms)
+            except Exception as e:
+                loguru.logger.warning(f"Query cache write failed for {key}: {e}")
+
+    return [row for b in buckets for row in rows_by_bucket[b]]
+
+
+async def cached_aggregations(
+    db,
+    dev_eui: str,
+    measurement_type: str,
+    start: datetime,
+    end: datetime,
+    steps: int,
+    channel: Optional[str] = None,
+) -> Rows:
+    """db_helpers.aggregations through the cache; start snaps to a step."""
+    steps = max(1, steps)
+    if end < start:
+        start, end = end, start
+
+    interval_ms, rollup = history_step(start, end, steps)
+
+    async def compute(from_ms: int, to_ms: int) -> Rows:
+        return await aggregate_buckets(
+            db,
+            dev_eui,
+            measurement_type,
+            _dt(from_ms),
+            _dt(to_ms - 1),
+            interval_ms,
+            rollup,
+            channel,
+        )
+
+    if not settings.QUERY_CACHE_ENABLED:
+        return await compute(_ms(start), _ms(end) + 1)
+
+    return await read_through(
+        f"history_cache:{dev_eui}:{measurement_type}:{channel or '*'}:{interval_ms}",
+        _ms(start),
+        _ms(end) + 1,
+        interval_ms,
+        compute,
+        lambda row: _ms(row["timestamp"]),
+    )
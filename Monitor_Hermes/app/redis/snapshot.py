@@ -0,0 +1,263 @@
+"""
+Per-device latest-state snapshot in Redis.
+
+For every device Hermes keeps
+- `device_last_messages:{dev_eui}`: its latest MAX_LAST_MESSAGES messages,
+  newest first (list), served by /messages/last;
+- `device_latest:{dev_eui}`: the last received value of each measurement
+  and channel (hash field "<measurement>:<channel>"), served in bulk by
+  /measurements/latest.
+
+The write buffer folds every flushed batch of messages into both, so warm
+devices are read without touching the `messages` collection. A device's
+message list is only extended once it exists: the first read seeds it from
+MongoDB, guarded by a token that any concurrent write cancels so a seed can
+never hide a message stored while it was being read. Messages a seed already
+read are not pushed again (see PUSH_MESSAGES_SCRIPT). Latest values are
+written unconditionally and completed on first read with HSETNX, which
+never replaces a newer value.
+
+Redis errors fall back to querying MongoDB.
+"""
+
+import asyncio
+import uuid
+from datetime import timezone
+from typing import Any, Dict, Iterable, List
+
+import loguru
+from redis.exceptions import WatchError
+
+from app.persistence.db_helpers import (
+    MAX_LAST_MESSAGES,
+    clamp_last_limit,
+    get_last_messages,
+)
+from app.persistence.models import MessageDB
+from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.utils.serialization import dumps, loads
+
+# Marks a latest-values hash that holds everything found in MongoDB
+SEEDED_FIELD = "_seeded"
+SEED_TIMEOUT = 30
+
+# LPUSHX of message rows (ARGV[3:], oldest first) that skips rows whose _id
+# is already in the list, e.g. because a seed read them from MongoDB after
+# they were stored; then trims to ARGV[1] rows and expires after ARGV[2] s.
+PUSH_MESSAGES_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+local max_len = tonumber(ARGV[1])
+local stored = {}
+for _, row in ipairs(redis.call("LRANGE", KEYS[1], 0, max_len - 1)) do
+    stored[cjson.decode(row)["_id"]] = true
+end
+for i = 3, #ARGV do
+    local id = cjson.decode(ARGV[i])["_id"]
+    if not stored[id] then
+        redis.call("LPUSH", KEYS[1], ARGV[i])
+        stored[id] = true
+    end
+end
+redis.call("LTRIM", KEYS[1], 0, max_len - 1)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return 1
+"""
+
+Rows = List[Dict[str, Any]]
+
+
+def _messages_key(dev_eui: str) -> str:
+    return f"device_last_messages:{dev_eui}"
+
+
+def _seed_key(dev_eui: str) -> str:
+    return f"device_last_messages_seed:{dev_eui}"
+
+
+def _latest_key(dev_eui: str) -> str:
+    return f"device_latest:{dev_eui}"
+
+
+def message_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """A stored message document as /messages/last returns it."""
+    ts = doc["timestamp"]
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    # Same value MongoDB hands back: naive UTC, millisecond precision
+    ts = ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+    message = MessageDB(**{**doc, "_id": str(doc["_id"]), "timestamp": ts})
+    return message.model_dump(mode="json", by_alias=True)
+
+
+def latest_values(rows: Iterable[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Hash fields with the last value of each measurement/channel found in
+    `rows` (message rows, oldest first).
+    """
+    fields: Dict[str, str] = {}
+    for row in rows:
+        measurements = (row.get("payload") or {}).get("measurements")
+        if not isinstance(measurements, dict):
+            continue
+        for measurement, channels in measurements.items():
+            if not isinstance(channels, dict):
+                continue
+            for channel, points in channels.items():
+                if not isinstance(points, list) or not points:
+                    continue
+                point = points[-1]
+                if not isinstance(point, dict) or "value" not in point:
+                    continue
+                fields[f"{measurement}:{channel}"] = dumps(
+                    {
+                        "value": point["value"],
+                        "time": point.get("time"),
+                        "received_at": row["timestamp"],
+                    }
+                )
+    return fields
+
+
+async def update_snapshots(docs: List[Dict[str, Any]]):
+    """Fold newly stored message documents, in arrival order, into the snapshots."""
+    if not docs or not settings.SNAPSHOT_ENABLED:
+        return
+
+    by_device: Dict[str, Rows] = {}
+    for doc in docs:
+        by_device.setdefault(doc["dev_eui"], []).append(message_row(doc))
+
+    try:
+        client = get_redis_client()
+        push_messages = client.register_script(PUSH_MESSAGES_SCRIPT)
+        async with client.pipeline(transaction=False) as pipe:
+            for dev_eui, rows in by_device.items():
+                pipe.delete(_seed_key(dev_eui))
+                await push_messages(
+                    keys=[_messages_key(dev_eui)],
+                    args=[
+                        MAX_LAST_MESSAGES,
+                        settings.SNAPSHOT_TTL,
+                        *[dumps(row) for row in rows],
+                    ],
+                    client=pipe,
+                )
+
+                values = latest_values(rows)
+                if values:
+                    pipe.hset(_latest_key(dev_eui), mapping=values)
+                    pipe.expire(_latest_key(dev_eui), settings.SNAPSHOT_TTL)
+            await pipe.execute()
+    except Exception as e:
+        loguru.logger.warning(f"Failed to update device snapshots: {e}")
+
+
+async def _seed_messages(db, dev_eui: str) -> Rows:
+    client = get_redis_client()
+    key, seed_key = _messages_key(dev_eui), _seed_key(dev_eui)
+    token = uuid.uuid4().hex
+    seeding = False
+    try:
+        seeding = await client.set(seed_key, token, nx=True, ex=SEED_TIMEOUT)
+    except Exception as e:
+        loguru.logger.warning(f"Failed to start seeding {key}: {e}")
+
+    messages = await get_last_messages(db, dev_eui, MAX_LAST_MESSAGES)
+    rows = [m.model_dump(mode="json", by_alias=True) for m in messages]
+    if not seeding or not rows:
+        return rows
+
+    try:
+        async with client.pipeline(transaction=True) as pipe:
+            await pipe.watch(seed_key)
+            if await pipe.get(seed_key) == token:
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *[dumps(row) for row in rows])
+                pipe.expire(key, settings.SNAPSHOT_TTL)
+                pipe.delete(seed_key)
+                await pipe.execute()
+    except WatchError:
+        # A message was stored meanwhile; the next read seeds again
+        pass
+    except Exception as e:
+        loguru.logger.warning(f"Failed to seed {key}: {e}")
+    return rows
+
+
+async def last_messages(db, dev_eui: str, limit: int = 5) -> Rows:
+    """The device's latest messages, newest first."""
+    limit = clamp_last_limit(limit)
+    if not settings.SNAPSHOT_ENABLED:
+        messages = await get_last_messages(db, dev_eui, limit)
+        return [m.model_dump(mode="json", by_alias=True) for m in messages]
+
+    key = _messages_key(dev_eui)
+    try:
+        cached = await get_redis_client().lrange(key, 0, limit - 1)
+        if cached:
+            return [loads(row) for row in cached]
+    except Exception as e:
+        loguru.logger.warning(f"Failed to read {key}: {e}")
+
+    return (await _seed_messages(db, dev_eui))[:limit]
+
+
+async def _seed_latest(db, dev_eui: str) -> Dict[str, str]:
+    rows = await last_messages(db, dev_eui, MAX_LAST_MESSAGES)
+    fields = latest_values(reversed(rows))
+    if not settings.SNAPSHOT_ENABLED:
+        return fields
+
+    key = _latest_key(dev_eui)
+    try:
+        async with get_redis_client().pipeline(transaction=False) as pipe:
+            for field, value in fields.items():
+                pipe.hsetnx(key, field, value)
+            pipe.hset(key, SEEDED_FIELD, 1)
+            pipe.expire(key, settings.SNAPSHOT_TTL)
+            pipe.hgetall(key)
+            return (await pipe.execute())[-1]
+    except Exception as e:
+        loguru.logger.warning(f"Failed to seed {key}: {e}")
+        return fields
+
+
+def _nest(fields: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    values: Dict[str, Dict[str, Any]] = {}
+    for field, value in fields.items():
+        if field == SEEDED_FIELD:
+            continue
+        measurement, _, channel = field.rpartition(":")
+        values.setdefault(measurement, {})[channel] = loads(value)
+    return values
+
+
+async def latest_values_for(
+    db, dev_euis: List[str]
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Last value of each measurement and channel of these devices, as
+    {dev_eui: {measurement: {channel: {value, time, received_at}}}}.
+    Warm devices are read with one pipelined round trip; the others are
+    seeded from their latest messages.
+    """
+    dev_euis = list(dict.fromkeys(dev_euis))
+    hashes: Dict[str, Dict[str, str]] = {}
+    if settings.SNAPSHOT_ENABLED:
+        try:
+            async with get_redis_client().pipeline(transaction=False) as pipe:
+                for dev_eui in dev_euis:
+                    pipe.hgetall(_latest_key(dev_eui))
+                hashes = dict(zip(dev_euis, await pipe.execute()))
+        except Exception as e:
+            loguru.logger.warning(f"Failed to read latest values: {e}")
+
+    cold = [d for d in dev_euis if SEEDED_FIELD not in hashes.get(d, {})]
+    seeded = await asyncio.gather(*(_seed_latest(db, d) for d in cold))
+    hashes.update(zip(cold, seeded))
+
+    return {dev_eui: _nest(hashes[dev_eui]) for dev_eui in dev_euis}
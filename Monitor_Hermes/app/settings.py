@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -11,6 +13,15 @@ class Settings(BaseSettings):
     # Broker MQTT
     BROKER_URL: str
     BROKER_PORT: int = 1883
+    # "asyncio" (on the event loop) or "thread" (paho network thread)
+    MQTT_MODE: str = "asyncio"
+    MQTT_PROTOCOL_VERSION: int = 5
+    MQTT_CLIENT_ID: str = ""
+    MQTT_KEEPALIVE: int = 60
+    MQTT_QOS: int = 0
+    MQTT_MAX_INFLIGHT: int = 20
+    MQTT_SHARED_GROUP: str = ""
+    MQTT_RECONNECT_DELAY: int = 5
 
     # MongoDB
     MONGO_HOST: str
@@ -25,12 +36,88 @@ class Settings(BaseSettings):
     REDIS_PORT: int
     REDIS_PASSWORD: str
 
+    # Redis ingest stream and queue worker
+    INGEST_STREAM_KEY: str = "messages_stream"
+    INGEST_STREAM_MAXLEN: int = 100000
+    INGEST_CONSUMER_GROUP: str = "hermes"
+    INGEST_CONSUMERS: int = 1
+    INGEST_RECLAIM_IDLE_MS: int = 60000
+    INGEST_RECLAIM_INTERVAL: int = 30
+    INGEST_MAX_DELIVERIES: int = 5
+    WORKER_BATCH_SIZE: int = 100
+    WORKER_MAX_LINGER_MS: int = 50
+    WORKER_BLOCK_TIMEOUT: int = 5
+
+    # In-process measurement config cache
+    MEASUREMENT_CONFIG_CACHE_SIZE: int = 10000
+    MEASUREMENT_CONFIG_CACHE_TTL: int = 300
+
+    # MongoDB write-behind buffer
+    WRITE_BUFFER_MAX_BATCH: int = 500
+    WRITE_BUFFER_FLUSH_INTERVAL_MS: int = 1000
+    WRITE_BUFFER_MAX_PENDING: int = 10000
+    # Seconds a producer waits for a full buffer to drain before giving up
+    WRITE_BUFFER_BACKPRESSURE_TIMEOUT: int = 30
+
+    # 1m/1h/1d rollups of measurements_history, maintained at ingest and
+    # used by /measurements/history for coarse steps
+    ROLLUPS_ENABLED: bool = True
+
+    # Redis read-through cache for /measurements/history. Buckets that ended
+    # more than QUERY_CACHE_GRACE_SECONDS ago are cached for QUERY_CACHE_TTL
+    QUERY_CACHE_ENABLED: bool = True
+    QUERY_CACHE_TTL: int = 86400
+    QUERY_CACHE_GRACE_SECONDS: int = 120
+
+    # Per-device latest messages and values in Redis, kept up to date by the
+    # ingest worker; snapshots of devices without traffic expire after
+    # SNAPSHOT_TTL seconds
+    SNAPSHOT_ENABLED: bool = True
+    SNAPSHOT_TTL: int = 7 * 86400
+    # Most devices /measurements/latest accepts per call
+    LATEST_VALUES_MAX_DEVICES: int = 500
+
+    # Cursor batch size of /measurements/historic, also the number of points
+    # per streamed chunk
+    HISTORIC_BATCH_SIZE: int = 1000
+
+    # Alert cooldown per device and unit (seconds); overrides are keyed by
+    # "<unit>:<severity>", "<unit>" or "*:<severity>"
+    ALERT_COOLDOWN_SECONDS: int = 60
+    ALERT_COOLDOWN_OVERRIDES: Dict[str, int] = {}
+    ALERT_COOLDOWN_CACHE_SIZE: int = 10000
+
+    # Pending alert retry worker
+    ALERT_RETRY_POLL_INTERVAL: int = 10
+    ALERT_RETRY_BATCH_SIZE: int = 100
+    ALERT_RETRY_BATCH_THRESHOLD: int = 10
+    ALERT_RETRY_CONCURRENCY: int = 10
+    ALERT_RETRY_LEASE_SECONDS: int = 120
+    ALERT_RETRY_MAX_ATTEMPTS: int = 10
+    ALERT_RETRY_BASE_DELAY: int = 30
+    ALERT_RETRY_MAX_DELAY: int = 3600
+
     WS_SECRET: str
+    # Per-connection outbound queue; "drop_oldest" or "disconnect" when full
+    WS_SEND_QUEUE_SIZE: int = 100
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    # Redis pub/sub bus for delivery across Hermes replicas
+    WS_BUS_ENABLED: bool = True
+    WS_BUS_CHANNEL_PREFIX: str = "ws"
 
     # External Services
     SERVICE_API_KEY: str
     ATLAS_HOST_URL: str = "http://localhost:8000"
     ATLAS_VERIFY_SSL: bool = True
+    ATLAS_NEGATIVE_CACHE_TTL: int = 60
+    ATLAS_TIMEOUT: float = 30.0
+    ATLAS_MAX_CONNECTIONS: int = 20
+    ATLAS_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    ATLAS_KEEPALIVE_EXPIRY: float = 30.0
+    ATLAS_HTTP2: bool = False
+
+    # Seconds between refreshes of the Redis/Mongo backed Prometheus gauges
+    METRICS_REFRESH_INTERVAL: int = 15
 
     # SSL/TLS Configuration for WSS (WebSocket Secure)
     SSL_KEYFILE: str | None = None
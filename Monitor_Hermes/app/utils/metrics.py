@@ -0,0 +1,132 @@
+"""
+Prometheus metrics for the ingest pipeline, served at /metrics.
+
+Counters and histograms are updated where the events happen. Gauges that
+describe in-process state (buffer depth, connections) are refreshed by
+update_runtime_gauges right before each scrape; the ones that need a Redis
+or Mongo round trip (stream backlog, pending alerts) are refreshed every
+METRICS_REFRESH_INTERVAL seconds by refresh_backlog_gauges, so scrapes
+never hit the databases.
+"""
+
+import asyncio
+import importlib
+
+import loguru
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.settings import settings
+
+MQTT_MESSAGES_RECEIVED = Counter(
+    "hermes_mqtt_messages_received_total", "MQTT uplink messages received"
+)
+MQTT_FORMAT_FAILURES = Counter(
+    "hermes_mqtt_format_failures_total",
+    "MQTT messages dropped because they could not be decoded or formatted",
+)
+
+WORKER_STAGE_SECONDS = Histogram(
+    "hermes_worker_stage_seconds",
+    "Time spent per ingest worker stage",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+WORKER_MESSAGES_PROCESSED = Counter(
+    "hermes_worker_messages_processed_total", "Messages processed by the worker"
+)
+
+ATLAS_REQUEST_SECONDS = Histogram(
+    "hermes_atlas_request_seconds", "Atlas API request latency", ["method"]
+)
+ATLAS_REQUEST_ERRORS = Counter(
+    "hermes_atlas_request_errors_total",
+    "Failed Atlas API requests (HTTP status or exception name)",
+    ["method", "reason"],
+)
+
+WS_SEND_FAILURES = Counter(
+    "hermes_ws_send_failures_total", "WebSocket sends that failed"
+)
+WS_DROPPED_MESSAGES = Counter(
+    "hermes_ws_dropped_messages_total",
+    "WebSocket messages dropped for slow consumers",
+)
+WS_SLOW_CONSUMER_DISCONNECTS = Counter(
+    "hermes_ws_slow_consumer_disconnects_total",
+    "WebSocket clients disconnected for being too slow",
+)
+
+ALERTS_SENT = Counter("hermes_alerts_sent_total", "Alerts delivered to Atlas")
+ALERTS_QUEUED = Counter(
+    "hermes_alerts_queued_total", "Alerts queued for retry after Atlas failed"
+)
+
+INGEST_STREAM_LENGTH = Gauge(
+    "hermes_ingest_stream_length", "Entries in the Redis ingest stream"
+)
+INGEST_PENDING = Gauge(
+    "hermes_ingest_pending_entries",
+    "Ingest stream entries delivered but not yet acknowledged",
+)
+INGEST_LAG = Gauge(
+    "hermes_ingest_lag_entries",
+    "Ingest stream entries not yet delivered to the consumer group",
+)
+WRITE_BUFFER_PENDING = Gauge(
+    "hermes_write_buffer_pending_documents", "Documents waiting in the write buffer"
+)
+WS_CONNECTIONS = Gauge(
+    "hermes_ws_connections", "Open WebSocket connections on this replica", ["kind"]
+)
+ATLAS_IN_FLIGHT = Gauge("hermes_atlas_in_flight_requests", "Atlas requests in flight")
+ATLAS_POOL_CONNECTIONS = Gauge(
+    "hermes_atlas_pool_connections", "Connections in the Atlas HTTP pool", ["state"]
+)
+PENDING_ALERTS = Gauge(
+    "hermes_pending_alerts", "Alerts waiting in the pending_alerts retry queue"
+)
+
+
+def update_runtime_gauges():
+    """Refresh the in-process state gauges."""
+    write_buffer = importlib.import_module("app.persistence.write_buffer").write_buffer
+    WRITE_BUFFER_PENDING.set(write_buffer.pending)
+
+    manager = importlib.import_module("app.ws.manager").manager
+    WS_CONNECTIONS.labels("tenant").set(sum(len(c) for c in manager.tenants.values()))
+    WS_CONNECTIONS.labels("superuser").set(len(manager.super_connections))
+    WS_CONNECTIONS.labels("global").set(len(manager.global_connections))
+    WS_CONNECTIONS.labels("device").set(
+        len({ws for subs in manager.device_subs.values() for ws in subs})
+    )
+
+    atlas_client = importlib.import_module("app.clients.atlas").atlas_client
+    open_connections, idle_connections = atlas_client.pool_connections()
+    ATLAS_POOL_CONNECTIONS.labels("open").set(open_connections)
+    ATLAS_POOL_CONNECTIONS.labels("idle").set(idle_connections)
+
+
+async def update_backlog_gauges(db):
+    """Refresh the Redis and Mongo backed gauges. Unavailable sources are skipped."""
+    try:
+        client = importlib.import_module("app.redis.redis").get_redis_client()
+        INGEST_STREAM_LENGTH.set(await client.xlen(settings.INGEST_STREAM_KEY))
+        for group in await client.xinfo_groups(settings.INGEST_STREAM_KEY):
+            if group.get("name") == settings.INGEST_CONSUMER_GROUP:
+                INGEST_PENDING.set(group.get("pending") or 0)
+                if group.get("lag") is not None:
+                    INGEST_LAG.set(group["lag"])
+    except Exception as e:
+        loguru.logger.debug(f"Could not read ingest stream metrics: {e}")
+
+    try:
+        PENDING_ALERTS.set(await db.pending_alerts.count_documents({"status": "pending"}))
+    except Exception as e:
+        loguru.logger.debug(f"Could not count pending alerts: {e}")
+
+
+async def refresh_backlog_gauges(db):
+    """Background task: update_backlog_gauges every METRICS_REFRESH_INTERVAL seconds."""
+    while True:
+        await update_backlog_gauges(db)
+        await asyncio.sleep(settings.METRICS_REFRESH_INTERVAL)
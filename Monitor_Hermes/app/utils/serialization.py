@@ -0,0 +1,68 @@
+"""
+Fast JSON encoding for outbound messages, cached query results and
+streamed responses.
+Uses orjson when it is installed and falls back to the standard library.
+"""
+
+import json
+from typing import Any, AsyncIterable, AsyncIterator, List
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def _default(obj: Any) -> str:
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def dumps(obj: Any) -> str:
+    """
+    Encode an object as a compact JSON string (same output shape as
+    WebSocket.send_json). Dates are encoded as ISO 8601, other values JSON
+    can't represent with str().
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            obj, default=_default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+
+def loads(data: str | bytes) -> Any:
+    """Decode a JSON string produced by dumps."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+async def _chunks(rows: AsyncIterable[Any], size: int) -> AsyncIterator[List[str]]:
+    chunk: List[str] = []
+    async for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def stream_ndjson(rows: AsyncIterable[Any], size: int = 1000) -> AsyncIterator[str]:
+    """Encode rows as newline-delimited JSON, `size` rows per chunk."""
+    async for chunk in _chunks(rows, size):
+        yield "\n".join(chunk) + "\n"
+
+
+async def stream_json_array(
+    rows: AsyncIterable[Any], size: int = 1000
+) -> AsyncIterator[str]:
+    """Encode rows as one JSON array, `size` rows per chunk."""
+    yield "["
+    first = True
+    async for chunk in _chunks(rows, size):
+        yield ("" if first else ",") + ",".join(chunk)
+        first = False
+    yield "]"
@@ -3,15 +3,20 @@ Measurement validation module.
 """
 
 from app.validation.measurement_cache import get_or_fetch_measurement_configs
-from app.validation.measurement_validator import validate_measurements
+from app.validation.measurement_validator import validate_measurements, validate_batch
 from app.validation.alert_service import send_alert_with_fallback
 from app.validation.rate_limiter import should_send_alert
-from app.validation.orchestrator import validate_and_alert_if_needed
+from app.validation.orchestrator import (
+    validate_and_alert_if_needed,
+    validate_and_alert_batch,
+)
 
 __all__ = [
     "get_or_fetch_measurement_configs",
     "validate_measurements",
+    "validate_batch",
     "send_alert_with_fallback",
     "should_send_alert",
     "validate_and_alert_if_needed",
+    "validate_and_alert_batch",
 ]
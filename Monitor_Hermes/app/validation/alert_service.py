@@ -12,6 +12,10 @@ from app.clients.atlas import atlas_client
 from app.persistence.mongo import save_pending_alert
 from app.persistence.models import PendingAlert
 from app.validation.measurement_validator import MeasurementViolation
+from app.utils.metrics import ALERTS_QUEUED, ALERTS_SENT
+
+# Notification type (severity) of measurement alerts in Atlas
+ALERT_TYPE = "warning"
 
 
 def build_alert_message(
@@ -55,7 +59,7 @@ def build_atlas_payload(
     return {
         "title": alert_msg["title"],
         "message": message_with_kpi,
-        "type": "warning",
+        "type": ALERT_TYPE,
         "dev_eui": dev_eui,
     }
 
@@ -76,6 +80,7 @@ async def send_alert_with_fallback(
             timeout=5.0,
         )
 
+        ALERTS_SENT.inc()
         loguru.logger.info(f"✅ Alert sent to Atlas for device {dev_eui}")
         return {"method": "atlas", "success": True}
 
@@ -94,6 +99,7 @@ async def send_alert_with_fallback(
 
         try:
             await save_pending_alert(db, pending_alert)
+            ALERTS_QUEUED.inc()
             loguru.logger.info(
                 f"📋 Alert queued for retry. Device: {dev_eui}"
             )
@@ -1,10 +1,12 @@
 """
 Measurement configuration cache management.
-Handles fetching configs from Atlas API and caching in MongoDB.
+Handles fetching configs from Atlas API and caching in MongoDB, with an
+in-process LRU cache in front of MongoDB for the validation hot path.
 """
 
 from typing import Optional, List
 from datetime import datetime, timezone
+import asyncio
 import httpx
 import loguru
 
@@ -14,6 +16,18 @@ from app.persistence.mongo import (
     save_device_measurement_configs,
 )
 from app.persistence.models import MeasurementConfig
+from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.utils.lru_cache import LRUCache
+from app.utils.singleflight import SingleFlight
+
+INVALIDATION_CHANNEL = "measurement_configs:invalidate"
+
+_local_cache = LRUCache(
+    maxsize=settings.MEASUREMENT_CONFIG_CACHE_SIZE,
+    ttl=settings.MEASUREMENT_CONFIG_CACHE_TTL,
+)
+_inflight = SingleFlight()
 
 
 async def get_or_fetch_measurement_configs(
@@ -21,12 +35,30 @@ async def get_or_fetch_measurement_configs(
 ) -> Optional[List[MeasurementConfig]]:
     """
     Get measurement configs from cache or fetch from Atlas API.
+    Lookup order: in-process LRU cache -> MongoDB -> Atlas API.
     First message from device triggers Atlas fetch and MongoDB cache.
+
+    Concurrent misses for the same device share a single lookup, and
+    devices without configs in Atlas are cached as empty for
+    ATLAS_NEGATIVE_CACHE_TTL seconds.
     """
+    configs = _local_cache.get(dev_eui)
+    if configs is not None:
+        return configs or None
+
+    return await _inflight.do(
+        dev_eui, lambda: _load_measurement_configs(dev_eui, db)
+    )
+
+
+async def _load_measurement_configs(
+    dev_eui: str, db
+) -> Optional[List[MeasurementConfig]]:
     cached = await get_device_measurement_configs(db, dev_eui)
 
     if cached:
         loguru.logger.debug(f"Using cached configs for {dev_eui}")
+        _local_cache.set(dev_eui, cached.configs)
         return cached.configs
 
     loguru.logger.info(f"No cached configs for {dev_eui}. Fetching from Atlas...")
@@ -42,16 +74,30 @@ async def get_or_fetch_measurement_configs(
 
         if not configs_data or not isinstance(configs_data, list):
             loguru.logger.warning(f"Empty or invalid configs from Atlas for {dev_eui}")
+            _local_cache.set(dev_eui, [], ttl=settings.ATLAS_NEGATIVE_CACHE_TTL)
             return None
 
         configs = [MeasurementConfig(**config) for config in configs_data]
 
         await save_device_measurement_configs(db, dev_eui, configs)
+        _local_cache.set(dev_eui, configs)
 
         loguru.logger.info(f"Fetched and cached {len(configs)} configs for {dev_eui}")
 
         return configs
 
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            loguru.logger.debug(
+                f"No configs in Atlas for {dev_eui}. Skipping validation."
+            )
+            _local_cache.set(dev_eui, [], ttl=settings.ATLAS_NEGATIVE_CACHE_TTL)
+        else:
+            loguru.logger.warning(
+                f"Atlas API error fetching configs for {dev_eui}: {e}. Skipping validation."
+            )
+        return None
+
     except httpx.HTTPError as e:
         loguru.logger.warning(
             f"Atlas API error fetching configs for {dev_eui}: {e}. Skipping validation."
@@ -86,6 +132,7 @@ async def force_refresh_measurement_configs(dev_eui: str, db) -> bool:
         configs = [MeasurementConfig(**config) for config in configs_data]
 
         await save_device_measurement_configs(db, dev_eui, configs)
+        await invalidate_measurement_configs(dev_eui)
 
         loguru.logger.info(f"Refreshed and cached {len(configs)} configs for {dev_eui}")
         return True
@@ -93,3 +140,48 @@ async def force_refresh_measurement_configs(dev_eui: str, db) -> bool:
     except Exception as e:
         loguru.logger.exception(f"Failed to force refresh configs for {dev_eui}: {e}")
         return False
+
+
+async def invalidate_measurement_configs(dev_eui: str):
+    """
+    Drop the in-process cache entry for a device and tell other Hermes
+    replicas to drop theirs via Redis pub/sub.
+    """
+    _local_cache.pop(dev_eui)
+    try:
+        await get_redis_client().publish(INVALIDATION_CHANNEL, dev_eui)
+    except Exception as e:
+        loguru.logger.warning(
+            f"Failed to publish config invalidation for {dev_eui}: {e}"
+        )
+
+
+async def listen_for_config_invalidations():
+    """
+    Background task: drop cache entries invalidated by any replica.
+    The whole cache is cleared on (re)subscribe, since invalidations may
+    have been missed while disconnected.
+    """
+    while True:
+        pubsub = None
+        try:
+            pubsub = get_redis_client().pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            _local_cache.clear()
+            loguru.logger.debug(f"Subscribed to {INVALIDATION_CHANNEL}")
+
+            async for msg in pubsub.listen():
+                if msg.get("type") == "message":
+                    _local_cache.pop(msg.get("data"))
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            loguru.logger.error(f"Config invalidation listener error: {e}")
+            await asyncio.sleep(1)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
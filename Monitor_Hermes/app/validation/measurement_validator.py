@@ -1,15 +1,32 @@
 """
 Measurement validation logic.
 Validates device measurements against configured limits.
+
+Per-device configs are compiled once into min/max arrays, one row per config.
+The readings of a whole batch of messages, on any channel, are collected in
+one pass and checked against all their configs with NumPy.
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 import loguru
+import numpy as np
 
 from app.persistence.models import MeasurementConfig
+from app.settings import settings
+from app.utils.lru_cache import LRUCache
 
 
 class MeasurementViolation:
+    __slots__ = (
+        "unit",
+        "channel",
+        "value",
+        "limit_type",
+        "limit_value",
+        "threshold",
+        "timestamp",
+    )
+
     def __init__(
         self,
         unit: str,
@@ -40,83 +57,172 @@ class MeasurementViolation:
         }
 
 
-def validate_measurements(
-    payload: Dict[str, Any], configs: List[MeasurementConfig]
-) -> List[MeasurementViolation]:
+class CompiledRules:
     """
-    Validate measurements in payload against configured limits.
-    Returns list of violations found.
+    Measurement configs of one device compiled for vectorized checks: each
+    config is one row of the `mins`, `maxs` and `thresholds` arrays and
+    `index` maps a unit to the rows of all its configs, so every config of
+    a unit is checked.
     """
-    violations = []
 
-    measurements = payload.get("measurements")
-    if not measurements or not isinstance(measurements, dict):
-        loguru.logger.debug("No measurements field in payload")
-        return violations
+    __slots__ = ("source", "index", "mins", "maxs", "thresholds")
 
-    for config in configs:
-        unit = config.unit
+    def __init__(self, configs: Sequence[MeasurementConfig]):
+        self.source = configs
+        self.index: Dict[str, List[int]] = {}
+        for row, config in enumerate(configs):
+            self.index.setdefault(config.unit, []).append(row)
+        self.mins = np.array([c.min for c in configs], dtype=np.float64)
+        self.maxs = np.array([c.max for c in configs], dtype=np.float64)
+        self.thresholds = np.array([c.threshold for c in configs], dtype=np.float64)
 
-        if unit not in measurements:
-            continue
+    def __len__(self) -> int:
+        return len(self.mins)
 
-        unit_data = measurements[unit]
-        if not isinstance(unit_data, dict):
+
+_compiled = LRUCache(
+    maxsize=settings.MEASUREMENT_CONFIG_CACHE_SIZE,
+    ttl=settings.MEASUREMENT_CONFIG_CACHE_TTL,
+)
+
+
+def get_compiled_rules(
+    dev_eui: str, configs: Sequence[MeasurementConfig]
+) -> CompiledRules:
+    """
+    Compile a device's configs, reusing the previous compilation as long as
+    the same config list (e.g. from the in-process config cache) is passed.
+    """
+    rules = _compiled.get(dev_eui)
+    if rules is None or rules.source is not configs:
+        rules = CompiledRules(configs)
+        _compiled.set(dev_eui, rules)
+    return rules
+
+
+def validate_batch(
+    items: Sequence[Tuple[Dict[str, Any], Optional[CompiledRules]]],
+) -> List[List[MeasurementViolation]]:
+    """
+    Validate the measurements of many payloads at once.
+
+    Readings are collected once each, grouped by the (message, unit) whose
+    configs apply to them; pairing every reading with each of its configs
+    and comparing against the limits is done with NumPy.
+
+    Args:
+        items: (payload, rules) pairs; payloads without rules are skipped.
+    Returns:
+        One list of violations per item, in the same order.
+    """
+    results: List[List[MeasurementViolation]] = [[] for _ in items]
+
+    values: List[float] = []
+    reading_groups: List[int] = []
+    refs: List[Tuple[int, str, str, Any]] = []
+    # Per (message, unit) group: rows of its configs in the concatenated arrays
+    group_rows: List[List[int]] = []
+    mins, maxs, thresholds = [], [], []
+    offset = 0
+
+    for item_idx, (payload, rules) in enumerate(items):
+        if not rules:
             continue
 
-        for channel in ["ch1", "ch2", "ch3"]:
-            if channel not in unit_data:
-                continue
+        measurements = payload.get("measurements")
+        if not measurements or not isinstance(measurements, dict):
+            continue
 
-            readings = unit_data[channel]
-            if not isinstance(readings, list):
+        start = len(values)
+        for unit, unit_data in measurements.items():
+            unit_rows = rules.index.get(unit)
+            if not unit_rows or not isinstance(unit_data, dict):
                 continue
 
-            for reading in readings:
-                if not isinstance(reading, dict):
+            group = len(group_rows)
+            group_start = len(values)
+            for channel, readings in unit_data.items():
+                if not isinstance(readings, list):
                     continue
 
-                value = reading.get("value")
-                timestamp = reading.get("time")
-
-                if value is None:
-                    continue
+                for reading in readings:
+                    if not isinstance(reading, dict):
+                        continue
+
+                    value = reading.get("value")
+                    if value is None:
+                        continue
+                    try:
+                        value = float(value)
+                    except (ValueError, TypeError):
+                        continue
+
+                    values.append(value)
+                    reading_groups.append(group)
+                    refs.append((item_idx, unit, channel, reading.get("time")))
+
+            if len(values) > group_start:
+                group_rows.append([offset + row for row in unit_rows])
+
+        if len(values) > start:
+            mins.append(rules.mins)
+            maxs.append(rules.maxs)
+            thresholds.append(rules.thresholds)
+            offset += len(rules)
+
+    if not values:
+        return results
+
+    # Expand every reading into one (reading, config row) pair per config
+    groups = np.array(reading_groups, dtype=np.intp)
+    group_sizes = np.array([len(rows) for rows in group_rows], dtype=np.intp)
+    group_offsets = np.cumsum(group_sizes) - group_sizes
+    flat_rows = np.fromiter(
+        (row for rows in group_rows for row in rows), dtype=np.intp
+    )
+    counts = group_sizes[groups]
+    pair_reading = np.repeat(np.arange(len(values)), counts)
+    pair_pos = np.arange(int(counts.sum())) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    row_arr = flat_rows[group_offsets[groups][pair_reading] + pair_pos]
+
+    value_arr = np.array(values, dtype=np.float64)[pair_reading]
+    min_arr = np.concatenate(mins)[row_arr]
+    max_arr = np.concatenate(maxs)[row_arr]
+    threshold_arr = np.concatenate(thresholds)[row_arr]
+
+    below = value_arr < min_arr
+    above = value_arr > max_arr
+
+    for i in np.flatnonzero(below | above).tolist():
+        reading = int(pair_reading[i])
+        item_idx, unit, channel, timestamp = refs[reading]
+        is_min = bool(below[i])
+        results[item_idx].append(
+            MeasurementViolation(
+                unit=unit,
+                channel=channel,
+                value=values[reading],
+                limit_type="min" if is_min else "max",
+                limit_value=float(min_arr[i] if is_min else max_arr[i]),
+                threshold=float(threshold_arr[i]),
+                timestamp=timestamp or "",
+            )
+        )
+
+    loguru.logger.debug(
+        f"Validated {len(values)} readings from {len(items)} messages: "
+        f"{int(below.sum() + above.sum())} violations"
+    )
+    return results
 
-                try:
-                    value = float(value)
-                except (ValueError, TypeError):
-                    continue
 
-                if value < config.min:
-                    violations.append(
-                        MeasurementViolation(
-                            unit=unit,
-                            channel=channel,
-                            value=value,
-                            limit_type="min",
-                            limit_value=config.min,
-                            threshold=config.threshold,
-                            timestamp=timestamp or "",
-                        )
-                    )
-                    loguru.logger.warning(
-                        f"Violation: {unit} {channel} value {value} < min {config.min}"
-                    )
-
-                elif value > config.max:
-                    violations.append(
-                        MeasurementViolation(
-                            unit=unit,
-                            channel=channel,
-                            value=value,
-                            limit_type="max",
-                            limit_value=config.max,
-                            threshold=config.threshold,
-                            timestamp=timestamp or "",
-                        )
-                    )
-                    loguru.logger.warning(
-                        f"Violation: {unit} {channel} value {value} > max {config.max}"
-                    )
-
-    return violations
+def validate_measurements(
+    payload: Dict[str, Any], configs: List[MeasurementConfig]
+) -> List[MeasurementViolation]:
+    """
+    Validate measurements in payload against configured limits.
+    Returns list of violations found.
+    """
+    return validate_batch([(payload, CompiledRules(configs))])[0]
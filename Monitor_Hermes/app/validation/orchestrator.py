@@ -3,49 +3,94 @@ Main validation orchestrator.
 Coordinates measurement validation and alert sending.
 """
 
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List
 import loguru
 
 from app.validation.measurement_cache import get_or_fetch_measurement_configs
-from app.validation.measurement_validator import validate_measurements
-from app.validation.alert_service import send_alert_with_fallback
+from app.validation.measurement_validator import (
+    MeasurementViolation,
+    get_compiled_rules,
+    validate_batch,
+)
+from app.validation.alert_service import ALERT_TYPE, send_alert_with_fallback
 from app.validation.rate_limiter import should_send_alert
 from app.persistence.device_mapping import get_user_ids_for_alert
 
 
 async def validate_and_alert_if_needed(message: Dict[str, Any], db) -> None:
     """
-    Main validation orchestrator.
-    Called by redis_worker after saving message.
+    Main validation orchestrator for a single message.
     """
-    dev_eui = message.get("dev_eui")
-    tenant_id = message.get("tenant_id")
-    device_name = message.get("device_name", dev_eui)
-    payload = message.get("payload", {})
+    await validate_and_alert_batch([message], db)
 
-    if not dev_eui or not tenant_id:
-        return
 
-    try:
-        configs = await get_or_fetch_measurement_configs(dev_eui, db)
+async def validate_and_alert_batch(messages: List[Dict[str, Any]], db) -> None:
+    """
+    Validate a batch of messages and send alerts for the violations found.
+    Called by redis_worker after buffering a batch of messages.
 
-        if not configs:
+    Configs are fetched once per distinct device, and all readings of the
+    batch are checked together (see validate_batch).
+    """
+    dev_euis = {
+        m.get("dev_eui") for m in messages if m.get("dev_eui") and m.get("tenant_id")
+    }
+    if not dev_euis:
+        return
+
+    dev_euis = list(dev_euis)
+    fetched = await asyncio.gather(
+        *(get_or_fetch_measurement_configs(dev_eui, db) for dev_eui in dev_euis),
+        return_exceptions=True,
+    )
+
+    rules = {}
+    for dev_eui, configs in zip(dev_euis, fetched):
+        if isinstance(configs, Exception):
+            loguru.logger.error(
+                f"Error fetching measurement configs for {dev_eui}: {configs}"
+            )
+        elif not configs:
             loguru.logger.debug(
                 f"No measurement configs for {dev_eui}. Skipping validation."
             )
-            return
+        else:
+            rules[dev_eui] = get_compiled_rules(dev_eui, configs)
 
-        violations = validate_measurements(payload, configs)
+    if not rules:
+        return
+
+    to_check = [
+        m for m in messages if m.get("dev_eui") in rules and m.get("tenant_id")
+    ]
+    try:
+        results = validate_batch(
+            [(m.get("payload", {}), rules[m["dev_eui"]]) for m in to_check]
+        )
+    except Exception as e:
+        loguru.logger.exception(f"Error validating batch of {len(to_check)}: {e}")
+        return
+
+    for message, violations in zip(to_check, results):
+        if violations:
+            await _alert_violations(message, violations, db)
 
-        if not violations:
-            return
 
+async def _alert_violations(
+    message: Dict[str, Any], violations: List[MeasurementViolation], db
+) -> None:
+    dev_eui = message.get("dev_eui")
+    tenant_id = message.get("tenant_id")
+    device_name = message.get("device_name", dev_eui)
+
+    try:
         loguru.logger.info(f"Found {len(violations)} violations for {dev_eui}")
 
         violated_units = set(v.unit for v in violations)
 
         for unit in violated_units:
-            can_send = await should_send_alert(dev_eui, unit)
+            can_send = await should_send_alert(dev_eui, unit, ALERT_TYPE)
 
             if not can_send:
                 loguru.logger.info(
@@ -3,28 +3,80 @@ Rate limiting for alerts using Redis.
 Prevents alert spam from repeated violations.
 """
 
+import time
+from typing import Optional
+
 import loguru
 from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.utils.lru_cache import LRUCache
+
+# Cooldowns known to be active, so repeated violations from a device stuck
+# out of range are rejected without a Redis round trip
+_active_cooldowns = LRUCache(
+    maxsize=settings.ALERT_COOLDOWN_CACHE_SIZE,
+    ttl=settings.ALERT_COOLDOWN_SECONDS,
+)
+
+
+def get_cooldown_seconds(unit: str, severity: Optional[str] = None) -> int:
+    """
+    Cooldown for a unit/severity from ALERT_COOLDOWN_OVERRIDES, looked up as
+    "<unit>:<severity>", then "<unit>", then "*:<severity>", falling back to
+    ALERT_COOLDOWN_SECONDS.
+    """
+    overrides = settings.ALERT_COOLDOWN_OVERRIDES
+    keys = [unit]
+    if severity:
+        keys = [f"{unit}:{severity}", unit, f"*:{severity}"]
+    for key in keys:
+        if key in overrides:
+            return overrides[key]
+    return settings.ALERT_COOLDOWN_SECONDS
 
 
-async def should_send_alert(dev_eui: str, unit: str) -> bool:
+async def should_send_alert(
+    dev_eui: str, unit: str, severity: Optional[str] = None
+) -> bool:
     """
     Check if alert should be sent based on cooldown period.
     Returns True if alert can be sent, False if in cooldown.
-    Uses Redis key with 5 minute TTL.
+
+    The cooldown is claimed atomically with SET NX EX, so only one worker
+    sends the alert. The key stores its expiry time, which lets workers that
+    lose the race remember the cooldown locally until it ends.
     """
     key = f"alert_cooldown:{dev_eui}:{unit}"
 
+    if _active_cooldowns.get(key):
+        loguru.logger.debug(f"Alert cooldown active for {dev_eui}:{unit} (cached)")
+        return False
+
+    cooldown = get_cooldown_seconds(unit, severity)
+    if cooldown <= 0:
+        return True
+
     try:
         redis_client = get_redis_client()
-        exists = await redis_client.exists(key)
+        expires_at = time.time() + cooldown
+        previous = await redis_client.set(
+            key, str(expires_at), ex=cooldown, nx=True, get=True
+        )
 
-        if exists:
-            loguru.logger.debug(f"Alert cooldown active for {dev_eui}:{unit}")
-            return False
+        if previous is None:
+            _active_cooldowns.set(key, True, ttl=cooldown)
+            return True
 
-        await redis_client.setex(key, 60, "1")
-        return True
+        try:
+            remaining = float(previous) - time.time()
+        except ValueError:
+            # Key written by an older version without its expiry
+            remaining = 0
+        if remaining > 0:
+            _active_cooldowns.set(key, True, ttl=min(remaining, cooldown))
+
+        loguru.logger.debug(f"Alert cooldown active for {dev_eui}:{unit}")
+        return False
 
     except Exception as e:
         loguru.logger.exception(f"Redis error checking cooldown: {e}")
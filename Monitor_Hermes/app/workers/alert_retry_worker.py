@@ -1,77 +1,191 @@
 """
 Alert retry worker.
 Retries failed alerts to Atlas API in background.
+
+Due alerts are claimed atomically (see claim_due_pending_alerts), so several
+Hermes replicas can share the queue. Failed attempts are rescheduled with
+exponential backoff and jitter. When many alerts are due at once they are
+sent through Atlas' batch alert endpoint, otherwise one by one with bounded
+concurrency.
 """
 
 import asyncio
-from datetime import datetime, timezone
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
 import loguru
 
 from app.clients.atlas import atlas_client
 from app.persistence.mongo import (
+    claim_due_pending_alerts,
     get_db,
-    get_pending_alerts,
-    update_pending_alert_status,
+    mark_pending_alerts_sent,
+    reschedule_pending_alerts,
 )
+from app.settings import settings
 import httpx
 
+ALERT_ENDPOINT = "/api/v1/notifications/notifications/alert/"
+BATCH_ALERT_ENDPOINT = "/api/v1/notifications/notifications/alert/batch/"
+
+# When Atlas has no batch endpoint (404/405), don't try it again before this
+_batch_unsupported_until = 0.0
+
+
+def backoff_delay(retry_count: int) -> float:
+    """
+    Seconds to wait before attempt number `retry_count + 1`: exponential from
+    ALERT_RETRY_BASE_DELAY up to ALERT_RETRY_MAX_DELAY, with equal jitter so
+    replicas retrying after an outage don't hit Atlas in lockstep.
+    """
+    delay = min(
+        settings.ALERT_RETRY_MAX_DELAY,
+        settings.ALERT_RETRY_BASE_DELAY * (2 ** max(0, retry_count - 1)),
+    )
+    return random.uniform(delay / 2, delay)
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Client errors other than timeouts/throttling won't succeed on retry."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+    return False
+
+
+def _failure(alert_doc: dict, error: str, permanent: bool = False) -> Dict[str, Any]:
+    retry_count = alert_doc.get("retry_count", 0) + 1
+    failed = permanent or retry_count >= settings.ALERT_RETRY_MAX_ATTEMPTS
+    next_attempt_at = datetime.now(timezone.utc) + timedelta(
+        seconds=backoff_delay(retry_count)
+    )
+
+    if failed:
+        loguru.logger.error(
+            f"❌ Giving up on alert for {alert_doc.get('dev_eui')} "
+            f"after {retry_count} attempts: {error}"
+        )
+    else:
+        loguru.logger.warning(
+            f"⚠️ Retry {retry_count}/{settings.ALERT_RETRY_MAX_ATTEMPTS} failed "
+            f"for {alert_doc.get('dev_eui')}: {error}"
+        )
+
+    return {
+        "_id": alert_doc["_id"],
+        "status": "failed" if failed else "pending",
+        "retry_count": retry_count,
+        "next_attempt_at": next_attempt_at,
+        "error_message": error,
+    }
+
+
+async def _send_one(
+    alert_doc: dict, semaphore: asyncio.Semaphore
+) -> Optional[Dict[str, Any]]:
+    """Send a single alert. Returns a failure update, or None if it was sent."""
+    async with semaphore:
+        try:
+            await atlas_client.post(
+                ALERT_ENDPOINT,
+                json=alert_doc.get("alert_data", {}),
+                timeout=10.0,
+            )
+            return None
+        except (httpx.HTTPError, httpx.TimeoutException) as e:
+            return _failure(alert_doc, str(e), permanent=_is_permanent(e))
+        except Exception as e:
+            loguru.logger.exception(
+                f"Unexpected error retrying alert {alert_doc['_id']}: {e}"
+            )
+            return _failure(alert_doc, str(e))
+
+
+async def _send_batch(alert_docs: List[dict]) -> Optional[List[Optional[dict]]]:
+    """
+    Send alerts through the batch endpoint. Returns one failure update (or
+    None if sent) per alert, or None if Atlas doesn't support batches.
+    """
+    global _batch_unsupported_until
+    try:
+        response = await atlas_client.post(
+            BATCH_ALERT_ENDPOINT,
+            json={"alerts": [doc.get("alert_data", {}) for doc in alert_docs]},
+            timeout=30.0,
+        )
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (404, 405):
+            loguru.logger.warning(
+                "Atlas batch alert endpoint unavailable, sending alerts one by one"
+            )
+            _batch_unsupported_until = time.monotonic() + 3600
+            return None
+        return [_failure(doc, str(e)) for doc in alert_docs]
+    except (httpx.HTTPError, httpx.TimeoutException) as e:
+        return [_failure(doc, str(e)) for doc in alert_docs]
+
+    results = response.json().get("results") or []
+    outcomes = []
+    for i, doc in enumerate(alert_docs):
+        result = results[i] if i < len(results) else None
+        if not isinstance(result, dict):
+            # No outcome reported for this alert: retry it later
+            outcomes.append(_failure(doc, "Atlas returned no result for the alert"))
+        elif result.get("status") == "error":
+            error = result.get("error") or "Atlas rejected the alert"
+            outcomes.append(_failure(doc, error, permanent=True))
+        else:
+            outcomes.append(None)
+    return outcomes
+
+
+async def process_due_alerts(db, semaphore: asyncio.Semaphore) -> int:
+    """Claim, send and record one batch of due alerts. Returns the batch size."""
+    claimed = await claim_due_pending_alerts(
+        db, settings.ALERT_RETRY_BATCH_SIZE, settings.ALERT_RETRY_LEASE_SECONDS
+    )
+    if not claimed:
+        return 0
+
+    loguru.logger.info(f"🔄 Retrying {len(claimed)} pending alerts...")
+
+    outcomes = None
+    if (
+        len(claimed) >= settings.ALERT_RETRY_BATCH_THRESHOLD
+        and time.monotonic() >= _batch_unsupported_until
+    ):
+        outcomes = await _send_batch(claimed)
+    if outcomes is None:
+        outcomes = await asyncio.gather(
+            *(_send_one(doc, semaphore) for doc in claimed)
+        )
+
+    sent = [doc["_id"] for doc, failure in zip(claimed, outcomes) if failure is None]
+    failures = [failure for failure in outcomes if failure is not None]
+    await mark_pending_alerts_sent(db, sent)
+    await reschedule_pending_alerts(db, failures)
+
+    if sent:
+        loguru.logger.info(f"✅ {len(sent)} pending alerts sent to Atlas")
+    return len(claimed)
+
 
 async def retry_pending_alerts():
     """
-    Background worker that retries pending alerts every 5 minutes.
-    Max 3 retry attempts per alert.
+    Background worker that retries pending alerts. Polls every
+    ALERT_RETRY_POLL_INTERVAL seconds and keeps draining without waiting
+    while full batches are due.
     """
     loguru.logger.info("🔄 Alert retry worker started")
+    semaphore = asyncio.Semaphore(max(1, settings.ALERT_RETRY_CONCURRENCY))
 
     while True:
         try:
             db = await get_db()
-            pending = await get_pending_alerts(db, limit=100)
-
-            if pending:
-                loguru.logger.info(f"🔄 Retrying {len(pending)} pending alerts...")
-
-            for alert_doc in pending:
-                alert_id = alert_doc["_id"]
-                dev_eui = alert_doc.get("dev_eui")
-                alert_data = alert_doc.get("alert_data", {})
-                retry_count = alert_doc.get("retry_count", 0)
-
-                try:
-                    response = await atlas_client.post(
-                        "/api/v1/notifications/notifications/alert/",
-                        json=alert_data,
-                        timeout=10.0,
-                    )
-
-                    await update_pending_alert_status(
-                        db, alert_id, status="sent", retry_count=retry_count
-                    )
-
-                    loguru.logger.info(f"✅ Pending alert sent to Atlas: {dev_eui}")
-
-                except (httpx.HTTPError, httpx.TimeoutException) as e:
-                    new_retry_count = retry_count + 1
-                    new_status = "failed" if new_retry_count >= 3 else "pending"
-
-                    await update_pending_alert_status(
-                        db,
-                        alert_id,
-                        status=new_status,
-                        retry_count=new_retry_count,
-                        error_message=str(e),
-                    )
-
-                    loguru.logger.warning(
-                        f"⚠️ Retry {new_retry_count}/3 failed for {dev_eui}: {e}"
-                    )
-
-                except Exception as e:
-                    loguru.logger.exception(
-                        f"Unexpected error retrying alert {alert_id}: {e}"
-                    )
-
-            await asyncio.sleep(300)
+            claimed = await process_due_alerts(db, semaphore)
+            if claimed < settings.ALERT_RETRY_BATCH_SIZE:
+                await asyncio.sleep(settings.ALERT_RETRY_POLL_INTERVAL)
 
         except Exception as e:
             loguru.logger.exception(f"Error in retry worker: {e}")
@@ -1,22 +1,298 @@
 import asyncio
 import json
+import os
+import socket
 import loguru
 import importlib
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from redis.exceptions import ResponseError
 from app.persistence.models import MessageIn
-from app.persistence.mongo import save_message
-from app.validation.orchestrator import validate_and_alert_if_needed
-from app.persistence.timeseries import transform_and_insert_timeseries
+from app.persistence.write_buffer import WriteBufferFull, write_buffer
+from app.redis.redis import get_redis_client
+from app.settings import settings
+from app.validation.orchestrator import validate_and_alert_batch
+from app.persistence.timeseries import build_timeseries_docs
+from app.utils.metrics import WORKER_MESSAGES_PROCESSED, WORKER_STAGE_SECONDS
 
+# Pre-stream ingest queue (Redis list), drained into the stream on startup
+LEGACY_QUEUE_KEY = "messages"
+STREAM_KEY = settings.INGEST_STREAM_KEY
+GROUP = settings.INGEST_CONSUMER_GROUP
 
-async def save_mapping(dev_eui: str, tenant_id: str, redis_client):
+Entry = Tuple[str, Dict[str, str]]
+
+
+async def save_mappings(mappings: Dict[str, str], redis_client):
+    """Save the dev_eui -> tenant_id mappings of a whole batch in one HSET."""
+    if not mappings:
+        return
     try:
-        await redis_client.hset("device_tenant_mapping", dev_eui, tenant_id)
+        await redis_client.hset("device_tenant_mapping", mapping=mappings)
     except Exception:
         loguru.logger.exception("Failed to save device_tenant_mapping")
 
 
-async def process_messages(db):
-    """Process messages from Redis queue."""
+async def ensure_consumer_group(client):
+    """
+    Create the ingest stream and its consumer group if they don't exist,
+    and move any entries left in the legacy list queue into the stream.
+    """
+    try:
+        await client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+        loguru.logger.info(f"Created consumer group '{GROUP}' on '{STREAM_KEY}'")
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    moved = 0
+    while True:
+        legacy = await client.rpop(LEGACY_QUEUE_KEY, 500)
+        if not legacy:
+            break
+        async with client.pipeline(transaction=False) as pipe:
+            for raw in legacy:
+                pipe.xadd(
+                    STREAM_KEY,
+                    {"data": raw},
+                    maxlen=settings.INGEST_STREAM_MAXLEN,
+                    approximate=True,
+                )
+            await pipe.execute()
+        moved += len(legacy)
+    if moved:
+        loguru.logger.info(f"Moved {moved} messages from legacy queue into stream")
+
+
+def entry_object_id(entry_id: str, index: int = 0) -> ObjectId:
+    """
+    ObjectId derived from a stream entry id ("<ms>-<seq>") and the index of
+    a document built from it (0 for the message, 1.. for its points), so a
+    redelivered entry is stored under the same _ids.
+    """
+    ms, _, seq = entry_id.partition("-")
+    ms, seq = int(ms), int(seq or 0)
+    return ObjectId(
+        (ms // 1000).to_bytes(4, "big")
+        + (ms % 1000).to_bytes(2, "big")
+        + seq.to_bytes(3, "big")
+        + index.to_bytes(3, "big")
+    )
+
+
+async def ack_entries(entry_ids: List[str]):
+    """Acknowledge processed stream entries."""
+    if not entry_ids:
+        return
+    client = get_redis_client()
+    await client.xack(STREAM_KEY, GROUP, *entry_ids)
+
+
+def _stream_entries(response) -> List[Entry]:
+    entries = []
+    for _stream, stream_entries in response or []:
+        entries.extend(stream_entries)
+    return entries
+
+
+async def read_batch(
+    client, consumer: str, batch_size: int, max_linger: float
+) -> List[Entry]:
+    """
+    Read up to batch_size new entries for this consumer.
+
+    Blocks on XREADGROUP until entries arrive (or WORKER_BLOCK_TIMEOUT expires,
+    returning an empty list). If the batch is not full, waits at most
+    max_linger seconds for more entries to arrive.
+    """
+    response = await client.xreadgroup(
+        GROUP,
+        consumer,
+        {STREAM_KEY: ">"},
+        count=batch_size,
+        block=settings.WORKER_BLOCK_TIMEOUT * 1000,
+    )
+    batch = _stream_entries(response)
+
+    if batch and len(batch) < batch_size and max_linger > 0:
+        response = await client.xreadgroup(
+            GROUP,
+            consumer,
+            {STREAM_KEY: ">"},
+            count=batch_size - len(batch),
+            block=max(1, int(max_linger * 1000)),
+        )
+        batch.extend(_stream_entries(response))
+
+    return batch
+
+
+async def process_payload(
+    payload: Dict[str, Any],
+    ack_id: Optional[str] = None,
+    redelivered: bool = False,
+):
+    """
+    Persist and notify device subscribers for a single message. Documents
+    of a stream entry get _ids derived from `ack_id`; `redelivered` entries
+    may have been stored before.
+    """
+    # Expected structure (snake_case):
+    # {
+    #   "tenant_id": str,
+    #   "tenant_name": str | None,
+    #   "dev_eui": str,
+    #   "dev_addr": str | None,
+    #   "device_name": str | None,
+    #   "frequency": int | None,
+    #   "f_cnt": int | None,
+    #   "region": str | None,
+    #   "payload": dict,
+    #   "metadata": dict | None
+    # }
+
+    msg_type = payload.get("type", "uplink")
+    dev_eui = payload.get("dev_eui")
+    tenant_id = payload.get("tenant_id")
+    tenant_name = payload.get("tenant_name")
+    dev_addr = payload.get("dev_addr")
+    device_name = payload.get("device_name")
+    frequency = payload.get("frequency")
+    f_cnt = payload.get("f_cnt")
+    region = payload.get("region")
+    object_payload = payload.get("payload", {})
+    metadata = payload.get("metadata")
+
+    loguru.logger.debug(f"Processing message from Redis: {dev_eui}")
+
+    message = MessageIn(
+        type=msg_type,
+        tenant_id=tenant_id,
+        tenant_name=tenant_name,
+        dev_eui=dev_eui,
+        dev_addr=dev_addr,
+        device_name=device_name,
+        frequency=frequency,
+        f_cnt=f_cnt,
+        region=region,
+        payload=object_payload,
+        metadata=metadata,
+    )
+
+    loguru.logger.debug(
+        f"Message created for device {message.dev_eui} in tenant {message.tenant_id}"
+    )
+
+    points = []
+    try:
+        with WORKER_STAGE_SECONDS.labels("timeseries").time():
+            points = build_timeseries_docs(payload)
+    except Exception as e:
+        loguru.logger.error(f"Failed to ingest timeseries for {dev_eui}: {e}")
+    if ack_id:
+        for index, point in enumerate(points, 1):
+            point["_id"] = entry_object_id(ack_id, index)
+
+    # The stream entry is acknowledged once the message and its points are stored
+    with WORKER_STAGE_SECONDS.labels("save_message").time():
+        await write_buffer.add_message(
+            message,
+            ack_id=ack_id,
+            points=points,
+            doc_id=entry_object_id(ack_id) if ack_id else None,
+            redelivered=redelivered,
+        )
+    loguru.logger.debug(
+        f"Message buffered for device {message.dev_eui} in tenant {message.tenant_id}"
+    )
+
+    try:
+        ws_mod = importlib.import_module("app.ws.manager")
+        ws_manager = getattr(ws_mod, "manager", None)
+        if ws_manager is not None and dev_eui:
+            ws_payload = {
+                "type": "uplink",
+                "tenant_id": tenant_id,
+                "tenant_name": tenant_name,
+                "dev_eui": dev_eui,
+                "dev_addr": dev_addr,
+                "device_name": device_name,
+                "frequency": frequency,
+                "f_cnt": f_cnt,
+                "region": region,
+                "payload": object_payload,
+            }
+            with WORKER_STAGE_SECONDS.labels("ws_notify").time():
+                await ws_manager.broadcast_to_device(ws_payload, dev_eui)
+            loguru.logger.debug(f"Notified device subscribers for {dev_eui}")
+    except Exception:
+        loguru.logger.exception("Failed to notify WS subscribers for device")
+
+
+async def process_batch(db, client, entries: List[Entry], redelivered: bool = False):
+    """
+    Process a batch of stream entries in arrival order, then validate the
+    whole batch at once. `redelivered` marks entries reclaimed from another
+    consumer, which may already be stored.
+
+    Entries are acknowledged once their message is persisted (see
+    WriteBuffer.ack_handler). Entries that can never be processed are
+    acknowledged right away; entries that fail unexpectedly stay pending
+    and are retried by reclaim_pending.
+    """
+    payloads = []
+    mappings = {}
+    discarded = []
+    for entry_id, fields in entries:
+        try:
+            payload = json.loads((fields or {}).get("data"))
+        except (TypeError, ValueError) as e:
+            loguru.logger.error(f"Failed to decode message {entry_id} from Redis: {e}")
+            discarded.append(entry_id)
+            continue
+
+        dev_eui = payload.get("dev_eui")
+        tenant_id = payload.get("tenant_id")
+        if not dev_eui or not tenant_id:
+            loguru.logger.warning(
+                f"Skipping message without dev_eui or tenant_id: {payload}"
+            )
+            discarded.append(entry_id)
+            continue
+
+        mappings[dev_eui] = tenant_id
+        payloads.append((entry_id, payload))
+
+    await save_mappings(mappings, client)
+
+    if discarded:
+        await ack_entries(discarded)
+
+    for entry_id, payload in payloads:
+        try:
+            await process_payload(payload, ack_id=entry_id, redelivered=redelivered)
+        except WriteBufferFull:
+            # Stop reading until MongoDB catches up; the rest stays pending
+            raise
+        except Exception as e:
+            loguru.logger.error(
+                f"Failed to process message for {payload.get('dev_eui')}: {e}"
+            )
+
+    WORKER_MESSAGES_PROCESSED.inc(len(payloads))
+
+    try:
+        with WORKER_STAGE_SECONDS.labels("validation").time():
+            await validate_and_alert_batch([p for _, p in payloads], db)
+    except Exception:
+        loguru.logger.exception("Validation failed for batch but continuing")
+
+
+async def consume(db, consumer: str):
+    """Consumer task: read new entries for `consumer` and process them."""
+    batch_size = max(1, settings.WORKER_BATCH_SIZE)
+    max_linger = max(0, settings.WORKER_MAX_LINGER_MS) / 1000
+
     while True:
         try:
             redis_mod = importlib.import_module("app.redis.redis")
@@ -26,104 +302,114 @@ async def process_messages(db):
                 await asyncio.sleep(1)
                 continue
 
-            _, raw = await client.brpop("messages")
-            payload = json.loads(raw)
-
-            # Expected structure (snake_case):
-            # {
-            #   "tenant_id": str,
-            #   "tenant_name": str | None,
-            #   "dev_eui": str,
-            #   "dev_addr": str | None,
-            #   "device_name": str | None,
-            #   "frequency": int | None,
-            #   "f_cnt": int | None,
-            #   "region": str | None,
-            #   "payload": dict,
-            #   "metadata": dict | None
-            # }
-
-            msg_type = payload.get("type", "uplink")
-            dev_eui = payload.get("dev_eui")
-            tenant_id = payload.get("tenant_id")
-            tenant_name = payload.get("tenant_name")
-            dev_addr = payload.get("dev_addr")
-            device_name = payload.get("device_name")
-            frequency = payload.get("frequency")
-            f_cnt = payload.get("f_cnt")
-            region = payload.get("region")
-            object_payload = payload.get("payload", {})
-            metadata = payload.get("metadata")
-
-            if not dev_eui or not tenant_id:
-                loguru.logger.warning(
-                    f"Skipping message without dev_eui or tenant_id: {payload}"
-                )
-                await asyncio.sleep(1)
+            entries = await read_batch(client, consumer, batch_size, max_linger)
+            if not entries:
                 continue
 
-            if dev_eui and tenant_id:
-                await save_mapping(dev_eui, tenant_id, client)
-
-            loguru.logger.debug(f"Processing message from Redis: {dev_eui}")
-
-            message = MessageIn(
-                type=msg_type,
-                tenant_id=tenant_id,
-                tenant_name=tenant_name,
-                dev_eui=dev_eui,
-                dev_addr=dev_addr,
-                device_name=device_name,
-                frequency=frequency,
-                f_cnt=f_cnt,
-                region=region,
-                payload=object_payload,
-                metadata=metadata,
-            )
+            loguru.logger.debug(f"[{consumer}] Read {len(entries)} messages from Redis")
+            await process_batch(db, client, entries)
 
-            loguru.logger.debug(
-                f"Message created for device {message.dev_eui} in tenant {message.tenant_id}"
-            )
+        except Exception as e:
+            loguru.logger.error(f"[{consumer}] Failed to process messages: {e}")
+            await asyncio.sleep(1)
 
-            await save_message(db, message)
-            loguru.logger.debug(
-                f"Message saved to database for device {message.dev_eui} in tenant {message.tenant_id}"
-            )
 
-            try:
-                await transform_and_insert_timeseries(db, payload)
-            except Exception as e:
-                loguru.logger.error(f"Failed to ingest timeseries for {dev_eui}: {e}")
+async def reclaim_pending(db, consumer: str):
+    """
+    Periodically take over entries that another consumer read but never
+    acknowledged (e.g. the process crashed) for longer than
+    INGEST_RECLAIM_IDLE_MS, and process them again. Entries delivered
+    INGEST_MAX_DELIVERIES times are acknowledged and dropped.
+
+    Entries still waiting in this process's write buffer are left alone;
+    those stored by another replica keep the same _ids (see entry_object_id)
+    and are not stored or rolled up twice.
+    """
+    batch_size = max(1, settings.WORKER_BATCH_SIZE)
 
-            try:
-                await validate_and_alert_if_needed(payload, db)
-            except Exception:
-                loguru.logger.exception(
-                    f"Validation failed for {dev_eui} but continuing"
+    while True:
+        await asyncio.sleep(settings.INGEST_RECLAIM_INTERVAL)
+        try:
+            client = get_redis_client()
+
+            pending = await client.xpending_range(
+                STREAM_KEY,
+                GROUP,
+                min="-",
+                max="+",
+                count=batch_size,
+                idle=settings.INGEST_RECLAIM_IDLE_MS,
+            )
+            dead = [
+                p["message_id"]
+                for p in pending
+                if p["times_delivered"] >= settings.INGEST_MAX_DELIVERIES
+                and not write_buffer.pending_ack(p["message_id"])
+            ]
+            if dead:
+                loguru.logger.error(
+                    f"Dropping {len(dead)} messages after "
+                    f"{settings.INGEST_MAX_DELIVERIES} delivery attempts: {dead}"
                 )
+                await ack_entries(dead)
 
-            try:
-                ws_mod = importlib.import_module("app.ws.manager")
-                ws_manager = getattr(ws_mod, "manager", None)
-                if ws_manager is not None and dev_eui:
-                    ws_payload = {
-                        "type": "uplink",
-                        "tenant_id": tenant_id,
-                        "tenant_name": tenant_name,
-                        "dev_eui": dev_eui,
-                        "dev_addr": dev_addr,
-                        "device_name": device_name,
-                        "frequency": frequency,
-                        "f_cnt": f_cnt,
-                        "region": region,
-                        "payload": object_payload,
-                    }
-                    await ws_manager.broadcast_to_device(ws_payload, dev_eui)
-                    loguru.logger.debug(f"Notified device subscribers for {dev_eui}")
-            except Exception:
-                loguru.logger.exception("Failed to notify WS subscribers for device")
+            start_id = "0-0"
+            while True:
+                next_id, claimed, *_ = await client.xautoclaim(
+                    STREAM_KEY,
+                    GROUP,
+                    consumer,
+                    min_idle_time=settings.INGEST_RECLAIM_IDLE_MS,
+                    start_id=start_id,
+                    count=batch_size,
+                )
+                # Entries trimmed from the stream come back without fields
+                claimed = [
+                    (entry_id, f)
+                    for entry_id, f in claimed
+                    if f and not write_buffer.pending_ack(entry_id)
+                ]
+                if claimed:
+                    loguru.logger.warning(
+                        f"[{consumer}] Reclaimed {len(claimed)} stale messages"
+                    )
+                    await process_batch(db, client, claimed, redelivered=True)
+                    await write_buffer.flush()
+                if next_id in ("0-0", b"0-0"):
+                    break
+                start_id = next_id
 
+        except RuntimeError:
+            loguru.logger.error("Redis client not initialized, skipping reclaim")
         except Exception as e:
-            loguru.logger.error(f"Failed to process message: {e}")
+            loguru.logger.error(f"Failed to reclaim pending messages: {e}")
+
+
+async def process_messages(db):
+    """
+    Process messages from the Redis ingest stream.
+
+    Runs INGEST_CONSUMERS consumer tasks in the INGEST_CONSUMER_GROUP group
+    plus a reclaim task. Consumer names are unique per process, so several
+    Hermes replicas can share the stream. Each read returns up to
+    WORKER_BATCH_SIZE entries; a consumer only idles while the stream has
+    no new entries (blocked in XREADGROUP).
+    """
+    while True:
+        try:
+            await ensure_consumer_group(get_redis_client())
+            break
+        except Exception as e:
+            loguru.logger.error(f"Failed to set up ingest stream, retrying in 1s: {e}")
+            await asyncio.sleep(1)
+
+    write_buffer.ack_handler = ack_entries
+
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    consumers = [f"{prefix}-{i}" for i in range(max(1, settings.INGEST_CONSUMERS))]
+    loguru.logger.info(f"Starting {len(consumers)} ingest consumers in group '{GROUP}'")
 
-        await asyncio.sleep(1)
+    await asyncio.gather(
+        *(consume(db, name) for name in consumers),
+        reclaim_pending(db, consumers[0]),
+    )
@@ -0,0 +1,153 @@
+"""
+Redis pub/sub bus for cross-replica WebSocket delivery.
+
+Broadcasts are published to a per-tenant or per-device channel instead of
+being delivered locally, and every Hermes replica subscribes only to the
+channels it has local listeners for. Superuser and global connections
+see every tenant, so while one is connected the replica also subscribes
+to the tenant channel pattern.
+"""
+
+import asyncio
+from typing import TYPE_CHECKING, Optional, Set
+
+import loguru
+
+from app.redis.redis import get_redis_client
+from app.settings import settings
+
+if TYPE_CHECKING:
+    from app.ws.manager import ConnectionManager
+
+TENANT_PREFIX = f"{settings.WS_BUS_CHANNEL_PREFIX}:tenant:"
+DEVICE_PREFIX = f"{settings.WS_BUS_CHANNEL_PREFIX}:device:"
+ALL_TENANTS_PATTERN = f"{TENANT_PREFIX}*"
+
+# How long the listener waits for a message before applying pending
+# subscription changes (seconds)
+POLL_INTERVAL = 0.2
+
+
+class BroadcastBus:
+    """
+    Publishes pre-encoded WebSocket frames to Redis and delivers the frames
+    received on subscribed channels to the local ConnectionManager.
+    """
+
+    def __init__(self, manager: "ConnectionManager"):
+        self.manager = manager
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the subscriber task (no-op if WS_BUS_ENABLED is off)."""
+        if not settings.WS_BUS_ENABLED:
+            loguru.logger.info("WebSocket bus disabled, delivering locally only")
+            return
+        if not self.active:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        loguru.logger.debug("WebSocket bus started")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish_tenant(self, tenant_id: str, frame: str) -> bool:
+        return await self._publish(f"{TENANT_PREFIX}{tenant_id}", frame)
+
+    async def publish_device(self, dev_eui: str, frame: str) -> bool:
+        return await self._publish(f"{DEVICE_PREFIX}{dev_eui}", frame)
+
+    async def _publish(self, channel: str, frame: str) -> bool:
+        """Publish a frame. Returns False if it could not be published."""
+        try:
+            await get_redis_client().publish(channel, frame)
+            return True
+        except Exception as e:
+            loguru.logger.error(f"Failed to publish to {channel}: {e}")
+            return False
+
+    def refresh(self):
+        """Signal that local listeners changed and subscriptions need syncing."""
+        self._changed.set()
+
+    def _wanted(self):
+        channels = {f"{TENANT_PREFIX}{t}" for t in self.manager.tenants}
+        channels.update(f"{DEVICE_PREFIX}{d}" for d in self.manager.device_subs)
+        patterns = set()
+        if self.manager.super_connections or self.manager.global_connections:
+            patterns.add(ALL_TENANTS_PATTERN)
+        return channels, patterns
+
+    async def _sync(self, pubsub, channels: Set[str], patterns: Set[str]):
+        wanted_channels, wanted_patterns = self._wanted()
+
+        if wanted_channels - channels:
+            await pubsub.subscribe(*(wanted_channels - channels))
+        if channels - wanted_channels:
+            await pubsub.unsubscribe(*(channels - wanted_channels))
+        if wanted_patterns - patterns:
+            await pubsub.psubscribe(*(wanted_patterns - patterns))
+        if patterns - wanted_patterns:
+            await pubsub.punsubscribe(*(patterns - wanted_patterns))
+
+        channels.clear()
+        channels.update(wanted_channels)
+        patterns.clear()
+        patterns.update(wanted_patterns)
+
+    def _dispatch(self, msg: dict):
+        channel = msg.get("channel") or ""
+        frame = msg.get("data")
+        if msg.get("type") == "pmessage":
+            # Pattern subscription only exists for superuser/global listeners
+            self.manager.deliver_all_tenants(frame)
+        elif channel.startswith(TENANT_PREFIX):
+            self.manager.deliver_tenant(channel[len(TENANT_PREFIX):], frame)
+        elif channel.startswith(DEVICE_PREFIX):
+            self.manager.deliver_device(channel[len(DEVICE_PREFIX):], frame)
+
+    async def _run(self):
+        while True:
+            pubsub = None
+            channels: Set[str] = set()
+            patterns: Set[str] = set()
+            try:
+                pubsub = get_redis_client().pubsub()
+                self._changed.set()
+
+                while True:
+                    if self._changed.is_set():
+                        self._changed.clear()
+                        await self._sync(pubsub, channels, patterns)
+
+                    if not (channels or patterns):
+                        await self._changed.wait()
+                        continue
+
+                    msg = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=POLL_INTERVAL
+                    )
+                    if msg is not None:
+                        self._dispatch(msg)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                loguru.logger.error(f"WebSocket bus listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
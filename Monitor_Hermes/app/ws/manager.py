@@ -2,18 +2,94 @@ import loguru
 import asyncio
 from typing import List, Dict, Set
 from fastapi import WebSocket
+from app.settings import settings
+from app.utils.metrics import (
+    WS_DROPPED_MESSAGES,
+    WS_SEND_FAILURES,
+    WS_SLOW_CONSUMER_DISCONNECTS,
+)
+from app.utils.serialization import dumps
+from app.ws.bus import BroadcastBus
 from app.ws.filters import get_devEui_mapping
 from loguru import logger
 
 
+class Outbox:
+    """
+    Bounded outbound queue with its own writer task for one WebSocket.
+    Holds pre-encoded JSON text frames.
+
+    Broadcasts only enqueue, so a slow client never delays delivery to the
+    others. When the queue is full the slow consumer is either downsampled
+    (oldest queued message dropped, policy "drop_oldest") or disconnected
+    (policy "disconnect"), according to WS_SLOW_CONSUMER_POLICY.
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(
+            maxsize=max(1, settings.WS_SEND_QUEUE_SIZE)
+        )
+        self.dropped = 0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def put(self, message: str) -> bool:
+        """Enqueue a message. Returns False if the connection must be dropped."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if settings.WS_SLOW_CONSUMER_POLICY == "disconnect":
+            loguru.logger.warning("Disconnecting slow WebSocket consumer")
+            WS_SLOW_CONSUMER_DISCONNECTS.inc()
+            return False
+
+        self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        self.dropped += 1
+        WS_DROPPED_MESSAGES.inc()
+        if self.dropped % 100 == 1:
+            loguru.logger.warning(
+                f"Slow WebSocket consumer, {self.dropped} messages dropped so far"
+            )
+        return True
+
+    def close(self):
+        self.task.cancel()
+
+    async def _run(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.websocket.send_text(message)
+            except Exception:
+                WS_SEND_FAILURES.inc()
+                loguru.logger.debug("WebSocket send failed, dropping connection")
+                self.manager.drop(self.websocket)
+                return
+
+
 class ConnectionManager:
     def __init__(self):
         self.tenants: Dict[str, List[WebSocket]] = {}
         self.global_connections: List[WebSocket] = []
         self.super_connections: List[WebSocket] = []
         self.device_subs: Dict[str, Set[WebSocket]] = {}
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+        self.bus = BroadcastBus(self)
+
+    def _outbox(self, websocket: WebSocket) -> Outbox:
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            outbox = Outbox(websocket, self)
+            self.outboxes[websocket] = outbox
+        return outbox
 
     async def connect(self, websocket: WebSocket, info: dict):
+        self._outbox(websocket)
         if info.get("is_global"):
             loguru.logger.debug(
                 f"Global connection established as global: \n User: {str(info.get('username'))} \n Tenant: {str(info.get('tenant_id'))}"
@@ -37,23 +113,33 @@ class ConnectionManager:
             if tenant_id not in self.tenants:
                 self.tenants[tenant_id] = []
             self.tenants[tenant_id].append(websocket)
+        self.bus.refresh()
 
     def disconnect(self, websocket: WebSocket, info: dict):
         if info.get("is_global"):
             loguru.logger.debug("Global connection closed")
-            self.global_connections.remove(websocket)
         elif info.get("is_superuser"):
             loguru.logger.debug("Superuser connection closed")
-            self.super_connections.remove(websocket)
         elif info.get("device_only"):
             tenant_id = str(info.get("tenant_id"))
             loguru.logger.debug(f"Device-only connection closed for tenant {tenant_id}")
         else:
             tenant_id = str(info.get("tenant_id"))
             loguru.logger.debug(f"Tenant {tenant_id} connection closed")
-            if tenant_id in self.tenants:
-                self.tenants[tenant_id].remove(websocket)
-                if not self.tenants[tenant_id]:
+
+        self.drop(websocket)
+
+    def drop(self, websocket: WebSocket):
+        """Remove a connection from every registry and stop its writer."""
+        if websocket in self.global_connections:
+            self.global_connections.remove(websocket)
+        if websocket in self.super_connections:
+            self.super_connections.remove(websocket)
+
+        for tenant_id, conns in list(self.tenants.items()):
+            if websocket in conns:
+                conns.remove(websocket)
+                if not conns:
                     del self.tenants[tenant_id]
 
         try:
@@ -65,33 +151,68 @@ class ConnectionManager:
         except Exception:
             loguru.logger.exception("Error cleaning device subscriptions on disconnect")
 
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            outbox.close()
+        self.bus.refresh()
+
+    def _enqueue(self, websocket: WebSocket, message: str):
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            return
+        if not outbox.put(message):
+            self.drop(websocket)
+            asyncio.get_running_loop().create_task(self._close_slow(websocket))
+
+    async def _close_slow(self, websocket: WebSocket):
+        try:
+            # 1013: try again later
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
     async def broadcast(self, message: dict, tenant_id: str):
+        """
+        Send a message to a tenant's connections and to every superuser and
+        global connection, on all replicas when the bus is active.
+        """
         tenant_key = str(tenant_id)
-        for connection in list(self.tenants.get(tenant_key, [])):
-            try:
-                await connection.send_json(message)
-            except Exception:
-                self.tenants[tenant_key].remove(connection)
+        if not self.bus.active and not (
+            self.tenants.get(tenant_key)
+            or self.super_connections
+            or self.global_connections
+        ):
+            return
+
+        # Encode once and share the frame across the bus and every recipient list
+        frame = dumps(message)
+        if self.bus.active and await self.bus.publish_tenant(tenant_key, frame):
+            return
+        self.deliver_tenant(tenant_key, frame)
+        self.deliver_all_tenants(frame)
+
+    def deliver_tenant(self, tenant_id: str, frame: str):
+        """Queue an encoded frame for this replica's connections of a tenant."""
+        for connection in list(self.tenants.get(tenant_id, [])):
+            self._enqueue(connection, frame)
 
+    def deliver_all_tenants(self, frame: str):
+        """Queue an encoded frame for this replica's superuser/global connections."""
         for connection in list(self.super_connections + self.global_connections):
-            try:
-                await connection.send_json(message)
-            except Exception:
-                if connection in self.super_connections:
-                    self.super_connections.remove(connection)
-                elif connection in self.global_connections:
-                    self.global_connections.remove(connection)
+            self._enqueue(connection, frame)
 
     async def subscribe_device(self, websocket: WebSocket, dev_eui: str):
         if not dev_eui:
             return
+        self._outbox(websocket)
         key = str(dev_eui)
         if key not in self.device_subs:
             self.device_subs[key] = set()
         self.device_subs[key].add(websocket)
+        self.bus.refresh()
         loguru.logger.debug(f"WebSocket subscribed to device {key}")
 
     def unsubscribe_device(self, websocket: WebSocket, dev_eui: str):
@@ -102,24 +223,25 @@ class ConnectionManager:
             self.device_subs[key].discard(websocket)
             if not self.device_subs[key]:
                 del self.device_subs[key]
+                self.bus.refresh()
             loguru.logger.debug(f"WebSocket unsubscribed from device {key}")
 
     async def broadcast_to_device(self, message: dict, dev_eui: str):
         if not dev_eui:
             return
         key = str(dev_eui)
-        conns = list(self.device_subs.get(key, set()))
-        for conn in conns:
-            try:
-                await conn.send_json(message)
-            except Exception:
-                if key in self.device_subs and conn in self.device_subs[key]:
-                    self.device_subs[key].discard(conn)
-                loguru.logger.exception(
-                    f"Failed to send message to subscriber of {key}"
-                )
-        if key in self.device_subs and not self.device_subs[key]:
-            del self.device_subs[key]
+        if not self.bus.active and not self.device_subs.get(key):
+            return
+
+        frame = dumps(message)
+        if self.bus.active and await self.bus.publish_device(key, frame):
+            return
+        self.deliver_device(key, frame)
+
+    def deliver_device(self, dev_eui: str, frame: str):
+        """Queue an encoded frame for this replica's subscribers of a device."""
+        for conn in list(self.device_subs.get(dev_eui, set())):
+            self._enqueue(conn, frame)
 
     def route_device_message(self, msg):
         dev_eui = msg.get("devEui") or msg.get("dev_eui")
@@ -0,0 +1,22 @@
+import os
+
+# Settings that have no default; unit tests never connect to these services
+for name, value in {
+    "JWT_SECRET_KEY": "test",
+    "BROKER_URL": "localhost",
+    "MONGO_HOST": "localhost",
+    "MONGO_PORT": "27017",
+    "MONGO_INITDB_ROOT_USERNAME": "test",
+    "MONGO_INITDB_ROOT_PASSWORD": "test",
+    "MONGO_URI": "mongodb://localhost:27017/test",
+    "MONGO_DB": "test",
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    "REDIS_PASSWORD": "test",
+    "WS_SECRET": "test",
+    "SERVICE_API_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+# Manual scripts that connect to a running Hermes
+collect_ignore = ["test_ws.py", "test_wss_connection.py"]
@@ -0,0 +1,93 @@
+from app.persistence.models import MeasurementConfig
+from app.validation.measurement_validator import (
+    CompiledRules,
+    validate_batch,
+    validate_measurements,
+)
+
+
+def config(unit, min, max, threshold=0.0, id="1"):
+    return MeasurementConfig(id=id, unit=unit, min=min, max=max, threshold=threshold)
+
+
+def payload(unit, value, channel="ch1"):
+    return {"measurements": {unit: {channel: [{"value": value, "time": "t"}]}}}
+
+
+def test_every_config_of_a_unit_is_checked():
+    configs = [config("voltage", 0, 10, id="1"), config("voltage", 0, 100, id="2")]
+
+    violations = validate_measurements(payload("voltage", 50), configs)
+
+    assert [(v.limit_type, v.limit_value) for v in violations] == [("max", 10.0)]
+
+
+def test_compiled_rules_keep_one_row_per_config():
+    rules = CompiledRules(
+        [config("voltage", 0, 10), config("current", 1, 2), config("voltage", 5, 100)]
+    )
+
+    assert len(rules) == 3
+    assert rules.index == {"voltage": [0, 2], "current": [1]}
+    assert rules.mins.tolist() == [0.0, 1.0, 5.0]
+
+
+def test_batch_keeps_violations_per_message():
+    voltage = CompiledRules([config("voltage", 0, 10, threshold=2)])
+    current = CompiledRules([config("current", 1, 2)])
+
+    results = validate_batch(
+        [
+            (payload("voltage", 11), voltage),
+            (payload("voltage", 11), None),
+            (payload("current", 0.5, channel="ch2"), current),
+            (payload("current", 1.5), current),
+        ]
+    )
+
+    assert [len(r) for r in results] == [1, 0, 1, 0]
+    assert results[0][0].to_dict() == {
+        "unit": "voltage",
+        "channel": "ch1",
+        "value": 11.0,
+        "limit_type": "max",
+        "limit_value": 10.0,
+        "threshold": 2.0,
+        "timestamp": "t",
+    }
+    assert (results[2][0].channel, results[2][0].limit_type) == ("ch2", "min")
+
+
+def test_any_channel_name_is_validated():
+    configs = [config("voltage", 0, 10, id="1"), config("voltage", 5, 100, id="2")]
+
+    violations = validate_measurements(
+        {
+            "measurements": {
+                "voltage": {
+                    "phase_a": [{"value": 50, "time": "t1"}],
+                    "ch1": [{"value": 1, "time": "t2"}],
+                }
+            }
+        },
+        configs,
+    )
+
+    assert sorted((v.channel, v.limit_type, v.limit_value) for v in violations) == [
+        ("ch1", "min", 5.0),
+        ("phase_a", "max", 10.0),
+    ]
+
+
+def test_invalid_values_are_ignored():
+    rules = CompiledRules([config("voltage", 0, 10)])
+    measurements = {
+        "measurements": {
+            "voltage": {
+                "ch1": [{"value": "n/a"}, {"value": None}, "bad"],
+                "ch2": "not a list",
+            }
+        }
+    }
+
+    assert validate_batch([(measurements, rules)]) == [[]]
@@ -0,0 +1,103 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.redis import query_cache
+from app.settings import settings
+
+WIDTH = 60_000
+# Fixed clock: buckets ending before NOW - grace are closed
+NOW = 100 * WIDTH + settings.QUERY_CACHE_GRACE_SECONDS * 1000
+
+
+class FakeStore:
+    def __init__(self, buckets=None, fail_reads=False):
+        self.buckets = dict(buckets or {})
+        self.fail_reads = fail_reads
+        self.stored = {}
+
+    async def read(self, key, buckets, width_ms):
+        if self.fail_reads:
+            raise ConnectionError("redis down")
+        return {b: self.buckets[b] for b in buckets if b in self.buckets}
+
+    async def store(self, key, rows_by_bucket, width_ms):
+        self.stored.update(rows_by_bucket)
+
+
+@pytest.fixture
+def store():
+    return FakeStore()
+
+
+@pytest.fixture(autouse=True)
+def patched(store):
+    with (
+        mock.patch.object(query_cache, "_read_buckets", side_effect=store.read),
+        mock.patch.object(query_cache, "_store_buckets", side_effect=store.store),
+        mock.patch.object(query_cache.time, "time", return_value=NOW / 1000),
+    ):
+        yield
+
+
+def computer(rows):
+    calls = []
+
+    async def compute(from_ms, to_ms):
+        calls.append((from_ms, to_ms))
+        return [row for row in rows if from_ms <= row["bucket"] < to_ms]
+
+    return compute, calls
+
+
+def read(start_ms, end_ms, compute):
+    return asyncio.run(
+        query_cache.read_through(
+            "key", start_ms, end_ms, WIDTH, compute, lambda row: row["bucket"]
+        )
+    )
+
+
+def test_closed_buckets_are_cached_and_open_ones_are_not(store):
+    rows = [{"bucket": b * WIDTH, "value": b} for b in (97, 99, 100)]
+    compute, calls = computer(rows)
+
+    result = read(97 * WIDTH, 101 * WIDTH, compute)
+
+    assert result == rows
+    assert calls == [(97 * WIDTH, 101 * WIDTH)]
+    # 100 has not ended yet; 98 had no rows and is cached empty
+    assert store.stored == {
+        97 * WIDTH: [rows[0]],
+        98 * WIDTH: [],
+        99 * WIDTH: [rows[1]],
+    }
+
+
+def test_only_missing_buckets_are_computed(store):
+    store.buckets = {97 * WIDTH: [{"bucket": 97 * WIDTH, "value": "cached"}]}
+    compute, calls = computer([{"bucket": 98 * WIDTH, "value": "fresh"}])
+
+    result = read(97 * WIDTH + 1, 99 * WIDTH, compute)
+
+    assert [row["value"] for row in result] == ["cached", "fresh"]
+    assert calls == [(98 * WIDTH, 99 * WIDTH)]
+    assert list(store.stored) == [98 * WIDTH]
+
+
+def test_redis_errors_fall_back_to_computing(store):
+    store.fail_reads = True
+    compute, calls = computer([{"bucket": 97 * WIDTH, "value": 1}])
+
+    result = read(97 * WIDTH, 98 * WIDTH, compute)
+
+    assert result == [{"bucket": 97 * WIDTH, "value": 1}]
+    assert calls == [(97 * WIDTH, 98 * WIDTH)]
+
+
+def test_rows_outside_the_requested_buckets_are_dropped():
+    async def wide(from_ms, to_ms):
+        return [{"bucket": 96 * WIDTH}, {"bucket": 97 * WIDTH}]
+
+    assert read(97 * WIDTH, 98 * WIDTH, wide) == [{"bucket": 97 * WIDTH}]
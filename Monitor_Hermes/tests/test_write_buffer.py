@@ -0,0 +1,202 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from bson import ObjectId
+
+from app.persistence import write_buffer as write_buffer_module
+from app.persistence.models import MessageIn
+from app.persistence.write_buffer import WriteBuffer, WriteBufferFull
+from app.workers.redis_worker import entry_object_id
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """insert_many that can fail after writing the first `written` documents."""
+
+    def __init__(self):
+        self.docs = []
+        self.failures = []
+
+    def fail_next(self, written=0):
+        self.failures.append(written)
+
+    async def insert_many(self, docs, ordered=True):
+        if self.failures:
+            written = self.failures.pop(0)
+            self.docs.extend(docs[:written])
+            raise ConnectionError("connection reset")
+        self.docs.extend(docs)
+
+    def find(self, filter, projection=None):
+        ids = set(filter["_id"]["$in"])
+        return FakeCursor([{"_id": d["_id"]} for d in self.docs if d["_id"] in ids])
+
+
+class FakeDB:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def buffer(db):
+    buffer = WriteBuffer(max_batch=100, flush_interval=1, max_pending=1000)
+    buffer.db = db
+    buffer.ack_handler = mock.AsyncMock()
+    return buffer
+
+
+@pytest.fixture(autouse=True)
+def rollups():
+    with (
+        mock.patch.object(write_buffer_module, "update_snapshots", mock.AsyncMock()),
+        mock.patch.object(
+            write_buffer_module, "update_rollups", mock.AsyncMock()
+        ) as update_rollups,
+    ):
+        yield update_rollups
+
+
+def message():
+    return MessageIn(tenant_id="t1", dev_eui="d1", payload={})
+
+
+def points(count):
+    ts = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "ts": ts + timedelta(seconds=i),
+            "meta": {"d": "d1", "t": "t1", "m": "voltage", "c": "ch1"},
+            "val": float(i),
+        }
+        for i in range(count)
+    ]
+
+
+def test_entry_is_acked_once_message_and_points_are_stored(db, buffer):
+    db.measurements_history.fail_next()
+
+    async def run():
+        await buffer.add_message(message(), ack_id="1-0", points=points(2))
+        await buffer.flush()
+        assert buffer.ack_handler.await_count == 0
+        assert buffer.pending_ack("1-0")
+
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    buffer.ack_handler.assert_awaited_once_with(["1-0"])
+    assert not buffer.pending_ack("1-0")
+    assert len(db.messages.docs) == 1
+    assert len(db.measurements_history.docs) == 2
+
+
+def test_failed_message_insert_keeps_entry_pending(db, buffer):
+    db.messages.fail_next()
+
+    async def run():
+        await buffer.add_message(message(), ack_id="1-0", points=points(1))
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    buffer.ack_handler.assert_not_awaited()
+    assert buffer.pending_ack("1-0")
+    assert buffer.pending == 1
+
+
+def test_retried_points_are_not_stored_or_rolled_up_twice(db, buffer, rollups):
+    db.measurements_history.fail_next(written=1)
+
+    async def run():
+        await buffer.add_message(message(), ack_id="1-0", points=points(3))
+        await buffer.flush()
+        rollups.assert_not_awaited()
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    stored = [doc["_id"] for doc in db.measurements_history.docs]
+    assert len(stored) == 3
+    assert len(set(stored)) == 3
+    rollups.assert_awaited_once()
+    assert len(rollups.await_args.args[1]) == 3
+    buffer.ack_handler.assert_awaited_once_with(["1-0"])
+
+
+def test_message_id_can_be_given(db, buffer):
+    doc_id = ObjectId()
+
+    async def run():
+        assert await buffer.add_message(message(), doc_id=doc_id) == str(doc_id)
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    assert db.messages.docs[0]["_id"] == doc_id
+
+
+def test_redelivered_points_already_stored_are_not_rolled_up(db, buffer, rollups):
+    first, second = points(2)
+    first["_id"], second["_id"] = ObjectId(), ObjectId()
+    db.measurements_history.docs.append(dict(first))
+
+    async def run():
+        await buffer.add_message(
+            message(), ack_id="1-0", points=[first, second], redelivered=True
+        )
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    assert [doc["_id"] for doc in db.measurements_history.docs] == [
+        first["_id"],
+        second["_id"],
+    ]
+    assert [p["_id"] for p in rollups.await_args.args[1]] == [second["_id"]]
+    buffer.ack_handler.assert_awaited_once_with(["1-0"])
+
+
+def test_entry_ids_are_deterministic():
+    assert entry_object_id("1700000000123-5") == entry_object_id("1700000000123-5")
+    ids = {entry_object_id("1700000000123-5", i) for i in range(3)}
+    ids.add(entry_object_id("1700000000123-6"))
+    assert len(ids) == 4
+
+
+def test_backpressure_gives_up_when_nothing_drains(db):
+    buffer = WriteBuffer(
+        max_batch=1, flush_interval=0.01, max_pending=1, backpressure_timeout=0.05
+    )
+    buffer.db = db
+    db.messages.failures = [0] * 100
+
+    with pytest.raises(WriteBufferFull):
+        asyncio.run(buffer.add_message(message()))
+    assert buffer.pending == 1